@@ -1,17 +1,23 @@
-from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
-from cassandra.cluster import Cluster
-from cassandra.query import dict_factory, SimpleStatement
+from cassandra.cluster import Cluster, OperationTimedOut
+from cassandra.query import dict_factory, tuple_factory, SimpleStatement, UNSET_VALUE
+from cassandra.query import PreparedStatement, BoundStatement, FETCH_SIZE_UNSET
 from typing import List, Optional
 from cassandra.policies import DCAwareRoundRobinPolicy, TokenAwarePolicy, WhiteListRoundRobinPolicy
+from cassandra.policies import RetryPolicy, FallthroughRetryPolicy, ConstantSpeculativeExecutionPolicy
+from cassandra.policies import WrapperPolicy
+from cassandra.cluster import ExecutionProfile, EXEC_PROFILE_DEFAULT
 from cassandra.query import BatchStatement, BatchType
+from cassandra.concurrent import execute_concurrent_with_args
 from fastapi import Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from datetime import date, datetime
 from uuid import UUID
 from pydantic import BaseModel
-from cassandra import ConsistencyLevel, WriteTimeout
-from cassandra.util import Date as CassandraDate
+from cassandra import ConsistencyLevel, WriteTimeout, InvalidRequest
+from cassandra.protocol import ProtocolException
+from cassandra.util import Date as CassandraDate, uuid_from_time
 import uuid
 import xml.etree.ElementTree as ET
 import time
@@ -21,19 +27,173 @@ import json
 import traceback
 import threading
 import queue
+import os
+import math
+import heapq
+import bisect
+import operator
+from collections import OrderedDict, namedtuple, deque, Counter
+import sys
+import asyncio
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+import zlib
+import hashlib
+import socket
+import contextvars
+import multiprocessing
+import pickle
+import re
+import base64
+import io
+import csv
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import msgpack  # optional, enables the columnar /insert-event/ format
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard  # optional, enables zstd Content-Encoding
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow  # optional, enables Parquet exports
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+
+
+
+alert_queue = queue.Queue()  # (AlertRecord, is_new), written by alert_worker through write_alerts
+alert_worker_stop = threading.Event()
+alert_worker_thread = None
+
+# One alert, laid out in prepared_alert_id_query bind order. alerts_by_status binds the
+# same columns in the same order, so one tuple is built per alert and reused for both
+# tables, the account index and the hot window.
+AlertRecord = namedtuple("AlertRecord", [
+    "alert_id", "region", "tenant", "score", "account_number", "alert_date",
+    "alert_description", "alert_type", "amount", "create_timestamp",
+    "first_name", "last_name", "reviewed", "severity", "status",
+    "transaction_key", "transaction_timestamp"
+])
+
+
+def alert_record_from_row(row, **changes):
+    # Rows read back from Cassandra carry alert_date as a cassandra.util.Date; records
+    # always hold a datetime.date, as the scorer builds them
+    record = AlertRecord._make(row.get(field) for field in AlertRecord._fields)
+    if isinstance(record.alert_date, CassandraDate):
+        changes.setdefault("alert_date", record.alert_date.date())
+    return record._replace(**changes) if changes else record
+
+
+# Shared description strings, keyed by (rule1_triggered, rule2_triggered)
+RULE1_DESCRIPTION = "Rule1 triggered: amount threshold exceeded"
+RULE2_DESCRIPTION = "Rule2 triggered: field2 = fraud"
+ALERT_DESCRIPTIONS = {
+    (True, False): RULE1_DESCRIPTION,
+    (False, True): RULE2_DESCRIPTION,
+    (True, True): f"{RULE1_DESCRIPTION}, {RULE2_DESCRIPTION}",
+}
+
+
+def alert_batch(items, unbucketed=frozenset()):
+    # One UNLOGGED batch for (record, is_new) items; returns it with the items it holds.
+    # unbucketed: ids of alerts whose status row is in alerts_by_status on a sharded day,
+    # updated in place (see unbucketed_alerts)
+    batch = BatchStatement(
+        batch_type=BatchType.UNLOGGED,
+        consistency_level=ConsistencyLevel.ONE
+    )
+    added = []
+    for record, is_new in items:
+        try:
+            statements = [
+                (prepared_alert_id_query, record),
+                # Only claim a bucket count for today onwards: past days may already hold
+                # unbucketed rows (late transactions, re-scored alerts)
+                alert_status_insert(record, create_buckets=record.alert_date >= datetime.datetime.utcnow().date(),
+                                    bucket_count=1 if record.alert_id in unbucketed else None),
+                (prepared_alert_account_index, (
+                    record.account_number, record.create_timestamp, record.alert_id,
+                    record.alert_date, record.transaction_key
+                )),
+            ]
+        except Exception as e:
+            print(f"❌ Skipped bad alert: {e}")
+            continue
+        if is_new:
+            # Tells the other workers' hot windows to load it (see status_change_worker)
+            statements.append(log_status_change(record.alert_id, record.status))
+        for statement, params in statements:
+            batch.add(statement, params)
+        added.append((record, is_new))
+    return batch, added
+
+
+def write_alerts(items, full, unbucketed=frozenset()):
+    # Writes (record, is_new) items in rounds of batches sized by alert_write_limits (at
+    # most its concurrency batches in flight), retrying the batches that hit overload
+    # errors after a jittered backoff; returns the written items
+    MAX_RETRIES = 3
 
-
-
-
-
-alert_queue = queue.Queue()
+    written = []
+    pending = items
+    for attempt in range(1, MAX_RETRIES + 1):
+        retry = []
+        position = 0
+        while position < len(pending):
+            batch_size, concurrency = alert_write_limits.limits()
+            round_items = pending[position:position + batch_size * concurrency]
+            position += len(round_items)
+            batches = [alert_batch(round_items[i:i + batch_size], unbucketed)
+                       for i in range(0, len(round_items), batch_size)]
+            errors = execute_ingest_batches([batch for batch, _ in batches], alert_write_limits,
+                                            full and len(round_items) == batch_size * concurrency)
+            for (_, batch_items), error in zip(batches, errors):
+                if error is None:
+                    written.extend(batch_items)
+                elif is_overload_error(error):
+                    retry.extend(batch_items)
+                else:
+                    print(f"❌ Batch insert failed: {error}")
+        pending = retry
+        if not pending:
+            break
+        if attempt == MAX_RETRIES:
+            print(f"❌ Dropped {len(pending)} alerts after {MAX_RETRIES} write timeouts")
+            break
+        # Retried at the controller's reduced batch size, after a jittered backoff
+        print(f"⚠️ Retry {attempt}/{MAX_RETRIES} on {len(pending)} alerts")
+        time.sleep(random.uniform(0, min(2.0, 0.1 * 2 ** attempt)))
+
+    if written:
+        print(f"✅ Inserted {len(written)} alerts")
+        for record, _ in written:
+            recent_alerts.add(record)
+
+    new_alerts = [record for record, is_new in written if is_new]
+    if new_alerts:
+        alert_sketches.add_alerts(new_alerts)
+        try:
+            record_alert_rollups(new_alerts)
+        except Exception as e:
+            # Counters are not idempotent, so a failed update is not retried
+            print(f"⚠️ Alert rollup update failed for {len(new_alerts)} alerts: {e}")
+    return written
 
 
 def alert_worker():
-    BATCH_LIMIT = 20
-    MAX_RETRIES = 3
-
-    while True:
+    # On shutdown keep going until the queue is drained
+    while not (alert_worker_stop.is_set() and alert_queue.empty()):
         batch_data = []
 
         try:
@@ -41,87 +201,524 @@ def alert_worker():
         except queue.Empty:
             continue
 
-        while len(batch_data) < BATCH_LIMIT:
+        # Take up to one round: concurrency batches of batch_size alerts, as currently
+        # allowed by the alert write controller
+        batch_size, concurrency = alert_write_limits.limits()
+        while len(batch_data) < batch_size * concurrency:
             try:
                 batch_data.append(alert_queue.get_nowait())
             except queue.Empty:
                 break
+        write_alerts(batch_data, len(batch_data) >= batch_size * concurrency)
+
+
+def start_alert_worker():
+    global alert_worker_thread
+    alert_worker_stop.clear()
+    alert_worker_thread = threading.Thread(target=alert_worker, name="alert-worker", daemon=True)
+    alert_worker_thread.start()
+
+
+def stop_alert_worker(timeout):
+    alert_worker_stop.set()
+    if alert_worker_thread is not None:
+        alert_worker_thread.join(timeout)
+        if alert_worker_thread.is_alive():
+            print(f"⚠️ Alert worker did not drain in {timeout}s, {alert_queue.qsize()} alerts dropped")
+
+
+router = APIRouter()
+
+# Execution profiles
+# Ingest batches, interactive lookups (alert detail, triage lists) and analytics scans
+# (dashboard refreshes, /browse) each get their own timeout, fetch size, retry policy and
+# in-flight budget, so a full-table scan can't queue ahead of an alert lookup.
+PROFILE_INGEST = "ingest"
+PROFILE_INTERACTIVE = "interactive"
+PROFILE_ANALYTICS = "analytics"
+
+PROFILE_SETTINGS = {
+    PROFILE_INGEST: {
+        "request_timeout": float(os.environ.get("INGEST_TIMEOUT", "10.0")),
+        "fetch_size": 100,
+        "max_in_flight": int(os.environ.get("INGEST_MAX_IN_FLIGHT", "256")),
+        "retry_policy": RetryPolicy(),
+        "speculative_delay": None,  # writes are not speculated
+    },
+    PROFILE_INTERACTIVE: {
+        "request_timeout": float(os.environ.get("INTERACTIVE_TIMEOUT", "2.0")),
+        "fetch_size": 1000,
+        "max_in_flight": int(os.environ.get("INTERACTIVE_MAX_IN_FLIGHT", "512")),
+        "retry_policy": RetryPolicy(),
+        "speculative_delay": float(os.environ.get("INTERACTIVE_SPECULATIVE_DELAY", "0.05")),
+    },
+    PROFILE_ANALYTICS: {
+        "request_timeout": float(os.environ.get("ANALYTICS_TIMEOUT", "60.0")),
+        "fetch_size": 5000,
+        "max_in_flight": int(os.environ.get("ANALYTICS_MAX_IN_FLIGHT", "8")),
+        "retry_policy": FallthroughRetryPolicy(),  # a failed scan is retried by the caller, not the driver
+        "speculative_delay": None,
+    },
+}
+
+
+# Hosts the health prober currently finds slow (see probe_cluster); with
+# HEALTH_DEMOTE_SLOW_HOSTS set, query plans try them only after every other host.
+HEALTH_DEMOTE_SLOW_HOSTS = os.environ.get("HEALTH_DEMOTE_SLOW_HOSTS", "0") == "1"
+slow_hosts = frozenset()
+
+
+class SlowHostDemotionPolicy(WrapperPolicy):
+    # Keeps the child's order (token-aware replicas first) but moves slow hosts to the end
+
+    def make_query_plan(self, working_keyspace=None, query=None):
+        demoted = []
+        for host in self._child_policy.make_query_plan(working_keyspace, query):
+            if host in slow_hosts:
+                demoted.append(host)
+            else:
+                yield host
+        yield from demoted
+
+
+def make_load_balancing_policy():
+    if HEALTH_DEMOTE_SLOW_HOSTS:
+        return SlowHostDemotionPolicy(TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc='datacenter1')))
+    return TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc='datacenter1'))
+    #return WhiteListRoundRobinPolicy(['192.168.1.103'])
+
+
+# Each profile also exists as "<profile>:tuples", identical but for a tuple_factory row
+# factory, for hot read paths that index rows by position (see row_serializer)
+TUPLE_PROFILE_SUFFIX = ":tuples"
+
+
+def build_execution_profiles():
+    profiles = {
+        EXEC_PROFILE_DEFAULT: ExecutionProfile(
+            load_balancing_policy=make_load_balancing_policy(),
+            consistency_level=ConsistencyLevel.ONE,
+            row_factory=dict_factory,
+        )
+    }
+    for name, settings in PROFILE_SETTINGS.items():
+        speculative_policy = None
+        if settings["speculative_delay"]:
+            # Only applies to statements marked is_idempotent (see profile_statement)
+            speculative_policy = ConstantSpeculativeExecutionPolicy(delay=settings["speculative_delay"], max_attempts=2)
+
+        for suffix, row_factory in (("", dict_factory), (TUPLE_PROFILE_SUFFIX, tuple_factory)):
+            profiles[name + suffix] = ExecutionProfile(
+                load_balancing_policy=make_load_balancing_policy(),
+                retry_policy=settings["retry_policy"],
+                consistency_level=ConsistencyLevel.ONE,
+                request_timeout=settings["request_timeout"],
+                row_factory=row_factory,
+                speculative_execution_policy=speculative_policy,
+            )
+    return profiles
+
+
+profile_slots = {
+    name: threading.BoundedSemaphore(settings["max_in_flight"])
+    for name, settings in PROFILE_SETTINGS.items()
+}
+
+
+@contextmanager
+def in_flight(profile):
+    # Hold one of the profile's in-flight slots; shed the request if none frees up in time
+    settings = PROFILE_SETTINGS[profile]
+    slot = profile_slots[profile]
+    if not slot.acquire(timeout=settings["request_timeout"]):
+        raise HTTPException(status_code=503, detail=f"Too many in-flight {profile} queries, try again later")
+    try:
+        yield
+    finally:
+        slot.release()
+
+
+def profile_statement(query, profile, idempotent=True, parameters=None):
+    # Give a statement the profile's fetch size; reads are idempotent and therefore
+    # eligible for speculative execution on the interactive profile. Raw CQL is wrapped
+    # and a prepared statement is bound to parameters (the shared PreparedStatement is
+    # left alone); a bound statement keeps a fetch size that was set explicitly.
+    fetch_size = PROFILE_SETTINGS[profile]["fetch_size"]
+    if isinstance(query, str):
+        return SimpleStatement(query, fetch_size=fetch_size, is_idempotent=idempotent)
+    if isinstance(query, PreparedStatement):
+        query = query.bind(parameters or ())
+    if isinstance(query, BoundStatement):
+        query.is_idempotent = idempotent
+        if query.fetch_size is FETCH_SIZE_UNSET:
+            query.fetch_size = fetch_size
+    return query
+
+
+# Sampled query tracing and slow-query log
+# execute_with_profile, iter_pages and the asyncio bridge request a driver trace for
+# QUERY_TRACE_SAMPLE_RATE of their statements, and for the next SLOW_QUERY_TRACE_NEXT
+# executions of a statement that took longer than SLOW_QUERY_MS (a trace can only be
+# requested up front). Traced and slow executions go to a bounded in-memory log, tagged
+# with the route being served (RouteContextMiddleware) or the background thread. Traces
+# are read from system_traces on a small pool once Cassandra has written them, and
+# summarised into per-replica timings and live/tombstone cell counts. /slow-queries ranks
+# the logged statements by their slowest execution.
+QUERY_TRACE_SAMPLE_RATE = float(os.environ.get("QUERY_TRACE_SAMPLE_RATE", "0.001"))
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_TRACE_NEXT = 3
+SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE", "1000"))
+QUERY_TRACE_MAX_WAIT = 2.0  # seconds to wait for Cassandra to finish writing a trace
+TRACE_CELLS_PATTERN = re.compile(r"Read (\d+) live rows? and (\d+) tombstone cells?")
+
+current_request_scope = contextvars.ContextVar("current_request_scope", default=None)
+
+
+class RouteContextMiddleware:
+    # Tags the request's queries with its route for the slow-query log. It holds on to the
+    # scope, which the router fills in with the matched route once the request reaches it;
+    # added innermost, so it sees the scope the router gets.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        token = current_request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request_scope.reset(token)
+
+
+def current_route():
+    # "GET /events/{user_id}": the route template, so every user's requests share a route
+    scope = current_request_scope.get()
+    if scope is None:
+        return f"thread {threading.current_thread().name}"
+    return f"{scope.get('method', 'WS')} {getattr(scope.get('route'), 'path', scope['path'])}"
+
 
-        batch = BatchStatement(
-            batch_type=BatchType.UNLOGGED,
-            consistency_level=ConsistencyLevel.ONE
+def statement_text(statement):
+    if isinstance(statement, BatchStatement):
+        # A batch holds its prepared statements as (True, query_id, values)
+        queries = dict.fromkeys(
+            statement_text(prepared_texts.get(query, f"prepared {query.hex()}") if is_prepared else query)
+            for is_prepared, query, _ in statement._statements_and_parameters
         )
+        return f"BATCH ({len(statement._statements_and_parameters)}): " + "; ".join(queries)
+    query = getattr(statement, "prepared_statement", statement)
+    return " ".join(getattr(query, "query_string", str(query)).split())
+
+
+def summarize_trace(trace):
+    replicas = {}
+    live = tombstones = 0
+    for event in trace.events:
+        source = str(event.source)
+        elapsed_us = event.source_elapsed.total_seconds() * 1e6 if event.source_elapsed else 0
+        replicas[source] = max(replicas.get(source, 0), elapsed_us)
+        cells = TRACE_CELLS_PATTERN.search(event.description or "")
+        if cells:
+            live += int(cells.group(1))
+            tombstones += int(cells.group(2))
+    return {
+        "trace_id": str(trace.trace_id),
+        "coordinator": str(trace.coordinator),
+        "duration_us": trace.duration.total_seconds() * 1e6 if trace.duration else None,
+        "replica_elapsed_us": replicas,
+        "live_rows_read": live,
+        "tombstone_cells_read": tombstones,
+        "events": [
+            {
+                "source": str(event.source),
+                "elapsed_us": event.source_elapsed.total_seconds() * 1e6 if event.source_elapsed else None,
+                "thread": event.thread_name,
+                "description": event.description,
+            }
+            for event in trace.events
+        ],
+    }
 
-        for alert_fields, insert_time in batch_data:
-            try:
-                batch.add(prepared_alert_id_query, (
-                    alert_fields["alert_id"], alert_fields["region"], alert_fields["tenant"],
-                    alert_fields["score"], alert_fields["account_number"], alert_fields["alert_date"],
-                    alert_fields["alert_description"], alert_fields["alert_type"], alert_fields["amount"],
-                    insert_time, alert_fields["first_name"], alert_fields["last_name"], False,
-                    alert_fields["severity"], "new", alert_fields["transaction_key"], insert_time
-                ))
-
-                batch.add(prepared_alert_status_query, (
-                    "new", alert_fields["alert_date"], insert_time, alert_fields["alert_id"],
-                    alert_fields["region"], alert_fields["tenant"], alert_fields["score"],
-                    alert_fields["account_number"], alert_fields["alert_description"],
-                    alert_fields["alert_type"], alert_fields["amount"], alert_fields["first_name"],
-                    alert_fields["last_name"], False, alert_fields["severity"],
-                    alert_fields["transaction_key"], insert_time
-                ))
 
-            except Exception as e:
-                print(f"❌ Skipped bad alert: {e}")
-                continue
+class QueryTracer:
+    def __init__(self, sample_rate, slow_ms, log_size):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.log = deque(maxlen=log_size)
+        self.armed = {}  # statement text -> traced executions still to come
+        self.traced = 0
+        self.trace_failures = 0
+        self.lock = threading.Lock()
+        self.fetcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="query-traces")
+
+    def should_trace(self, statement):
+        if random.random() < self.sample_rate:
+            return True
+        if not self.armed:
+            return False
+        text = statement_text(statement)
+        with self.lock:
+            remaining = self.armed.get(text)
+            if not remaining:
+                return False
+            if remaining == 1:
+                del self.armed[text]
+            else:
+                self.armed[text] = remaining - 1
+        return True
+
+    def observe(self, statement, profile, started, response_future, traced, rows):
+        latency_ms = (time.perf_counter() - started) * 1000
+        slow = latency_ms >= self.slow_ms
+        if not (traced or slow):
+            return
+        text = statement_text(statement)
+        entry = {
+            "statement": text,
+            "route": current_route(),
+            "profile": profile,
+            "latency_ms": round(latency_ms, 3),
+            "rows": rows,
+            "coordinator": str(response_future.coordinator_host) if response_future.coordinator_host else None,
+            "slow": slow,
+            "at": datetime.datetime.utcnow(),
+            "trace": None,
+        }
+        with self.lock:
+            self.log.append(entry)
+            if slow and not traced and text not in self.armed:
+                self.armed[text] = SLOW_QUERY_TRACE_NEXT
+        if traced:
+            self.fetcher.submit(self._fetch_trace, entry, response_future)
+
+    def _fetch_trace(self, entry, response_future):
+        try:
+            trace = response_future.get_query_trace(max_wait=QUERY_TRACE_MAX_WAIT)
+            entry["trace"] = summarize_trace(trace)
+            with self.lock:
+                self.traced += 1
+        except Exception as e:
+            entry["trace"] = {"error": f"{type(e).__name__}: {e}"}
+            with self.lock:
+                self.trace_failures += 1
+
+    def slowest(self, limit, route=None):
+        with self.lock:
+            entries = [entry for entry in self.log if route is None or entry["route"] == route]
+        by_statement = {}
+        for entry in entries:
+            by_statement.setdefault(entry["statement"], []).append(entry)
+
+        statements = []
+        for text, logged in by_statement.items():
+            latencies = sorted(entry["latency_ms"] for entry in logged)
+            slowest = max(logged, key=operator.itemgetter("latency_ms"))
+            traced = [entry for entry in logged if entry["trace"] and "error" not in entry["trace"]]
+            statements.append({
+                "statement": text,
+                "count": len(logged),
+                "max_ms": latencies[-1],
+                "median_ms": latencies[len(latencies) // 2],
+                "routes": dict(Counter(entry["route"] for entry in logged)),
+                "slowest": slowest,
+                "slowest_traced": max(traced, key=operator.itemgetter("latency_ms")) if traced else None,
+            })
+        statements.sort(key=operator.itemgetter("max_ms"), reverse=True)
+        return statements[:limit]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "logged": len(self.log),
+                "armed_statements": len(self.armed),
+                "traces_fetched": self.traced,
+                "trace_failures": self.trace_failures,
+                "sample_rate": self.sample_rate,
+                "slow_query_ms": self.slow_ms,
+            }
+
+
+query_tracer = QueryTracer(QUERY_TRACE_SAMPLE_RATE, SLOW_QUERY_MS, SLOW_QUERY_LOG_SIZE)
+
+
+def execute_with_profile(query, parameters=None, profile=PROFILE_INTERACTIVE, idempotent=True):
+    statement = profile_statement(query, profile, idempotent, parameters)
+    trace = query_tracer.should_trace(statement)
+    started = time.perf_counter()
+    with in_flight(profile):
+        future = session.execute_async(statement, parameters, trace=trace, execution_profile=profile)
+        result = future.result()
+    query_tracer.observe(statement, profile, started, future, trace, len(result.current_rows))
+    return result
+
+
+def iter_pages(query, parameters=None, paging_state=None, profile=PROFILE_ANALYTICS, fetch_size=None):
+    # Yield (rows, paging_state) one page at a time, holding an in-flight slot only while
+    # a page is fetched; paging_state is None after the last page
+    statement = profile_statement(query, profile, parameters=parameters)
+    if fetch_size:
+        statement.fetch_size = fetch_size
+    while True:
+        trace = query_tracer.should_trace(statement)
+        started = time.perf_counter()
+        with in_flight(profile):
+            future = session.execute_async(statement, parameters, trace=trace, paging_state=paging_state,
+                                           execution_profile=profile)
+            result = future.result()
+        query_tracer.observe(statement, profile, started, future, trace, len(result.current_rows))
+        paging_state = result.paging_state
+        yield result.current_rows, paging_state
+        if paging_state is None:
+            return
 
-        for attempt in range(1, MAX_RETRIES + 1):
-            try:
-                session.execute(batch)
-                print(f"✅ Inserted {len(batch_data)} alerts")
-                break
-            except WriteTimeout:
-                print(f"⚠️ Retry {attempt}/{MAX_RETRIES} on batch of {len(batch_data)} alerts")
-                time.sleep(0.2 * attempt)
-            except Exception as e:
-                print(f"❌ Batch insert failed: {e}")
-                break
 
+# Asyncio bridge for driver futures
+# Async handlers await the ResponseFuture of session.execute_async instead of blocking the
+# event loop in session.execute, so read concurrency is bounded by the profile's
+# max_in_flight and the driver's connections, not by a thread pool. The driver calls back
+# on its IO thread and the result is handed to the loop with call_soon_threadsafe. When
+# the awaiting task is cancelled (the client went away) the callbacks are dropped and no
+# further pages are requested; a request already on the wire completes or times out in
+# the driver.
+ASYNC_SLOT_POLL_MAX = 0.05  # seconds between attempts while waiting for an in-flight slot
+
+
+@asynccontextmanager
+async def async_in_flight(profile):
+    # in_flight for coroutines. Takes a slot from the same profile_slots as the threaded
+    # paths, so max_in_flight is one budget per process; while none is free it polls
+    # instead of blocking the event loop or holding a thread
+    settings = PROFILE_SETTINGS[profile]
+    slot = profile_slots[profile]
+    deadline = time.monotonic() + settings["request_timeout"]
+    delay = 0.001
+    while not slot.acquire(blocking=False):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise HTTPException(status_code=503, detail=f"Too many in-flight {profile} queries, try again later")
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, ASYNC_SLOT_POLL_MAX)
+    try:
+        yield
+    finally:
+        slot.release()
 
-# Launch worker at startup
-threading.Thread(target=alert_worker, daemon=True).start()
 
+async def await_response(response_future):
+    # Resolves with the ResultSet of the page response_future fetched. Only current_rows,
+    # one() and paging_state are safe on it: iterating past the page would block.
+    loop = asyncio.get_running_loop()
+    result = loop.create_future()
 
+    def settle(error):
+        if result.done():  # the awaiting task was cancelled
+            return
+        if error is None:
+            result.set_result(response_future.result())
+        else:
+            result.set_exception(error)
 
+    response_future.add_callbacks(
+        lambda _: loop.call_soon_threadsafe(settle, None),
+        lambda error: loop.call_soon_threadsafe(settle, error),
+    )
+    try:
+        return await result
+    except asyncio.CancelledError:
+        response_future.clear_callbacks()
+        raise
+
+
+async def execute_async_with_profile(query, parameters=None, profile=PROFILE_INTERACTIVE, idempotent=True,
+                                     paging_state=None, tuples=False):
+    statement = profile_statement(query, profile, idempotent, parameters)
+    trace = query_tracer.should_trace(statement)
+    async with async_in_flight(profile):
+        started = time.perf_counter()
+        future = session.execute_async(statement, parameters, trace=trace, paging_state=paging_state,
+                                       execution_profile=profile + TUPLE_PROFILE_SUFFIX if tuples else profile)
+        result = await await_response(future)
+    query_tracer.observe(statement, profile, started, future, trace, len(result.current_rows))
+    return result
+
+
+async def aiter_pages(query, parameters=None, paging_state=None, profile=PROFILE_ANALYTICS, fetch_size=None,
+                      idempotent=True, tuples=False):
+    # iter_pages for coroutines, holding an in-flight slot only while a page is fetched
+    statement = profile_statement(query, profile, idempotent, parameters)
+    if fetch_size:
+        statement.fetch_size = fetch_size
+    while True:
+        result = await execute_async_with_profile(statement, parameters, profile, paging_state=paging_state,
+                                                  tuples=tuples)
+        paging_state = result.paging_state
+        yield result.current_rows, paging_state
+        if paging_state is None:
+            return
 
-app = FastAPI()
 
-app.add_middleware(
-    CORSMiddleware,
-    #allow_origins=["*"],  # Adjust in production
-    #allow_origins=["192.168.1.103"],
-    allow_origins=["192.168.1.103, https://halibut-more-tiger.ngrok-free.app"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def fetch_all(query, parameters=None, profile=PROFILE_INTERACTIVE, idempotent=True, tuples=False):
+    rows = []
+    async for page, _ in aiter_pages(query, parameters, profile=profile, idempotent=idempotent, tuples=tuples):
+        rows.extend(page)
+    return rows
 
-cluster = Cluster(
-    #contact_points=['192.168.1.103', '192.168.1.120'],
-    #contact_points=['192.168.1.120'],
-    contact_points=['192.168.1.103'],
-    load_balancing_policy=TokenAwarePolicy(
-        DCAwareRoundRobinPolicy(local_dc='datacenter1')
-    ),
-    #load_balancing_policy=WhiteListRoundRobinPolicy(['192.168.1.103']),
-    connect_timeout=5.0,
-    idle_heartbeat_interval=30,
-)
 
-#session = cluster.connect('eventlog')
-session = cluster.connect()
-session.default_consistency_level = ConsistencyLevel.ONE
-session.row_factory = dict_factory
+# Tuple rows
+# Wide reads (/browse, /events/*) skip dict_factory: their statements are prepared once
+# per query text, the column positions come from the prepared result metadata, and rows
+# arrive as plain tuples through the ":tuples" profiles. row_serializer builds the
+# response dict straight from those positions, so no per-row dict is built in between.
+prepared_reads = {}  # query text -> (PreparedStatement, {column: position})
+prepared_texts = {}  # query_id -> CQL of every statement prepared here, to name batch members
+
+
+async def prepare_read(query):
+    entry = prepared_reads.get(query)
+    if entry is None:
+        prepared = await asyncio.get_running_loop().run_in_executor(None, session.prepare, query)
+        prepared.is_idempotent = True  # reads, so speculative execution still applies
+        prepared_texts[prepared.query_id] = prepared.query_string
+        index = {column[2]: position for position, column in enumerate(prepared.result_metadata)}
+        entry = prepared_reads[query] = (prepared, index)
+    return entry
+
+
+def row_serializer(index, fields, converters):
+    # values tuple -> output dict of fields, converting the columns that have a converter
+    plan = [(field, index[field], converters.get(field)) for field in fields]
+
+    def serialize(values):
+        return {
+            field: values[position] if convert is None else convert(values[position])
+            for field, position, convert in plan
+        }
+    return serialize
+
+
+# Cluster, session and prepared statements are created per process by the app lifespan
+# (see create_app), never at import time, so the module is safe to import in every
+# worker of a multi-process server.
+cluster = None
+session = None
+
+CONTACT_POINTS = os.environ.get("CASSANDRA_CONTACT_POINTS", "192.168.1.103").split(",")
+#CONTACT_POINTS = ['192.168.1.103', '192.168.1.120']
+#CONTACT_POINTS = ['192.168.1.120']
+
+
+def connect_cluster():
+    new_cluster = Cluster(
+        contact_points=CONTACT_POINTS,
+        execution_profiles=build_execution_profiles(),
+        connect_timeout=5.0,
+        idle_heartbeat_interval=30,
+    )
+    #return new_cluster, new_cluster.connect('eventlog')
+    return new_cluster, new_cluster.connect()
 
 class StatusUpdateRequest(BaseModel):
     status: str
@@ -135,70 +732,1110 @@ class StatusUpdateRequest(BaseModel):
 #    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
 #""")
 
-prepared_transaction_query = session.prepare("""
-    INSERT INTO alerts.transactions (
-        insert_date,
-        insert_time,
-        transaction_key,
-        session_id,
-        first_name,
-        last_name,
-        account_number,
-        amount,
-
-        field_1,
-        field_2,
-        field_3,
-        field_4,
-        field_5,
-        field_6,
-        field_7,
-        field_8,
-        field_9,
-        field_10,
-        field_11,
-        field_12,
-        field_13,
-        field_14,
-        field_15,
-        field_16,
-        field_17,
-        field_18,
-        field_19,
-        field_20
-    ) VALUES (
-        ?, ?, ?, ?, ?, ?, ?, ?,
-        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+# Statements prepared at startup, keyed by the module-level name they are bound to
+PREPARED_QUERIES = {
+    "prepared_transaction_query": """
+        INSERT INTO alerts.transactions (
+            insert_date,
+            insert_time,
+            transaction_key,
+            session_id,
+            first_name,
+            last_name,
+            account_number,
+            amount,
+
+            field_1,
+            field_2,
+            field_3,
+            field_4,
+            field_5,
+            field_6,
+            field_7,
+            field_8,
+            field_9,
+            field_10,
+            field_11,
+            field_12,
+            field_13,
+            field_14,
+            field_15,
+            field_16,
+            field_17,
+            field_18,
+            field_19,
+            field_20
+        ) VALUES (
+            ?, ?, ?, ?, ?, ?, ?, ?,
+            ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+        )
+    """,
+
+    "prepared_event_query": """
+        INSERT INTO eventlog.user_events_with_100_fields (
+            user_id, event_date, event_time, event_type, metadata, session_id, xml_blob,
+            """ + ', '.join([f'field_{i}' for i in range(1, 101)]) + """
+        ) VALUES (
+            ?, ?, ?, ?, ?, ?, ?, """ + ', '.join(['?'] * 100) + """
+        )
+    """,
+
+    "prepared_alert_status_query": """
+        INSERT INTO alerts.alerts_by_status (
+            alert_id, region, tenant, score, account_number, alert_date,
+            alert_description, alert_type, amount, create_timestamp,
+            first_name, last_name, reviewed, severity, status,
+            transaction_key, transaction_timestamp
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+
+    "prepared_alert_status_bucketed_query": """
+        INSERT INTO alerts.alerts_by_status_bucketed (
+            alert_id, region, tenant, score, account_number, alert_date,
+            alert_description, alert_type, amount, create_timestamp,
+            first_name, last_name, reviewed, severity, status,
+            transaction_key, transaction_timestamp, bucket
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+
+    "prepared_alert_status_bucketed_delete": """
+        DELETE FROM alerts.alerts_by_status_bucketed
+        WHERE status = ? AND alert_date = ? AND bucket = ? AND create_timestamp = ? AND alert_id = ?
+    """,
+
+    "prepared_alert_status_bucketed_select": """
+        SELECT * FROM alerts.alerts_by_status_bucketed
+        WHERE status = ? AND alert_date = ? AND bucket = ?
+        LIMIT ?
+    """,
+
+    "prepared_alert_status_select": """
+        SELECT * FROM alerts.alerts_by_status
+        WHERE status = ? AND alert_date = ?
+        LIMIT ?
+    """,
+
+    "prepared_alert_bucket_count_select": """
+        SELECT bucket_count FROM alerts.alert_status_buckets WHERE alert_date = ?
+    """,
+
+    "prepared_alert_bucket_count_insert": """
+        INSERT INTO alerts.alert_status_buckets (alert_date, bucket_count)
+        VALUES (?, ?) IF NOT EXISTS
+    """,
+
+    "prepared_alert_account_index": """
+        INSERT INTO alerts.alerts_by_account (
+            account_number, create_timestamp, alert_id, alert_date, transaction_key
+        ) VALUES (?, ?, ?, ?, ?)
+    """,
+
+    "prepared_transaction_account_index": """
+        INSERT INTO alerts.transactions_by_account (
+            account_number, insert_time, transaction_key, insert_date
+        ) VALUES (?, ?, ?, ?)
+    """,
+
+    "prepared_alert_by_id_select": """
+        SELECT * FROM alerts.alerts_by_id WHERE alert_id = ?
+    """,
+
+    "prepared_status_change_insert": """
+        INSERT INTO alerts.alert_status_changes (minute, changed_at, alert_id, status, reviewed)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+
+    "prepared_status_change_select": """
+        SELECT alert_id, status, reviewed FROM alerts.alert_status_changes
+        WHERE minute = ? AND changed_at > minTimeuuid(?)
+    """,
+
+    "prepared_alert_account_lookup": """
+        SELECT alert_id, transaction_key FROM alerts.alerts_by_account
+        WHERE account_number = ? AND create_timestamp = ?
+    """,
+
+    "prepared_index_backfill_insert": """
+        INSERT INTO alerts.index_backfills (index_name, completed_at, rows_indexed) VALUES (?, ?, ?)
+    """,
+
+    "prepared_index_backfill_select": """
+        SELECT completed_at FROM alerts.index_backfills WHERE index_name = ?
+    """,
+
+    "prepared_rollup_minute_update": """
+        UPDATE alerts.alert_rollup_minute
+        SET alert_count = alert_count + ?, amount_cents = amount_cents + ?
+        WHERE dimension = ? AND day = ? AND bucket_start = ? AND value = ?
+    """,
+
+    "prepared_rollup_minute_select": """
+        SELECT bucket_start, value, alert_count, amount_cents FROM alerts.alert_rollup_minute
+        WHERE dimension = ? AND day = ? AND bucket_start >= ? AND bucket_start < ?
+    """,
+
+    "prepared_rollup_insert": """
+        INSERT INTO alerts.alert_rollups (
+            resolution, dimension, period, bucket_start, value, alert_count, amount
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+
+    "prepared_rollup_select": """
+        SELECT bucket_start, value, alert_count, amount FROM alerts.alert_rollups
+        WHERE resolution = ? AND dimension = ? AND period = ? AND bucket_start >= ? AND bucket_start < ?
+    """,
+
+    "prepared_sketch_snapshot_insert": """
+        INSERT INTO alerts.sketch_snapshots (kind, day, tenant, worker, sketch, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?) USING TTL ?
+    """,
+
+    "prepared_sketch_snapshot_select": """
+        SELECT tenant, worker, sketch FROM alerts.sketch_snapshots WHERE kind = ? AND day = ?
+    """,
+
+    "prepared_rescore_checkpoint_insert": """
+        INSERT INTO alerts.rescore_checkpoints (
+            job_id, range_start, range_end, paging_state, done, dry_run, rows_scanned
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+
+    "prepared_rescore_checkpoint_select": """
+        SELECT range_start, range_end, paging_state, done, dry_run, rows_scanned
+        FROM alerts.rescore_checkpoints WHERE job_id = ?
+    """,
+
+    "prepared_transaction_select": """
+        SELECT * FROM alerts.transactions
+        WHERE insert_date = ? AND insert_time = ? AND transaction_key = ?
+    """,
+
+    "prepared_alert_id_query": """
+        INSERT INTO alerts.alerts_by_id (
+            alert_id, region, tenant, score, account_number, alert_date,
+            alert_description, alert_type, amount, create_timestamp,
+            first_name, last_name, reviewed, severity, status,
+            transaction_key, transaction_timestamp
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+
+    "prepared_alerts_by_id_update": """
+        UPDATE alerts.alerts_by_id
+        SET reviewed = true, status = 'open'
+        WHERE alert_id = ?
+    """,
+
+    "prepared_alert_status_delete": """
+        DELETE FROM alerts.alerts_by_status
+        WHERE status = ? AND alert_date = ? AND create_timestamp = ? AND alert_id = ?
+    """,
+
+    "prepared_alert_status_lookup": """
+        SELECT alert_id FROM alerts.alerts_by_status
+        WHERE status = ? AND alert_date = ? AND create_timestamp = ? AND alert_id = ?
+    """,
+
+    "prepared_alerts_by_id_status_update": """
+        UPDATE alerts.alerts_by_id
+        SET status = ?
+        WHERE alert_id = ?
+    """,
+}
+
+prepared_transaction_query = None
+prepared_event_query = None
+prepared_alert_status_query = None
+prepared_alert_status_bucketed_query = None
+prepared_alert_status_bucketed_delete = None
+prepared_alert_status_bucketed_select = None
+prepared_alert_status_select = None
+prepared_alert_bucket_count_select = None
+prepared_alert_bucket_count_insert = None
+prepared_alert_id_query = None
+prepared_alert_account_index = None
+prepared_transaction_account_index = None
+prepared_alert_by_id_select = None
+prepared_alert_account_lookup = None
+prepared_status_change_insert = None
+prepared_status_change_select = None
+prepared_index_backfill_insert = None
+prepared_index_backfill_select = None
+prepared_rollup_minute_update = None
+prepared_rollup_minute_select = None
+prepared_rollup_insert = None
+prepared_rollup_select = None
+prepared_sketch_snapshot_insert = None
+prepared_sketch_snapshot_select = None
+prepared_rescore_checkpoint_insert = None
+prepared_rescore_checkpoint_select = None
+prepared_transaction_select = None
+prepared_alerts_by_id_update = None
+prepared_alert_status_delete = None
+prepared_alert_status_lookup = None
+prepared_alerts_by_id_status_update = None
+
+STARTUP_PARALLELISM = int(os.environ.get("STARTUP_PARALLELISM", "8"))
+POOL_WARMUP_QUERIES = int(os.environ.get("POOL_WARMUP_QUERIES", "4"))
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", "10.0"))
+
+
+def prepare_statements(executor):
+    futures = {name: executor.submit(session.prepare, cql) for name, cql in PREPARED_QUERIES.items()}
+    prepared = {name: future.result() for name, future in futures.items()}
+    prepared_texts.update((statement.query_id, statement.query_string) for statement in prepared.values())
+    return prepared
+
+
+def warm_up_pools():
+    # Push a few concurrent requests through every host so connections are open and
+    # the first real requests don't pay for pool growth
+    futures = []
+    for host in cluster.metadata.all_hosts():
+        if not host.is_up:
+            continue
+        for _ in range(POOL_WARMUP_QUERIES):
+            futures.append(session.execute_async("SELECT now() FROM system.local", host=host))
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"⚠️ Pool warm-up query failed: {e}")
+
+
+class Broadcaster:
+    # WebSocket connections of this worker process
+
+    def __init__(self):
+        self.connections = set()
+
+    def add(self, websocket):
+        self.connections.add(websocket)
+
+    def discard(self, websocket):
+        self.connections.discard(websocket)
+
+    async def broadcast(self, message: str):
+        to_remove = []
+        for connection in self.connections:
+            try:
+                await connection.send_text(message)
+            except (WebSocketDisconnect, RuntimeError):
+                to_remove.append(connection)
+        for conn in to_remove:
+            self.connections.discard(conn)
+
+    async def close_all(self):
+        for connection in list(self.connections):
+            try:
+                await connection.close(code=1001)
+            except Exception:
+                pass
+        self.connections.clear()
+
+
+broadcaster = Broadcaster()
+
+
+# Duplicate-delivery filter for /insert-transaction/ retries
+DEDUP_WINDOW_SECONDS = float(os.environ.get("DEDUP_WINDOW_SECONDS", "900"))
+DEDUP_MAX_KEYS = int(os.environ.get("DEDUP_MAX_KEYS", "100000"))
+DEDUP_BLOOM_BITS = int(os.environ.get("DEDUP_BLOOM_BITS", str(1 << 22)))
+DEDUP_BLOOM_HASHES = 4
+
+
+class TransactionDeduplicator:
+    # A rotating two-generation Bloom filter in front of an exact LRU of recently written
+    # transaction keys. Almost every fresh key is rejected by the Bloom filter without
+    # touching the LRU; possible duplicates are confirmed against the exact set, so a
+    # false positive never drops a row. A key stays known for at least window_seconds.
+    # A new key is reserved as in flight by seen(), so a retry arriving while the first
+    # delivery is still being written is dropped too; remember() keeps it once written and
+    # release() frees it when the write fails, so the client can retry. The filter is per
+    # process: a retry routed to another worker is not caught.
+
+    def __init__(self, window_seconds, max_keys, bloom_bits, hashes):
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self.bloom_bits = bloom_bits
+        self.hashes = hashes
+        self.current = bytearray(bloom_bits // 8 + 1)
+        self.previous = bytearray(bloom_bits // 8 + 1)
+        self.rotated_at = time.monotonic()
+        self.recent = OrderedDict()  # transaction_key -> monotonic time it was written
+        self.in_flight = set()  # keys accepted but not yet written
+        self.checked = 0
+        self.duplicates = 0
+        self.lock = threading.Lock()
+
+    def _positions(self, key):
+        # Double hashing straight off the 128-bit UUID, which is already uniformly random for uuid4
+        h1 = key.int & 0xFFFFFFFFFFFFFFFF
+        h2 = (key.int >> 64) | 1
+        return [(h1 + i * h2) % self.bloom_bits for i in range(self.hashes)]
+
+    @staticmethod
+    def _contains(bits, positions):
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions)
+
+    def _expire(self, now):
+        if now - self.rotated_at >= self.window_seconds:
+            self.previous = self.current
+            self.current = bytearray(len(self.previous))
+            self.rotated_at = now
+
+        while self.recent:
+            key, written_at = next(iter(self.recent.items()))
+            if now - written_at <= self.window_seconds and len(self.recent) <= self.max_keys:
+                break
+            self.recent.popitem(last=False)
+
+    def seen(self, key):
+        now = time.monotonic()
+        positions = self._positions(key)
+        with self.lock:
+            self.checked += 1
+            self._expire(now)
+            if key in self.in_flight:
+                self.duplicates += 1
+                return True
+            if (self._contains(self.current, positions) or self._contains(self.previous, positions)) and key in self.recent:
+                self.recent.move_to_end(key)
+                self.duplicates += 1
+                return True
+            self.in_flight.add(key)
+            return False
+
+    def remember(self, keys):
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                for pos in self._positions(key):
+                    self.current[pos >> 3] |= 1 << (pos & 7)
+                self.recent[key] = now
+                self.recent.move_to_end(key)
+                self.in_flight.discard(key)
+            self._expire(now)
+
+    def release(self, keys):
+        with self.lock:
+            self.in_flight.difference_update(keys)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "tracked_keys": len(self.recent),
+                "in_flight_keys": len(self.in_flight),
+                "keys_checked": self.checked,
+                "duplicates_dropped": self.duplicates,
+                "duplicate_rate": round(self.duplicates / self.checked, 4) if self.checked else 0,
+            }
+
+
+transaction_deduplicator = TransactionDeduplicator(
+    DEDUP_WINDOW_SECONDS, DEDUP_MAX_KEYS, DEDUP_BLOOM_BITS, DEDUP_BLOOM_HASHES
+)
+
+
+# Admission control for the ingest endpoints
+ADMISSION_MAX_DRIVER_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_DRIVER_IN_FLIGHT", "2048"))
+ADMISSION_WRITE_LATENCY_TARGET_MS = float(os.environ.get("ADMISSION_WRITE_LATENCY_TARGET_MS", "100"))
+ADMISSION_MAX_WRITE_LATENCY_MS = float(os.environ.get("ADMISSION_MAX_WRITE_LATENCY_MS", "1000"))
+ADMISSION_MAX_ALERT_QUEUE = int(os.environ.get("ADMISSION_MAX_ALERT_QUEUE", "20000"))
+ADMISSION_TENANT_ROWS_PER_SECOND = float(os.environ.get("ADMISSION_TENANT_ROWS_PER_SECOND", "5000"))
+ADMISSION_TENANT_BURST = float(os.environ.get("ADMISSION_TENANT_BURST", "20000"))
+ADMISSION_MAX_TENANTS = 10000
+ADMISSION_LATENCY_HALF_LIFE = 5.0  # seconds without writes for the latency signal to halve
+
+
+def derive_tenant(fields):
+    return int(fields.get("tenant") or fields.get("field_5", 1))
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated_at = now
+
+
+class AdmissionController:
+    # Rejects ingest early (429 + Retry-After) when the cluster or the alert pipeline is
+    # saturated, and meters each tenant through a token bucket whose refill rate shrinks
+    # as observed write latency climbs above target.
+
+    def __init__(self):
+        self.buckets = OrderedDict()  # tenant -> TokenBucket, least recently used first
+        self.write_latency_ms = 0.0
+        self.last_write_at = time.monotonic()
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def record_write_latency(self, seconds):
+        now = time.monotonic()
+        with self.lock:
+            self.write_latency_ms = 0.8 * self._current_latency(now) + 0.2 * seconds * 1000
+            self.last_write_at = now
+
+    def _current_latency(self, now):
+        # Decay toward zero while idle so a single slow write doesn't shed load forever
+        return self.write_latency_ms * 0.5 ** ((now - self.last_write_at) / ADMISSION_LATENCY_HALF_LIFE)
+
+    def driver_in_flight(self):
+        if session is None:
+            return 0
+        return sum(sum(state["in_flights"]) for state in session.get_pool_state().values())
+
+    def _overload_reason(self, now):
+        latency = self._current_latency(now)
+        if latency > ADMISSION_MAX_WRITE_LATENCY_MS:
+            return f"write latency {latency:.0f} ms", latency / ADMISSION_MAX_WRITE_LATENCY_MS
+        depth = alert_queue.qsize()
+        if depth > ADMISSION_MAX_ALERT_QUEUE:
+            return f"alert queue depth {depth}", depth / ADMISSION_MAX_ALERT_QUEUE
+        in_flight_requests = self.driver_in_flight()
+        if in_flight_requests > ADMISSION_MAX_DRIVER_IN_FLIGHT:
+            return f"{in_flight_requests} in-flight driver requests", in_flight_requests / ADMISSION_MAX_DRIVER_IN_FLIGHT
+        return None, 0
+
+    def _tenant_rate(self, now):
+        latency = self._current_latency(now)
+        if latency <= ADMISSION_WRITE_LATENCY_TARGET_MS:
+            return ADMISSION_TENANT_ROWS_PER_SECOND
+        return ADMISSION_TENANT_ROWS_PER_SECOND * ADMISSION_WRITE_LATENCY_TARGET_MS / latency
+
+    def _reject(self, detail, retry_after):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def admit(self, rows_by_tenant):
+        now = time.monotonic()
+        with self.lock:
+            reason, pressure = self._overload_reason(now)
+            if reason:
+                self._reject(f"Ingest overloaded ({reason}), retry later", pressure * ADMISSION_LATENCY_HALF_LIFE)
+
+            rate = self._tenant_rate(now)
+            buckets = []
+            for tenant, rows in rows_by_tenant.items():
+                bucket = self.buckets.get(tenant)
+                if bucket is None:
+                    bucket = TokenBucket(ADMISSION_TENANT_BURST, now)
+                    self.buckets[tenant] = bucket
+                    if len(self.buckets) > ADMISSION_MAX_TENANTS:
+                        self.buckets.popitem(last=False)
+                else:
+                    self.buckets.move_to_end(tenant)
+                    bucket.tokens = min(ADMISSION_TENANT_BURST, bucket.tokens + (now - bucket.updated_at) * rate)
+                    bucket.updated_at = now
+
+                # A batch bigger than the burst only needs a full bucket, otherwise it could never pass
+                needed = min(rows, ADMISSION_TENANT_BURST)
+                if bucket.tokens < needed:
+                    self._reject(f"Tenant {tenant} is over its ingest rate", (needed - bucket.tokens) / rate)
+                buckets.append((bucket, needed))
+
+            # Only charge once every tenant in the batch has been admitted
+            for bucket, rows in buckets:
+                bucket.tokens -= rows
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "write_latency_ms": self._current_latency(now),
+                "alert_queue_depth": alert_queue.qsize(),
+                "driver_in_flight": self.driver_in_flight(),
+                "tenant_rows_per_second": self._tenant_rate(now),
+                "tracked_tenants": len(self.buckets),
+                "rejected_requests": self.rejected,
+            }
+
+
+admission_controller = AdmissionController()
+
+
+def rows_by_tenant(batch, tenant_of):
+    counts = {}
+    for fields in batch:
+        try:
+            tenant = tenant_of(fields)
+        except (TypeError, ValueError, AttributeError):
+            tenant = "default"  # malformed rows are rejected later, with a proper 400
+        counts[tenant] = counts.get(tenant, 0) + 1
+    return counts
+
+
+def execute_ingest_write(statement):
+    started = time.perf_counter()
+    try:
+        with in_flight(PROFILE_INGEST):
+            return session.execute(statement, execution_profile=PROFILE_INGEST)
+    finally:
+        admission_controller.record_write_latency(time.perf_counter() - started)
+
+
+async def execute_ingest_write_async(statement):
+    started = time.perf_counter()
+    try:
+        async with async_in_flight(PROFILE_INGEST):
+            return await await_response(session.execute_async(statement, execution_profile=PROFILE_INGEST))
+    finally:
+        admission_controller.record_write_latency(time.perf_counter() - started)
+
+
+# Adaptive write batching
+# The alert worker and /insert-event/ write in rounds of `concurrency` batches of
+# `batch_size` statements sent together. A WriteBatchController per path sets both,
+# AIMD-style: while a full round completes under WRITE_BATCH_LATENCY_TARGET_MS the batch
+# grows by one statement and concurrency by one batch per `concurrency` rounds; a slow
+# round, a write timeout or a batch-size warning from the coordinator cuts them back (a
+# warning only halves the batch size), at most once per WRITE_BATCH_DECREASE_COOLDOWN.
+WRITE_BATCH_LATENCY_TARGET_MS = float(os.environ.get("WRITE_BATCH_LATENCY_TARGET_MS", "50"))
+WRITE_BATCH_DECREASE_COOLDOWN = 1.0  # seconds; the rounds in flight when a cut happens saw the old limits
+WRITE_BATCH_DECREASE_FACTOR = 0.7
+
+
+def is_overload_error(error):
+    return isinstance(error, (WriteTimeout, OperationTimedOut))
+
+
+def is_batch_size_warning(warning):
+    # "Batch for [ks.table] is of size 6.1KiB, exceeding specified threshold of 5.0KiB by 1.1KiB."
+    return warning.startswith("Batch") and "exceeding" in warning
+
+
+class WriteBatchController:
+    def __init__(self, batch_size, max_batch_size, concurrency, max_concurrency, min_batch_size=1):
+        self.batch_size = float(batch_size)
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.latency_ms = None
+        self.last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.timeouts = 0
+        self.size_warnings = 0
+        self.lock = threading.Lock()
+
+    def limits(self):
+        with self.lock:
+            return int(self.batch_size), int(self.concurrency)
+
+    def observe(self, seconds, timed_out=False, oversized=False, full=True):
+        # full: the round used every batch it was allowed; only then is growing justified
+        latency_ms = seconds * 1000
+        now = time.monotonic()
+        with self.lock:
+            self.latency_ms = latency_ms if self.latency_ms is None else 0.8 * self.latency_ms + 0.2 * latency_ms
+            self.timeouts += timed_out
+            self.size_warnings += oversized
+            if timed_out or oversized or latency_ms > WRITE_BATCH_LATENCY_TARGET_MS:
+                if now - self.last_decrease < WRITE_BATCH_DECREASE_COOLDOWN:
+                    return
+                self.last_decrease = now
+                self.decreases += 1
+                if oversized and not timed_out:
+                    self.batch_size = max(self.min_batch_size, self.batch_size / 2)
+                    return
+                self.batch_size = max(self.min_batch_size, self.batch_size * WRITE_BATCH_DECREASE_FACTOR)
+                self.concurrency = max(1.0, self.concurrency * WRITE_BATCH_DECREASE_FACTOR)
+            elif full:
+                self.increases += 1
+                self.batch_size = min(self.max_batch_size, self.batch_size + 1)
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "batch_size": int(self.batch_size),
+                "concurrency": int(self.concurrency),
+                "max_batch_size": self.max_batch_size,
+                "max_concurrency": self.max_concurrency,
+                "latency_ms": round(self.latency_ms, 3) if self.latency_ms is not None else None,
+                "target_latency_ms": WRITE_BATCH_LATENCY_TARGET_MS,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "timeouts": self.timeouts,
+                "size_warnings": self.size_warnings,
+            }
+
+
+alert_write_limits = WriteBatchController(
+    batch_size=20, concurrency=1,
+    max_batch_size=int(os.environ.get("ALERT_MAX_BATCH_SIZE", "200")),
+    max_concurrency=int(os.environ.get("ALERT_MAX_WRITE_CONCURRENCY", "16")),
+)
+event_write_limits = WriteBatchController(
+    batch_size=25, concurrency=1,
+    max_batch_size=int(os.environ.get("EVENT_MAX_BATCH_SIZE", "200")),
+    max_concurrency=int(os.environ.get("EVENT_MAX_WRITE_CONCURRENCY", "16")),
+)
+
+
+def observe_ingest_round(controller, started, futures, errors, full):
+    elapsed = time.perf_counter() - started
+    admission_controller.record_write_latency(elapsed)
+    controller.observe(
+        elapsed,
+        timed_out=any(is_overload_error(error) for error in errors),
+        oversized=any(is_batch_size_warning(warning) for future in futures for warning in future.warnings or ()),
+        full=full,
+    )
+
+
+def execute_ingest_batches(batches, controller, full=True):
+    # Send one round of batches together (the round holds one ingest slot); returns the
+    # error, or None, per batch
+    started = time.perf_counter()
+    errors = []
+    with in_flight(PROFILE_INGEST):
+        futures = [session.execute_async(batch, execution_profile=PROFILE_INGEST) for batch in batches]
+        for future in futures:
+            try:
+                future.result()
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+    observe_ingest_round(controller, started, futures, errors, full)
+    return errors
+
+
+async def execute_ingest_batches_async(batches, controller, full=True):
+    started = time.perf_counter()
+    async with async_in_flight(PROFILE_INGEST):
+        futures = [session.execute_async(batch, execution_profile=PROFILE_INGEST) for batch in batches]
+        results = await asyncio.gather(*[await_response(future) for future in futures], return_exceptions=True)
+    errors = [result if isinstance(result, Exception) else None for result in results]
+    observe_ingest_round(controller, started, futures, errors, full)
+    return errors
+
+
+# Sharded alerts_by_status partitions
+# A day with bucket_count > 1 keeps its status rows in alerts_by_status_bucketed, spread
+# over (status, alert_date, bucket) partitions with bucket = alert_id % bucket_count;
+# other days stay in alerts_by_status. The count is fixed per day in
+# alerts.alert_status_buckets, claimed with IF NOT EXISTS by the first writer of the day
+# so every worker process agrees on it. A process can still have written unbucketed rows
+# for the day before the claim (it started earlier, or cached the day as unsharded), so
+# reads and deletes on a sharded day also cover its alerts_by_status partition.
+ALERT_STATUS_BUCKETS = int(os.environ.get("ALERT_STATUS_BUCKETS", "1"))
+ALERT_BUCKET_UNSET_TTL = 60.0  # re-check days without a stored count, an operator may configure them
+
+alert_bucket_counts = {}  # alert_date -> (bucket_count, stored, looked_up_at)
+alert_bucket_lock = threading.Lock()
+
+
+def cached_alert_bucket_count(alert_date, create=False):
+    # The cached count, or None when it has to be looked up (again)
+    with alert_bucket_lock:
+        cached = alert_bucket_counts.get(alert_date)
+    if cached and (cached[1] or time.monotonic() - cached[2] < ALERT_BUCKET_UNSET_TTL):
+        if cached[1] or not create or ALERT_STATUS_BUCKETS <= 1:
+            return cached[0]
+    return None
+
+
+def alert_bucket_count(alert_date, create=False):
+    now = time.monotonic()
+    cached = cached_alert_bucket_count(alert_date, create)
+    if cached is not None:
+        return cached
+
+    row = session.execute(prepared_alert_bucket_count_select, (alert_date,),
+                          execution_profile=PROFILE_INTERACTIVE).one()
+    if row:
+        count, stored = row["bucket_count"], True
+    elif create and ALERT_STATUS_BUCKETS > 1:
+        # LWT result carries the existing row when another worker got there first
+        result = session.execute(prepared_alert_bucket_count_insert, (alert_date, ALERT_STATUS_BUCKETS),
+                                 execution_profile=PROFILE_INGEST).one()
+        count = ALERT_STATUS_BUCKETS if result["[applied]"] else result["bucket_count"]
+        stored = True
+    else:
+        count, stored = 1, False
+
+    with alert_bucket_lock:
+        alert_bucket_counts[alert_date] = (count, stored, now)
+    return count
+
+
+async def alert_bucket_count_async(alert_date):
+    # Read-only alert_bucket_count for coroutines
+    cached = cached_alert_bucket_count(alert_date)
+    if cached is not None:
+        return cached
+    now = time.monotonic()
+    row = (await execute_async_with_profile(prepared_alert_bucket_count_select, (alert_date,))).one()
+    count, stored = (row["bucket_count"], True) if row else (1, False)
+    with alert_bucket_lock:
+        alert_bucket_counts[alert_date] = (count, stored, now)
+    return count
+
+
+def alert_bucket(alert_id, bucket_count):
+    return alert_id.int % bucket_count
+
+
+def alert_status_insert(record, create_buckets=False, bucket_count=None):
+    # record is an AlertRecord, already in prepared_alert_status_query bind order. Coroutines
+    # pass the bucket_count they got from alert_bucket_count_async, so nothing blocks here.
+    if bucket_count is None:
+        bucket_count = alert_bucket_count(record.alert_date, create=create_buckets)
+    if bucket_count <= 1:
+        return prepared_alert_status_query, record
+    return prepared_alert_status_bucketed_query, record + (alert_bucket(record.alert_id, bucket_count),)
+
+
+def alert_status_delete(status, alert_date, create_timestamp, alert_id, bucket_count=None):
+    # [(statement, params)] removing the alert's status row, wherever it may be
+    if bucket_count is None:
+        bucket_count = alert_bucket_count(alert_date)
+    deletes = [(prepared_alert_status_delete, (status, alert_date, create_timestamp, alert_id))]
+    if bucket_count > 1:
+        deletes.append((prepared_alert_status_bucketed_delete, (
+            status, alert_date, alert_bucket(alert_id, bucket_count), create_timestamp, alert_id
+        )))
+    return deletes
+
+
+def merge_status_rows(results, limit):
+    # Newest first across the buckets and the unbucketed partition, one row per alert: a
+    # re-scored alert may have been copied to its bucket while the unbucketed row stayed;
+    # the bucketed row (listed first, so merged first) is the one kept.
+    merged = heapq.merge(*results, key=lambda row: row["create_timestamp"], reverse=True)
+    seen = set()
+    rows = []
+    for row in merged:
+        if row["alert_id"] in seen:
+            continue
+        seen.add(row["alert_id"])
+        rows.append(row)
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def read_alerts_by_status(status, alert_date, limit, fields):
+    bucket_count = alert_bucket_count(alert_date)
+    if bucket_count <= 1:
+        return execute_with_profile(f"""
+            SELECT {', '.join(fields)}
+            FROM alerts.alerts_by_status
+            WHERE status = %s AND alert_date = %s
+            LIMIT {limit}
+        """, (status, alert_date))
+
+    # Read every bucket and the unbucketed partition concurrently, then merge newest first
+    with in_flight(PROFILE_INTERACTIVE):
+        futures = [
+            session.execute_async(prepared_alert_status_bucketed_select, (status, alert_date, bucket, limit),
+                                  execution_profile=PROFILE_INTERACTIVE)
+            for bucket in range(bucket_count)
+        ]
+        futures.append(session.execute_async(prepared_alert_status_select, (status, alert_date, limit),
+                                             execution_profile=PROFILE_INTERACTIVE))
+        results = [list(future.result()) for future in futures]
+
+    return merge_status_rows(results, limit)
+
+
+async def read_alerts_by_status_async(status, alert_date, limit, fields):
+    bucket_count = await alert_bucket_count_async(alert_date)
+    if bucket_count <= 1:
+        return await fetch_all(f"""
+            SELECT {', '.join(fields)}
+            FROM alerts.alerts_by_status
+            WHERE status = %s AND alert_date = %s
+            LIMIT {limit}
+        """, (status, alert_date))
+
+    results = await asyncio.gather(
+        *[
+            execute_async_with_profile(prepared_alert_status_bucketed_select, (status, alert_date, bucket, limit))
+            for bucket in range(bucket_count)
+        ],
+        execute_async_with_profile(prepared_alert_status_select, (status, alert_date, limit)),
     )
-""")
-
-prepared_alert_status_query = session.prepare("""
-    INSERT INTO alerts.alerts_by_status (
-        status, alert_date, create_timestamp, alert_id, region,
-        tenant, score, account_number, alert_description, alert_type,
-        amount, first_name, last_name, reviewed, severity,
-        transaction_key, transaction_timestamp
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-""")
-
-prepared_alert_id_query = session.prepare("""
-    INSERT INTO alerts.alerts_by_id (
-        alert_id, region, tenant, score, account_number, alert_date,
-        alert_description, alert_type, amount, create_timestamp,
-        first_name, last_name, reviewed, severity, status,
-        transaction_key, transaction_timestamp
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-""")
-
-prepared_alerts_by_id_update = session.prepare("""
-    UPDATE alerts.alerts_by_id
-    SET reviewed = true, status = 'open'
-    WHERE alert_id = ?
-""")
-
-
-# WebSocket connections
-websocket_connections = set()
+    return merge_status_rows([result.current_rows for result in results], limit)
+
+
+# In-memory hot window of recent alerts
+# Holds every alert created in the last HOT_WINDOW_HOURS, per status and ordered by
+# create_timestamp, so the default triage view (/alerts?days=1) never touches Cassandra.
+# The alert worker and the status endpoints keep it current. The status endpoints also
+# log every transition in alerts.alert_status_changes, and the alert worker logs every new
+# alert there too; each worker process polls it every HOT_WINDOW_CHANGE_POLL_SECONDS and
+# loads the alerts it does not hold from alerts_by_id, so a new alert or a status change
+# made through another worker shows up here after at most that long (plus the write
+# itself). The periodic resync, every HOT_WINDOW_RESYNC_SECONDS, repairs anything a
+# failed poll missed. Timestamps and the window's days are UTC.
+HOT_WINDOW_HOURS = float(os.environ.get("HOT_WINDOW_HOURS", "24"))
+HOT_WINDOW_MAX_ALERTS = int(os.environ.get("HOT_WINDOW_MAX_ALERTS", "200000"))
+HOT_WINDOW_RESYNC_SECONDS = float(os.environ.get("HOT_WINDOW_RESYNC_SECONDS", "60"))
+HOT_WINDOW_CHANGE_POLL_SECONDS = float(os.environ.get("HOT_WINDOW_CHANGE_POLL_SECONDS", "2"))
+HOT_WINDOW_CHANGE_OVERLAP = datetime.timedelta(seconds=5)  # re-read for late writes and clock skew
+
+ALERT_FIELDS = [
+    "alert_date", "status", "create_timestamp", "alert_id", "region", "tenant", "score", "alert_type", "alert_description",
+    "account_number", "amount", "first_name", "last_name",
+    "reviewed", "severity", "transaction_key", "transaction_timestamp"
+]
+ALERT_STATUSES = ("new", "open", "closed")
+alert_field_values = operator.attrgetter(*ALERT_FIELDS)  # AlertRecord -> values in ALERT_FIELDS order
+
+
+class HotAlert:
+    __slots__ = ("sort_key", "record")
+
+    def __init__(self, record):
+        self.record = record  # AlertRecord
+        self.sort_key = (record.create_timestamp, record.alert_id)
+
+    @property
+    def alert_id(self):
+        return self.record.alert_id
+
+    @property
+    def status(self):
+        return self.record.status
+
+
+def hot_sort_key(record):
+    return record.sort_key
+
+
+class RecentAlertIndex:
+    def __init__(self, hours, max_alerts):
+        self.window = datetime.timedelta(hours=hours)
+        self.max_alerts = max_alerts
+        self.by_status = {}  # status -> [HotAlert], oldest first
+        self.by_id = {}
+        self.covered_since = None  # holds every alert created at or after this time
+        self.journal = None  # changes made while a resync is reading Cassandra
+        self.lock = threading.Lock()
+
+    def _insert(self, record):
+        records = self.by_status.setdefault(record.status, [])
+        if not records or records[-1].sort_key < record.sort_key:
+            records.append(record)  # the common case, alerts arrive roughly in order
+        else:
+            bisect.insort(records, record, key=hot_sort_key)
+        self.by_id[record.alert_id] = record
+
+    def _remove(self, record):
+        records = self.by_status.get(record.status, [])
+        i = bisect.bisect_left(records, record.sort_key, key=hot_sort_key)
+        if i < len(records) and records[i] is record:
+            del records[i]
+        self.by_id.pop(record.alert_id, None)
+
+    def _trim(self):
+        cutoff = datetime.datetime.utcnow() - self.window
+        if self.covered_since is not None and self.covered_since < cutoff:
+            self.covered_since = cutoff
+        for records in self.by_status.values():
+            drop = bisect.bisect_left(records, (cutoff,), key=hot_sort_key)
+            for record in records[:drop]:
+                self.by_id.pop(record.alert_id, None)
+            del records[:drop]
+
+        # Over the size cap: evict the oldest alerts and shrink the covered range with them
+        while len(self.by_id) > self.max_alerts:
+            oldest = min((records[0] for records in self.by_status.values() if records), key=hot_sort_key)
+            self._remove(oldest)
+            self.covered_since = max(self.covered_since or oldest.sort_key[0], oldest.sort_key[0] + datetime.timedelta(microseconds=1))
+
+    def add(self, record):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append(("add", record))
+            if self.covered_since is None or record.create_timestamp < self.covered_since:
+                return
+            existing = self.by_id.get(record.alert_id)
+            if existing is not None:
+                self._remove(existing)
+            self._insert(HotAlert(record))
+            if len(self.by_id) > self.max_alerts:
+                self._trim()
+
+    def set_status(self, alert_id, status, reviewed=None):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append(("status", (alert_id, status, reviewed)))
+            hot = self.by_id.get(alert_id)
+            if hot is None:
+                return
+            changes = {"status": status} if reviewed is None else {"status": status, "reviewed": reviewed}
+            self._remove(hot)
+            self._insert(HotAlert(hot.record._replace(**changes)))
+
+    def missing(self, alert_ids):
+        with self.lock:
+            return {alert_id for alert_id in alert_ids if alert_id not in self.by_id}
+
+    def covers(self, since):
+        with self.lock:
+            return self.covered_since is not None and self.covered_since <= since
+
+    def query(self, statuses, end_date, days, max_rows):
+        # Same ordering as the Cassandra path: day by day, newest day first, then by status
+        results = []
+        with self.lock:
+            for i in range(days):
+                day = end_date - datetime.timedelta(days=i)
+                day_start = datetime.datetime.combine(day, datetime.time.min)
+                day_end = day_start + datetime.timedelta(days=1)
+                for status in statuses:
+                    records = self.by_status.get(status, [])
+                    lo = bisect.bisect_left(records, (day_start,), key=hot_sort_key)
+                    hi = bisect.bisect_left(records, (day_end,), key=hot_sort_key)
+                    for hot in reversed(records[lo:hi]):
+                        results.append(hot.record)
+                        if len(results) >= max_rows:
+                            return results
+        return results
+
+    def begin_resync(self):
+        with self.lock:
+            self.journal = []
+
+    def finish_resync(self, rows, covered_since):
+        with self.lock:
+            journal, self.journal = self.journal or [], None
+            self.by_status = {}
+            self.by_id = {}
+            self.covered_since = covered_since
+            for record in rows:
+                if record.create_timestamp is not None and record.create_timestamp >= covered_since:
+                    self._insert(HotAlert(record))
+
+        # Replay what happened while Cassandra was being read
+        for op, args in journal:
+            if op == "add":
+                self.add(args)
+            else:
+                self.set_status(*args)
+
+        with self.lock:
+            self._trim()
+
+    def abort_resync(self):
+        with self.lock:
+            self.journal = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "alerts": len(self.by_id),
+                "covered_since": self.covered_since.isoformat() if self.covered_since else None,
+            }
+
+
+recent_alerts = RecentAlertIndex(HOT_WINDOW_HOURS, HOT_WINDOW_MAX_ALERTS)
+background_stop = threading.Event()  # stops the periodic background loops on shutdown
+
+
+def resync_recent_alerts():
+    covered_since = datetime.datetime.utcnow() - recent_alerts.window
+    recent_alerts.begin_resync()
+    try:
+        rows = []
+        day = covered_since.date()
+        while day <= datetime.datetime.utcnow().date():
+            for status in ALERT_STATUSES:
+                for row in read_alerts_by_status(status, day, HOT_WINDOW_MAX_ALERTS, AlertRecord._fields):
+                    rows.append(alert_record_from_row(row))
+            day += datetime.timedelta(days=1)
+    except Exception:
+        recent_alerts.abort_resync()
+        raise
+    recent_alerts.finish_resync(rows, covered_since)
+    return len(rows)
+
+
+def hot_window_worker():
+    # Seed at startup, then resync periodically (HOT_WINDOW_RESYNC_SECONDS <= 0: seed only)
+    while not background_stop.is_set():
+        try:
+            loaded = resync_recent_alerts()
+            print(f"✅ Hot alert window loaded {loaded} alerts")
+        except Exception as e:
+            print(f"⚠️ Hot alert window resync failed: {e}")
+        if HOT_WINDOW_RESYNC_SECONDS <= 0:
+            return
+        background_stop.wait(HOT_WINDOW_RESYNC_SECONDS)
+
+
+status_change_poll = {"applied": 0, "loaded": 0, "polled_at": None, "error": None}
+
+
+def log_status_change(alert_id, status, reviewed=None):
+    # (statement, params) recording a transition for the other workers' hot windows
+    now = datetime.datetime.utcnow()
+    return prepared_status_change_insert, (now.replace(second=0, microsecond=0), uuid_from_time(now),
+                                           alert_id, status, reviewed)
+
+
+def read_status_changes(since, until):
+    # Logged transitions after since, oldest first
+    changes = []
+    minute = since.replace(second=0, microsecond=0)
+    while minute <= until:
+        changes.extend(session.execute(prepared_status_change_select, (minute, since),
+                                       execution_profile=PROFILE_INTERACTIVE))
+        minute += datetime.timedelta(minutes=1)
+    return changes
+
+
+def read_alert_records(alert_ids):
+    records = []
+    for success, result in execute_concurrent_with_args(session, prepared_alert_by_id_select,
+                                                        [(alert_id,) for alert_id in alert_ids],
+                                                        execution_profile=PROFILE_INTERACTIVE):
+        row = result.one()
+        if row:
+            records.append(alert_record_from_row(row))
+    return records
+
+
+def status_change_worker():
+    # Applies the alerts and transitions logged by every worker, this one's included.
+    # Alerts the window does not hold are loaded first (add() ignores those older than
+    # the window); replaying the transitions in order then leaves each at its latest status
+    since = datetime.datetime.utcnow()
+    while not background_stop.wait(HOT_WINDOW_CHANGE_POLL_SECONDS):
+        now = datetime.datetime.utcnow()
+        try:
+            changes = read_status_changes(since - HOT_WINDOW_CHANGE_OVERLAP, now)
+            missing = recent_alerts.missing(change["alert_id"] for change in changes)
+            loaded = read_alert_records(missing) if missing else []
+        except Exception as e:
+            status_change_poll["error"] = str(e)
+            print(f"⚠️ Alert status change poll failed: {e}")
+            continue
+        for record in loaded:
+            recent_alerts.add(record)
+        for change in changes:
+            recent_alerts.set_status(change["alert_id"], change["status"], reviewed=change["reviewed"])
+        status_change_poll.update({"applied": status_change_poll["applied"] + len(changes),
+                                   "loaded": status_change_poll["loaded"] + len(loaded),
+                                   "polled_at": now.isoformat(), "error": None})
+        since = now
+
+
+def scan_alerts_by_status(columns):
+    # Full scan of both status tables for the dashboard refreshes
+    for table in ("alerts.alerts_by_status", "alerts.alerts_by_status_bucketed"):
+        rows = session.execute(profile_statement(f"SELECT {columns} FROM {table}", PROFILE_ANALYTICS),
+                               execution_profile=PROFILE_ANALYTICS)
+        yield from rows
 
 def compute_score_and_should_alert(amount: float):
     if amount > 49950:
@@ -216,99 +1853,258 @@ def compute_score_and_should_alert(amount: float):
     else:
         return 50, False
 
+def score_alert(fields, insert_time):
+    # Apply the alert rules to one transaction; returns a new AlertRecord or None
+    amount = float(fields["amount"])
+    tenant = derive_tenant(fields)
+    score = 0
+
+    # Rule 1: based on amount thresholds
+    base_score, rule1_triggered = compute_score_and_should_alert(amount)
+    if rule1_triggered:
+        score += base_score
+
+    # Rule 2: based on fraud indicator
+    field2 = fields.get("field_2", "")
+    field2_triggered = field2 == "fraud"
+    if field2_triggered:
+        score += 90
+
+    # No rules triggered, no alert
+    if not rule1_triggered and not field2_triggered:
+        return None
+
+    # Determine severity from final score
+    if score > 85:
+        severity = "CRITICAL"
+    elif score > 70:
+        severity = "HIGH"
+    elif score > 60:
+        severity = "ELEVATED"
+    elif score > 50:
+        severity = "MODERATE"
+    else:
+        return None  # Below alert threshold
+
+    alert_id = uuid.uuid4()
+    alert_date = insert_time.date()
+
+    # Determine alert type
+    if rule1_triggered and field2_triggered:
+        alert_type = "MULTIPLE"
+    elif field2_triggered:
+        alert_type = "FRAUD"
+    else:
+        alert_type = "HIGH_SCORE" if severity in ("HIGH", "CRITICAL") else "MEDIUM_SCORE"
+
+    region = fields.get("field_3")
+    transaction_key = fields["transaction_key"]
+    return AlertRecord(
+        alert_id, sys.intern(region) if isinstance(region, str) else region, tenant, score,
+        fields["account_number"], alert_date, ALERT_DESCRIPTIONS[rule1_triggered, field2_triggered],
+        alert_type, amount, insert_time, fields["first_name"], fields["last_name"], False,
+        severity, "new", uuid.UUID(transaction_key) if isinstance(transaction_key, str) else transaction_key,
+        insert_time
+    )
+
+
 def maybe_insert_alert(fields, insert_time):
     try:
-        amount = float(fields["amount"])
-        tenant = int(fields.get("tenant") or fields.get("field_5", 1))
-        score = 0
-
-        # Rule 1: based on amount thresholds
-        base_score, rule1_triggered = compute_score_and_should_alert(amount)
-        if rule1_triggered:
-            score += base_score
-
-        # Rule 2: based on fraud indicator
-        field2 = fields.get("field_2", "")
-        field2_triggered = field2 == "fraud"
-        if field2_triggered:
-            score += 90
-
-        # No rules triggered, no alert
-        if not rule1_triggered and not field2_triggered:
-            return
+        record = score_alert(fields, insert_time)
+        if record is not None:
+            alert_queue.put((record, True))
+    except Exception as e:
+        print(f"❌ Failed to prepare alert for queue: {e}")
 
-        # Determine severity from final score
-        if score > 85:
-            severity = "CRITICAL"
-        elif score > 70:
-            severity = "HIGH"
-        elif score > 60:
-            severity = "ELEVATED"
-        elif score > 50:
-            severity = "MODERATE"
-        else:
-            return  # Below alert threshold
 
-        alert_id = uuid.uuid4()
-        alert_date = insert_time.date()
+# Group commit for /insert-transaction/
+# Producers mostly send 1-10 rows per request. Rather than one round-trip per request, the
+# handlers hand their bound statements to a shared writer thread, which collects them for
+# GROUP_COMMIT_WINDOW_MS, groups them by partition into batches and writes those
+# concurrently. A request resolves only once every batch holding its rows is acknowledged,
+# so a success response still means the rows are written. Handlers bind their statements
+# before submitting, so a bad value fails that request with a 400 and never reaches the
+# writer thread; a request whose client went away is dropped. Statements are submitted in
+# units that must be written together (a transaction row and its account index row):
+# batches holding such units are LOGGED, so a unit is never half applied, at the cost of
+# the coordinator's batchlog write; batches of single-statement units stay UNLOGGED.
+# GROUP_COMMIT_WINDOW_MS=0 writes each request as its own LOGGED batch. /metrics reports
+# the statements written per round trip.
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("GROUP_COMMIT_WINDOW_MS", "5"))
+GROUP_COMMIT_MAX_STATEMENTS = int(os.environ.get("GROUP_COMMIT_MAX_STATEMENTS", "1000"))  # flush early past this
+GROUP_COMMIT_BATCH_STATEMENTS = int(os.environ.get("GROUP_COMMIT_BATCH_STATEMENTS", "50"))  # cap per partition batch
+
+
+class GroupCommitWriter:
+    def __init__(self, window_ms, max_statements, batch_statements):
+        self.window = window_ms / 1000
+        self.max_statements = max_statements
+        self.batch_statements = batch_statements
+        self.pending = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.flushes = 0
+        self.requests = 0
+        self.round_trips = 0
+        self.statements = 0
+
+    def submit(self, units):
+        # units: [(partition_key, [bound statement, ...])], each unit written atomically;
+        # the future resolves once all are written
+        future = Future()
+        self.pending.put((units, future))
+        return future
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="transaction-group-commit", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout):
+        # Flush what is already queued before returning
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run(self):
+        while not (self.stop_event.is_set() and self.pending.empty()):
+            try:
+                item = self.pending.get(timeout=1)
+            except queue.Empty:
+                continue
 
-        # Determine alert type
-        if rule1_triggered and field2_triggered:
-            alert_type = "MULTIPLE"
-        elif field2_triggered:
-            alert_type = "FRAUD"
-        else:
-            alert_type = "HIGH_SCORE" if severity in ("HIGH", "CRITICAL") else "MEDIUM_SCORE"
-
-        # Build description
-        description_parts = []
-        if rule1_triggered:
-            description_parts.append("Rule1 triggered: amount threshold exceeded")
-        if field2_triggered:
-            description_parts.append(f"Rule2 triggered: field2 = {field2}")
-        alert_description = ", ".join(description_parts)
-
-        alert_fields = {
-            "alert_id": alert_id,
-            "region": fields.get("field_3"),
-            "tenant": tenant,
-            "score": score,
-            "account_number": fields["account_number"],
-            "alert_date": alert_date,
-            "alert_description": alert_description,
-            "alert_type": alert_type,
-            "amount": amount,
-            "first_name": fields["first_name"],
-            "last_name": fields["last_name"],
-            "severity": severity,
-            "transaction_key": uuid.UUID(fields["transaction_key"])
+            group, count = [], 0
+            deadline = time.monotonic() + self.window
+            while True:
+                # Claim the request; False means it was cancelled (the client went away)
+                if item[1].set_running_or_notify_cancel():
+                    group.append(item)
+                    count += len(item[0])
+                remaining = deadline - time.monotonic()
+                if count >= self.max_statements or remaining <= 0:
+                    break
+                try:
+                    item = self.pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if not group:
+                continue
+            try:
+                self.flush(group)
+            except Exception as e:
+                # Keep the thread alive: fail this group's requests and carry on
+                print(f"❌ Group commit flush failed: {e}")
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def flush(self, group):
+        partitions = {}  # partition key -> [(request index, unit)]
+        for i, (units, _) in enumerate(group):
+            for key, unit in units:
+                partitions.setdefault(key, []).append((i, unit))
+
+        batches = []
+        for units in partitions.values():
+            # Up to batch_statements statements per batch, never splitting a unit
+            chunks, size = [[]], 0
+            for i, unit in units:
+                if size and size + len(unit) > self.batch_statements:
+                    chunks.append([])
+                    size = 0
+                chunks[-1].append((i, unit))
+                size += len(unit)
+
+            for chunk in chunks:
+                atomic = any(len(unit) > 1 for _, unit in chunk)
+                batch = BatchStatement(batch_type=BatchType.LOGGED if atomic else BatchType.UNLOGGED)
+                for _, unit in chunk:
+                    for statement in unit:
+                        batch.add(statement)
+                batches.append((batch, {i for i, _ in chunk}))
+
+        errors = {}  # request index -> first error among its batches
+        started = time.perf_counter()
+        try:
+            with in_flight(PROFILE_INGEST):
+                futures = [
+                    (session.execute_async(batch, execution_profile=PROFILE_INGEST), owners)
+                    for batch, owners in batches
+                ]
+                for future, owners in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        for i in owners:
+                            errors.setdefault(i, e)
+        except Exception as e:
+            # No ingest slot or the driver refused the submit: fail everything not yet failed
+            for i in range(len(group)):
+                errors.setdefault(i, e)
+        finally:
+            admission_controller.record_write_latency(time.perf_counter() - started)
+
+        for i, (_, future) in enumerate(group):
+            if future.done():
+                continue
+            if i in errors:
+                future.set_exception(errors[i])
+            else:
+                future.set_result(None)
+
+        self.flushes += 1
+        self.requests += len(group)
+        self.round_trips += len(batches)
+        self.statements += sum(len(unit) for units, _ in group for _, unit in units)
+
+    def stats(self):
+        return {
+            "flushes": self.flushes,
+            "requests_per_flush": round(self.requests / self.flushes, 2) if self.flushes else 0,
+            "statements_per_round_trip": round(self.statements / self.round_trips, 2) if self.round_trips else 0,
+            "queued_requests": self.pending.qsize(),
         }
 
-        alert_queue.put((alert_fields, insert_time))
 
-    except Exception as e:
-        print(f"❌ Failed to prepare alert for queue: {e}")
+transaction_writer = GroupCommitWriter(GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_STATEMENTS, GROUP_COMMIT_BATCH_STATEMENTS)
+
+
+TRANSACTION_FIELD_TYPES = {
+    f"field_{i}": t for i, t in zip(range(1, 21), [
+        "timestamp", "text", "text", "int", "bigint", "uuid", "date",
+        "timestamp", "text", "text", "int", "bigint", "uuid", "date",
+        "timestamp", "text", "text", "int", "bigint", "uuid"
+    ])
+}
 
 
-@app.post("/insert-transaction/")
+@router.post("/insert-transaction/")
 async def insert_transaction(payload: dict):
+    admission_controller.admit(rows_by_tenant(payload.get("batch") or [], derive_tenant))
+
+    written_keys = set()  # keys this request reserved with the deduplicator
     try:
         batch = payload.get("batch", [])
         if not batch:
             raise HTTPException(status_code=400, detail="Missing batch")
 
-        FIELD_TYPES = {
-            f"field_{i}": t for i, t in zip(range(1, 21), [
-                "timestamp", "text", "text", "int", "bigint", "uuid", "date",
-                "timestamp", "text", "text", "int", "bigint", "uuid", "date",
-                "timestamp", "text", "text", "int", "bigint", "uuid"
-            ])
-        }
-
+        FIELD_TYPES = TRANSACTION_FIELD_TYPES
         field_order = [f"field_{i}" for i in range(1, 21)]
-        batch_stmt = BatchStatement()
+        units = []  # (partition key, [bound statement]), see GroupCommitWriter
+        sketch_rows = []  # (insert_date, tenant, amount)
+        alert_rows = []  # (fields, insert_time), queued for scoring once the rows are written
+        duplicate_rows = 0
 
         for fields in batch:
+            # Drop rows a retrying client already delivered, before any coercion or scoring
+            transaction_key = uuid.UUID(fields["transaction_key"]) if isinstance(fields["transaction_key"], str) else fields["transaction_key"]
+            if transaction_key in written_keys or transaction_deduplicator.seen(transaction_key):
+                duplicate_rows += 1
+                continue
+            written_keys.add(transaction_key)
+
             insert_date = fields["insert_date"]
             if isinstance(insert_date, str):
                 insert_date = datetime.datetime.strptime(insert_date, "%Y-%m-%d").date()
@@ -325,7 +2121,6 @@ async def insert_transaction(payload: dict):
             first_name = fields["first_name"]
             last_name = fields["last_name"]
             session_id = uuid.UUID(fields["session_id"]) if isinstance(fields["session_id"], str) else fields["session_id"]
-            transaction_key = uuid.UUID(fields["transaction_key"]) if isinstance(fields["transaction_key"], str) else fields["transaction_key"]
 
             values = [
                 insert_date, insert_time, transaction_key, session_id,
@@ -361,7 +2156,14 @@ async def insert_transaction(payload: dict):
                 except Exception as e:
                     raise HTTPException(status_code=400, detail=f"Invalid value for {fname}: {val} ({e})")
 
-            batch_stmt.add(prepared_transaction_query, values)
+            # Bind here so a value the column type rejects fails this request, not the writer
+            try:
+                units.append((("transactions", insert_date), [
+                    prepared_transaction_query.bind(values),
+                    prepared_transaction_account_index.bind((account_number, insert_time, transaction_key, insert_date)),
+                ]))
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid transaction {transaction_key}: {e}")
             # Inject backend-computed score + alert flag
             #score, should_alert = compute_score_and_should_alert(amount)
             #fields["score"] = score
@@ -370,140 +2172,626 @@ async def insert_transaction(payload: dict):
             score, should_alert = compute_score_and_should_alert(amount)
             fields["score"] = score
             fields["should_alert"] = should_alert
-            maybe_insert_alert(fields, insert_time)
-
-        session.execute(batch_stmt)
-        return {"status": "success", "inserted_rows": len(batch)}
+            alert_rows.append((fields, insert_time))
+            sketch_rows.append((insert_date, derive_tenant(fields), amount))
+
+        if written_keys:
+            if GROUP_COMMIT_WINDOW_MS > 0:
+                await asyncio.wrap_future(transaction_writer.submit(units))
+            else:
+                batch_stmt = BatchStatement()
+                for _, unit in units:
+                    for statement in unit:
+                        batch_stmt.add(statement)
+                await execute_ingest_write_async(batch_stmt)
+            # Only remember keys and raise alerts once the rows are durable
+            transaction_deduplicator.remember(written_keys)
+            for fields, insert_time in alert_rows:
+                maybe_insert_alert(fields, insert_time)
+            alert_sketches.add_transactions(sketch_rows)
+
+        return {"status": "success", "inserted_rows": len(written_keys), "duplicate_rows": duplicate_rows}
 
     except Exception as e:
         print("❌ Exception in /insert-transaction/:")
         traceback.print_exc()
         raise HTTPException(status_code=400, detail=str(e) or "Unknown error occurred")
+    finally:
+        # Free reservations of a failed or cancelled write so the retry is accepted
+        # (a no-op once remember() has taken the keys)
+        transaction_deduplicator.release(written_keys)
+
+EVENT_COLUMNS = [
+    "user_id", "event_date", "event_time", "event_type", "metadata", "session_id", "xml_blob"
+] + [f"field_{i}" for i in range(1, 101)]
+
+EVENT_UUID_FIELDS = {5, 12, 19, 26, 33, 40, 47, 54, 61, 68, 75, 82, 89, 96}
+EVENT_DATE_FIELDS = {6, 13, 20, 27, 34, 41, 48, 55, 62, 69, 76, 83, 90, 97}
+EVENT_TIMESTAMP_FIELDS = {7, 14, 21, 28, 35, 42, 49, 56, 63, 70, 77, 84, 91, 98}
+EVENT_INT_FIELDS = {3, 10, 17, 24, 31, 38, 45, 52, 59, 66, 73, 80, 87, 94}
+EVENT_BIGINT_FIELDS = {4, 11, 18, 25, 32, 39, 46, 53, 60, 67, 74, 81, 88, 95}
+
+
+def event_field_type(i):
+    if i in EVENT_UUID_FIELDS:
+        return "uuid"
+    if i in EVENT_DATE_FIELDS:
+        return "date"
+    if i in EVENT_TIMESTAMP_FIELDS:
+        return "timestamp"
+    if i in EVENT_INT_FIELDS:
+        return "int"
+    if i in EVENT_BIGINT_FIELDS:
+        return "bigint"
+    return "text"
+
+
+EVENT_COLUMN_TYPES = [
+    "uuid", "date", "timestamp", "text", "text", "text", "blob"
+] + [event_field_type(i) for i in range(1, 101)]
+
+# Event rows are mostly empty. Binding None writes a tombstone per missing cell, so
+# everything after the primary key (user_id, event_date, event_time) is bound as
+# UNSET_VALUE when absent and the cell is simply not written.
+EVENT_KEY_COLUMNS = 3
+
+
+def unset_if_none(value):
+    return UNSET_VALUE if value is None else value
+
+
+def coerce_event_row(fields):
+    user_id = uuid.UUID(fields.get("user_id"))
+    event_date = fields.get("event_date")
+    event_time = fields.get("event_time")
+    if isinstance(event_time, str):
+        try:
+            event_time = datetime.datetime.strptime(event_time, "%Y-%m-%d %H:%M:%S.%f")
+        except ValueError:
+            event_time = datetime.datetime.strptime(event_time, "%Y-%m-%d %H:%M:%S")
+
+    event_type = unset_if_none(fields.get("event_type"))
+    metadata = unset_if_none(fields.get("metadata"))
+    session_id = unset_if_none(fields.get("session_id"))
+    xml_blob = fields.get("xml_blob").encode() if isinstance(fields.get("xml_blob"), str) else unset_if_none(fields.get("xml_blob"))
+
+    dynamic_fields = []
+    for i in range(1, 101):
+        val = fields.get(f"field_{i}")
+        if val is None:
+            val = UNSET_VALUE
+        else:
+            if i in EVENT_UUID_FIELDS and isinstance(val, str):
+                val = uuid.UUID(val)
+            elif i in EVENT_DATE_FIELDS and isinstance(val, str):
+                val = datetime.datetime.strptime(val, "%Y-%m-%d").date()
+            elif i in EVENT_TIMESTAMP_FIELDS and isinstance(val, str):
+                try:
+                    val = datetime.datetime.strptime(val, "%Y-%m-%d %H:%M:%S.%f")
+                except ValueError:
+                    val = datetime.datetime.strptime(val, "%Y-%m-%d %H:%M:%S")
+            elif i in EVENT_INT_FIELDS:
+                val = int(val)
+            elif i in EVENT_BIGINT_FIELDS:
+                val = int(val)
+        dynamic_fields.append(val)
+
+    return [user_id, event_date, event_time, event_type, metadata, session_id, xml_blob] + dynamic_fields
+
+
+# Columnar msgpack ingest (Content-Type: application/x-msgpack)
+#
+#   {"rows": <n>, "tenant": <optional>, "columns": [<column>, ...]}
+#
+# "columns" holds one array of n values per entry of EVENT_COLUMNS, in that order, or nil for
+# a column that is empty in every row; nil values outside the primary key are left unset.
+# Values are already in wire-friendly types:
+#   uuid       16-byte bin
+#   date       int, days since 1970-01-01
+#   timestamp  int, milliseconds since the epoch (UTC)
+#   int/bigint int
+#   text       str
+#   xml_blob   bin
+# Each column is converted once, and the rows are zipped straight into bind tuples.
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+CQL_DATE_EPOCH_OFFSET = 2 ** 31  # the driver binds plain ints for date columns as offset days
+
+
+def decode_uuid_column(column):
+    return [None if v is None else UUID(bytes=v) for v in column]
+
+
+def decode_date_column(column):
+    return [None if v is None else v + CQL_DATE_EPOCH_OFFSET for v in column]
+
+
+COLUMN_DECODERS = {
+    "uuid": decode_uuid_column,
+    "date": decode_date_column,
+    # timestamps, ints, text and blobs bind as they come off the wire
+}
+
+
+def decode_event_columns(columns, row_count):
+    if not isinstance(columns, list) or len(columns) != len(EVENT_COLUMNS):
+        raise ValueError(f"Expected {len(EVENT_COLUMNS)} columns in EVENT_COLUMNS order")
+
+    decoded = []
+    for index, (name, column_type, column) in enumerate(zip(EVENT_COLUMNS, EVENT_COLUMN_TYPES, columns)):
+        key = index < EVENT_KEY_COLUMNS
+        if column is None:
+            if name == "user_id":
+                raise ValueError("Column user_id is required")
+            decoded.append([None if key else UNSET_VALUE] * row_count)
+            continue
+        if len(column) != row_count:
+            raise ValueError(f"Column {name} has {len(column)} values, expected {row_count}")
+        if name == "user_id" and None in column:
+            raise ValueError("Column user_id is required")
 
-@app.post("/insert-event/")
-async def insert_event(payload: dict):
-    try:
-        batch = payload.get("batch", [])
-        if not batch:
-            raise HTTPException(status_code=400, detail="Missing batch")
+        decoder = COLUMN_DECODERS.get(column_type)
+        values = decoder(column) if decoder else column
+        if not key and None in values:
+            values = [UNSET_VALUE if v is None else v for v in values]
+        decoded.append(values)
+
+    return list(zip(*decoded))
+
+
+# Process-pool offload
+# With PROCESS_POOL_WORKERS > 0, CPU-bound per-row work on big batches runs in a pool of
+# spawned worker processes instead of on the event loop: /insert-event/ JSON batches of
+# OFFLOAD_MIN_ROWS rows or more are coerced there, and so are the xml_blob columns of
+# read pages that size (serialize_rows). The rows are split into OFFLOAD_CHUNK_ROWS
+# chunks, run in parallel and put back together in their original order. Coerced rows
+# come back as one pickle per chunk, with UNSET_VALUE passed by reference so the
+# driver still recognises it. Off by default: every server worker process would start
+# its own pool.
+PROCESS_POOL_WORKERS = int(os.environ.get("PROCESS_POOL_WORKERS", "0"))
+OFFLOAD_MIN_ROWS = int(os.environ.get("OFFLOAD_MIN_ROWS", "2000"))
+OFFLOAD_CHUNK_ROWS = int(os.environ.get("OFFLOAD_CHUNK_ROWS", "500"))
+
+process_pool = None
+
+
+def start_process_pool():
+    global process_pool
+    if PROCESS_POOL_WORKERS <= 0:
+        return
+    process_pool = ProcessPoolExecutor(PROCESS_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    # Spawned workers import this module first; have that done before the first request
+    for future in [process_pool.submit(os.getpid) for _ in range(PROCESS_POOL_WORKERS)]:
+        future.result()
+    print(f"✅ Started {PROCESS_POOL_WORKERS} offload worker processes")
+
+
+def stop_process_pool():
+    global process_pool
+    if process_pool is not None:
+        process_pool.shutdown(wait=True, cancel_futures=True)
+        process_pool = None
+
+
+class RowPickler(pickle.Pickler):
+    def persistent_id(self, obj):
+        return "unset" if obj is UNSET_VALUE else None
+
+
+class RowUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        if pid == "unset":
+            return UNSET_VALUE
+        raise pickle.UnpicklingError(f"Unknown persistent id {pid!r}")
+
+
+def coerce_event_chunk(batch):
+    # Runs in a worker process
+    buffer = io.BytesIO()
+    RowPickler(buffer, pickle.HIGHEST_PROTOCOL).dump([coerce_event_row(fields) for fields in batch])
+    return buffer.getvalue()
+
+
+def map_chunk(func, values):
+    # Runs in a worker process
+    return [func(value) for value in values]
+
+
+def offload_chunks(items):
+    return [items[i:i + OFFLOAD_CHUNK_ROWS] for i in range(0, len(items), OFFLOAD_CHUNK_ROWS)]
+
+
+async def offload_map(func, values):
+    # [func(v) for v in values], in the process pool; func must be a module-level function
+    results = await asyncio.gather(*[
+        asyncio.wrap_future(process_pool.submit(map_chunk, func, chunk)) for chunk in offload_chunks(values)
+    ])
+    return [value for chunk in results for value in chunk]
+
+
+async def coerce_event_rows(batch):
+    if process_pool is None or len(batch) < OFFLOAD_MIN_ROWS:
+        return [coerce_event_row(fields) for fields in batch]
+    packed = await asyncio.gather(*[
+        asyncio.wrap_future(process_pool.submit(coerce_event_chunk, chunk)) for chunk in offload_chunks(batch)
+    ])
+    rows = []
+    for blob in packed:
+        rows.extend(RowUnpickler(io.BytesIO(blob)).load())
+    return rows
 
-        UUID_FIELDS = {5, 12, 19, 26, 33, 40, 47, 54, 61, 68, 75, 82, 89, 96}
-        DATE_FIELDS = {6, 13, 20, 27, 34, 41, 48, 55, 62, 69, 76, 83, 90, 97}
-        TIMESTAMP_FIELDS = {7, 14, 21, 28, 35, 42, 49, 56, 63, 70, 77, 84, 91, 98}
-        INT_FIELDS = {3, 10, 17, 24, 31, 38, 45, 52, 59, 66, 73, 80, 87, 94}
-        BIGINT_FIELDS = {4, 11, 18, 25, 32, 39, 46, 53, 60, 67, 74, 81, 88, 95}
-
-        prepared_query = session.prepare("""
-            INSERT INTO eventlog.user_events_with_100_fields (
-                user_id, event_date, event_time, event_type, metadata, session_id, xml_blob,
-                """ + ', '.join([f'field_{i}' for i in range(1, 101)]) + """
-            ) VALUES (
-                ?, ?, ?, ?, ?, ?, ?, """ + ', '.join(['?'] * 100) + """
-            )
-        """)
 
-        chunk_size = 25  # small batches recommended for Cassandra
-        for i in range(0, len(batch), chunk_size):
-            chunk = batch[i:i + chunk_size]
+async def write_event_rows(rows):
+    # Rounds sized by event_write_limits; the first failed batch fails the request
+    position = 0
+    while position < len(rows):
+        batch_size, concurrency = event_write_limits.limits()
+        round_rows = rows[position:position + batch_size * concurrency]
+        position += len(round_rows)
+
+        batches = []
+        for i in range(0, len(round_rows), batch_size):
             cass_batch = BatchStatement(consistency_level=ConsistencyLevel.ONE)
+            for values in round_rows[i:i + batch_size]:
+                cass_batch.add(prepared_event_query, values)
+            batches.append(cass_batch)
+
+        errors = await execute_ingest_batches_async(batches, event_write_limits,
+                                                    full=len(round_rows) == batch_size * concurrency)
+        error = next((error for error in errors if error is not None), None)
+        if error is not None:
+            raise error
+
+
+# Reservoir sample of user ids for /random_user_ids
+# Reseeded periodically by a background sampler that reads DISTINCT partition keys after
+# random tokens, a uniform sample of every user in the table. /insert-event/ offers the
+# distinct user ids of each request: before the first reseed they go through Algorithm R
+# (counting each id once while it is held), afterwards they only fill free slots, so ingest
+# of a few busy users cannot displace the token-range sample; new users are picked up
+# when it is refreshed.
+USER_SAMPLE_SIZE = int(os.environ.get("USER_SAMPLE_SIZE", "5000"))
+USER_SAMPLE_REFRESH_SECONDS = float(os.environ.get("USER_SAMPLE_REFRESH_SECONDS", "300"))
+USER_SAMPLE_PROBES = int(os.environ.get("USER_SAMPLE_PROBES", "16"))
+MURMUR3_MIN_TOKEN = -2 ** 63
+MURMUR3_MAX_TOKEN = 2 ** 63 - 1
+
+
+class UserIdReservoir:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = []
+        self.members = set()  # the ids in items
+        self.seen = 0  # distinct ids offered before the first reseed
+        self.seeded = False
+        self.rng = random.Random()
+        self.lock = threading.Lock()
+
+    def offer_many(self, user_ids):
+        with self.lock:
+            for user_id in dict.fromkeys(user_ids):
+                if user_id in self.members:
+                    continue
+                if len(self.items) < self.capacity:
+                    self.items.append(user_id)
+                    self.members.add(user_id)
+                    self.seen += 1
+                elif not self.seeded:
+                    self.seen += 1
+                    j = self.rng.randrange(self.seen)
+                    if j < self.capacity:
+                        self.members.discard(self.items[j])
+                        self.items[j] = user_id
+                        self.members.add(user_id)
+
+    def reseed(self, user_ids):
+        # A fresh token-range sample replaces the old one
+        user_ids = list(dict.fromkeys(user_ids))
+        if len(user_ids) > self.capacity:
+            user_ids = self.rng.sample(user_ids, self.capacity)
+        with self.lock:
+            self.items = user_ids
+            self.members = set(user_ids)
+            self.seeded = True
+
+    def sample(self, count, seed=None):
+        with self.lock:
+            pool = list(self.items)
+        if seed is None:
+            return random.sample(pool, min(count, len(pool)))
+        # Deterministic: the same seed over the same reservoir gives the same ids
+        pool.sort()
+        return random.Random(seed).sample(pool, min(count, len(pool)))
+
+    def __len__(self):
+        return len(self.items)
+
+
+user_reservoir = UserIdReservoir(USER_SAMPLE_SIZE)
+
+
+USER_SAMPLE_QUERY = f"""
+    SELECT DISTINCT user_id FROM eventlog.user_events_with_100_fields
+    WHERE TOKEN(user_id) > %s
+    LIMIT {max(1, USER_SAMPLE_SIZE // USER_SAMPLE_PROBES)}
+"""
+
+
+def sample_user_ids_by_token():
+    user_ids = []
+    for _ in range(USER_SAMPLE_PROBES):
+        token = random.randint(MURMUR3_MIN_TOKEN, MURMUR3_MAX_TOKEN)
+        rows = execute_with_profile(USER_SAMPLE_QUERY, (token,), profile=PROFILE_ANALYTICS)
+        user_ids.extend(row["user_id"] for row in rows)
+    return user_ids
+
+
+async def sample_user_ids_by_token_async():
+    # The same probes, sent concurrently
+    results = await asyncio.gather(*[
+        fetch_all(USER_SAMPLE_QUERY, (random.randint(MURMUR3_MIN_TOKEN, MURMUR3_MAX_TOKEN),), profile=PROFILE_ANALYTICS)
+        for _ in range(USER_SAMPLE_PROBES)
+    ])
+    return [row["user_id"] for rows in results for row in rows]
+
+
+def user_sampler_worker():
+    while not background_stop.is_set():
+        try:
+            user_reservoir.reseed(sample_user_ids_by_token())
+            print(f"✅ User id reservoir reseeded with {len(user_reservoir)} ids")
+        except Exception as e:
+            print(f"⚠️ User id sampling failed: {e}")
+        background_stop.wait(USER_SAMPLE_REFRESH_SECONDS)
+
+
+async def read_event_payload(request: Request):
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith(MSGPACK_CONTENT_TYPE):
+        if msgpack is None:
+            raise HTTPException(status_code=415, detail="msgpack ingest is not available on this server")
+        try:
+            payload = msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid msgpack body: {e}")
+        return payload, True
 
-            for fields in chunk:
-                user_id = uuid.UUID(fields.get("user_id"))
-                event_date = fields.get("event_date")
-                event_time = fields.get("event_time")
-                if isinstance(event_time, str):
-                    try:
-                        event_time = datetime.datetime.strptime(event_time, "%Y-%m-%d %H:%M:%S.%f")
-                    except ValueError:
-                        event_time = datetime.datetime.strptime(event_time, "%Y-%m-%d %H:%M:%S")
-
-                event_type = fields.get("event_type")
-                metadata = fields.get("metadata")
-                session_id = fields.get("session_id")
-                xml_blob = fields.get("xml_blob").encode() if isinstance(fields.get("xml_blob"), str) else fields.get("xml_blob")
-
-                dynamic_fields = []
-                for i in range(1, 101):
-                    val = fields.get(f"field_{i}")
-                    if val is not None:
-                        if i in UUID_FIELDS and isinstance(val, str):
-                            val = uuid.UUID(val)
-                        elif i in DATE_FIELDS and isinstance(val, str):
-                            val = datetime.datetime.strptime(val, "%Y-%m-%d").date()
-                        elif i in TIMESTAMP_FIELDS and isinstance(val, str):
-                            try:
-                                val = datetime.datetime.strptime(val, "%Y-%m-%d %H:%M:%S.%f")
-                            except ValueError:
-                                val = datetime.datetime.strptime(val, "%Y-%m-%d %H:%M:%S")
-                        elif i in INT_FIELDS:
-                            val = int(val)
-                        elif i in BIGINT_FIELDS:
-                            val = int(val)
-                    dynamic_fields.append(val)
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    return payload, False
+
+
+@router.post("/insert-event/")
+async def insert_event(request: Request):
+    payload, columnar = await read_event_payload(request)
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Expected an object body")
+
+    # Event rows carry no tenant column; producers can tag the whole batch instead
+    batch_tenant = payload.get("tenant", "default")
+    if columnar:
+        row_count = payload.get("rows") or 0
+        if not isinstance(row_count, int) or isinstance(row_count, bool) or row_count < 0:
+            raise HTTPException(status_code=400, detail="rows must be a non-negative integer")
+        admission_controller.admit({batch_tenant: row_count} if row_count else {})
+    else:
+        admission_controller.admit(rows_by_tenant(payload.get("batch") or [], lambda fields: batch_tenant))
 
-                values = [user_id, event_date, event_time, event_type, metadata, session_id, xml_blob] + dynamic_fields
-                cass_batch.add(prepared_query, values)
+    try:
+        if columnar:
+            if not row_count:
+                raise HTTPException(status_code=400, detail="Missing rows")
+            rows = decode_event_columns(payload.get("columns"), row_count)
+        else:
+            batch = payload.get("batch", [])
+            if not batch:
+                raise HTTPException(status_code=400, detail="Missing batch")
+            rows = await coerce_event_rows(batch)
 
-            session.execute(cass_batch)
+        await write_event_rows(rows)
+        user_reservoir.offer_many(row[0] for row in rows)
 
-        return {"status": "success", "inserted_rows": len(batch)}
+        return {"status": "success", "inserted_rows": len(rows)}
 
     except Exception as e:
         print("❌ Exception while inserting event batch:")
         traceback.print_exc()
         raise HTTPException(status_code=400, detail=str(e) or "Unknown error occurred")
 
-@app.websocket("/ws/data")
+@router.websocket("/ws/data")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    websocket_connections.add(websocket)
+    broadcaster.add(websocket)
     try:
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        websocket_connections.remove(websocket)
+        broadcaster.discard(websocket)
 
 async def broadcast_new_data(message: str):
-    to_remove = []
-    for connection in websocket_connections:
+    await broadcaster.broadcast(message)
+
+# Cluster health prober
+# Every HEALTH_PROBE_SECONDS a background thread reads system.local on each host directly
+# (host=, bypassing load balancing), timing every host and collecting its schema version,
+# and records the driver's pool state per host. /health, /demo-query and /health/nodes
+# serve the cached result instead of querying the cluster on each call. A host is slow
+# when its smoothed latency is HEALTH_SLOW_FACTOR times the cluster median and above
+# HEALTH_SLOW_HOST_MS, or when its probe failed; slow hosts feed SlowHostDemotionPolicy.
+HEALTH_PROBE_SECONDS = float(os.environ.get("HEALTH_PROBE_SECONDS", "5"))
+HEALTH_PROBE_TIMEOUT = float(os.environ.get("HEALTH_PROBE_TIMEOUT", "2.0"))
+HEALTH_SLOW_HOST_MS = float(os.environ.get("HEALTH_SLOW_HOST_MS", "20"))
+HEALTH_SLOW_FACTOR = 3.0
+HEALTH_IN_FLIGHT_PER_CONNECTION = 1024  # in-flight requests reported as a saturated connection
+HEALTH_STALE_SECONDS = 3 * HEALTH_PROBE_SECONDS + HEALTH_PROBE_TIMEOUT
+HEALTH_PROBE_QUERY = "SELECT schema_version FROM system.local"
+
+cluster_health = {"checked_at": None, "probed_at": None, "cassandra_status": "UNKNOWN",
+                  "schema_agreement": None, "latency_ms": None, "hosts": {}}
+cluster_health_lock = threading.Lock()
+
+
+def probe_cluster():
+    global slow_hosts
+    with cluster_health_lock:
+        previous = cluster_health["hosts"]
+    pool_state = session.get_pool_state()
+
+    # All probes in flight at once; each is timed when its own response arrives
+    probes = []
+    for host in cluster.metadata.all_hosts():
+        if not host.is_up:
+            probes.append((host, None, None, None))
+            continue
+        finished = {}
+        started = time.perf_counter()
+        future = session.execute_async(HEALTH_PROBE_QUERY, host=host, timeout=HEALTH_PROBE_TIMEOUT)
+        future.add_callbacks(lambda _, f=finished: f.setdefault("at", time.perf_counter()),
+                             lambda _, f=finished: f.setdefault("at", time.perf_counter()))
+        probes.append((host, future, started, finished))
+
+    hosts = {}
+    for host, future, started, finished in probes:
+        address = str(host.endpoint)
+        state = pool_state.get(host) or {}
+        in_flight = sum(state.get("in_flights", []))
+        open_connections = state.get("open_count", 0)
+        entry = {
+            "address": address,
+            "datacenter": host.datacenter,
+            "rack": host.rack,
+            "is_up": bool(host.is_up),
+            "latency_ms": None,
+            "latency_ewma_ms": None,
+            "schema_version": None,
+            "error": None,
+            "open_connections": open_connections,
+            "in_flight": in_flight,
+            "pool_saturation": round(in_flight / (open_connections * HEALTH_IN_FLIGHT_PER_CONNECTION), 4)
+                               if open_connections else None,
+        }
+        if future is None:
+            entry["error"] = "host is down"
+        else:
+            try:
+                row = future.result().one()
+                latency = (finished.get("at", time.perf_counter()) - started) * 1000
+                last = previous.get(address, {}).get("latency_ewma_ms")
+                entry["latency_ms"] = round(latency, 3)
+                entry["latency_ewma_ms"] = round(latency if last is None else 0.7 * last + 0.3 * latency, 3)
+                entry["schema_version"] = str(row["schema_version"]) if row else None
+            except Exception as e:
+                entry["error"] = f"{type(e).__name__}: {e}"
+        hosts[address] = (host, entry)
+
+    latencies = sorted(entry["latency_ewma_ms"] for _, entry in hosts.values() if entry["latency_ewma_ms"] is not None)
+    median = latencies[len(latencies) // 2] if latencies else None
+    slow = set()
+    for host, entry in hosts.values():
+        entry["slow"] = entry["error"] is not None or (
+            entry["latency_ewma_ms"] >= max(HEALTH_SLOW_HOST_MS, HEALTH_SLOW_FACTOR * median)
+        )
+        if entry["slow"]:
+            slow.add(host)
+    slow_hosts = frozenset(slow)
+
+    versions = {entry["schema_version"] for _, entry in hosts.values() if entry["schema_version"]}
+    if not latencies:
+        status = "DOWN"
+    elif slow:
+        status = "DEGRADED"
+    else:
+        status = "UP"
+    with cluster_health_lock:
+        cluster_health.update({
+            "checked_at": datetime.datetime.utcnow(),
+            "probed_at": time.monotonic(),
+            "cassandra_status": status,
+            "schema_agreement": len(versions) == 1 if versions else None,
+            "latency_ms": median,
+            "hosts": {address: entry for address, (_, entry) in hosts.items()},
+        })
+
+
+def health_prober():
+    while True:
         try:
-            await connection.send_text(message)
-        except WebSocketDisconnect:
-            to_remove.append(connection)
-    for conn in to_remove:
-        websocket_connections.remove(conn)
+            probe_cluster()
+        except Exception as e:
+            print(f"⚠️ Cluster health probe failed: {e}")
+            with cluster_health_lock:
+                cluster_health.update({"checked_at": datetime.datetime.utcnow(), "probed_at": time.monotonic(),
+                                       "cassandra_status": "DOWN"})
+        if background_stop.wait(HEALTH_PROBE_SECONDS):
+            return
 
-@app.get("/health")
-async def health_check():
-    try:
-        # Try a basic Cassandra query
-        session.execute("SELECT now() FROM system.local")
-        cassandra_status = "UP"
-    except Exception:
-        cassandra_status = "DOWN"
 
+def cached_health():
+    with cluster_health_lock:
+        health = dict(cluster_health)
+    age = time.monotonic() - health["probed_at"] if health["probed_at"] is not None else None
+    if age is None or age > HEALTH_STALE_SECONDS:
+        health["cassandra_status"] = "UNKNOWN"  # the prober has not run (recently)
+    health["age_seconds"] = round(age, 3) if age is not None else None
+    return health
+
+
+@router.get("/slow-queries")
+async def get_slow_queries(
+    limit: int = Query(20, gt=0, le=200),
+    route: Optional[str] = Query(None, description='Only queries issued while serving this route, e.g. "GET /events/{user_id}"'),
+):
+    return {"tracing": query_tracer.stats(), "statements": query_tracer.slowest(limit, route)}
+
+@router.get("/ingest/limits")
+async def get_ingest_limits():
+    return {"alerts": alert_write_limits.stats(), "events": event_write_limits.stats()}
+
+@router.get("/health")
+async def health_check():
+    health = cached_health()
     return {
         "api_status": "UP",
-        "cassandra_status": cassandra_status
+        "cassandra_status": health["cassandra_status"],
+        "cassandra_latency_ms": health["latency_ms"],
+        "schema_agreement": health["schema_agreement"],
+        "checked_at": health["checked_at"],
+        "age_seconds": health["age_seconds"],
+    }
+
+@router.get("/health/nodes")
+async def health_nodes():
+    health = cached_health()
+    return {
+        "cassandra_status": health["cassandra_status"],
+        "schema_agreement": health["schema_agreement"],
+        "checked_at": health["checked_at"],
+        "age_seconds": health["age_seconds"],
+        "demote_slow_hosts": HEALTH_DEMOTE_SLOW_HOSTS,
+        "nodes": sorted(health["hosts"].values(), key=lambda entry: entry["address"]),
     }
 
-@app.get("/demo-query")
+@router.get("/demo-query")
 async def demo_query():
     from datetime import datetime
 
-    try:
-        # Lightweight check to make sure Cassandra is reachable
-        session.execute("SELECT now() FROM system.local")
-    except Exception as e:
+    # The prober's last result tells whether Cassandra is reachable
+    if cached_health()["cassandra_status"] not in ("UP", "DEGRADED"):
         raise HTTPException(status_code=500, detail="Cassandra is not available.")
 
     return {"message": "Hello from backend!", "timestamp": datetime.utcnow().isoformat()}
 
-@app.get("/metrics")
-async def dummy_metrics():
-    return ""
+@router.get("/metrics")
+async def get_metrics():
+    return {
+        "hot_window": {**recent_alerts.stats(), "status_changes": status_change_poll},
+        "transaction_group_commit": transaction_writer.stats(),
+        "transaction_dedup": transaction_deduplicator.stats(),
+        "admission": admission_controller.stats(),
+    }
 
-@app.get("/transactions")
+@router.get("/transactions")
 async def get_transactions(
     days: int = Query(1, ge=1, le=30, description="How many days back to fetch data for"),
     limit: int = Query(20, gt=0),
@@ -512,7 +2800,7 @@ async def get_transactions(
     max_rows_needed = limit * 100
     offset = (page - 1) * limit
 
-    latest_row = session.execute("SELECT insert_date FROM alerts.transactions LIMIT 1").one()
+    latest_row = (await execute_async_with_profile("SELECT insert_date FROM alerts.transactions LIMIT 1")).one()
     if not latest_row:
         return {"data": []}
 
@@ -540,7 +2828,7 @@ async def get_transactions(
             LIMIT {max_rows_needed}
         """
 
-        rows = session.execute(query, (query_date,))
+        rows = await fetch_all(query, (query_date,))
         for row in rows:
             result_data = {field: str(row.get(field)) for field in selected_fields}
             all_results.append(result_data)
@@ -553,73 +2841,53 @@ async def get_transactions(
     paginated_results = all_results[offset:offset + limit]
     return {"data": paginated_results}
 
-@app.get("/browse")
-async def browse_data(limit: int = 10):
-    api_start = time.perf_counter()
+BROWSE_FIELDS = [
+    "user_id", "event_date", "event_time", "event_type", "metadata", "session_id", "xml_blob"
+] + [f"field_{i}" for i in range(1, 100)]
+BROWSE_DATE_FIELDS = [
+    "field_6", "field_13", "field_20", "field_27", "field_34", "field_41", "field_48",
+    "field_55", "field_62", "field_69", "field_76", "field_83", "field_90", "field_97"
+]
 
-    selected_fields = [
-        "user_id", "event_date", "event_time", "event_type", "metadata", "session_id", "xml_blob"
-    ] + [f"field_{i}" for i in range(1, 100)]
 
-    #excluded_fields = ["dummy_field1", "dummy_field2"]
-    #selected_fields = [field for field in selected_fields if field not in excluded_fields]
+def browse_xml_blob(blob):
+    # /browse returns the parsed XML as a JSON string
+    if not blob:
+        return None
+    try:
+        xml_tree = ET.fromstring(blob.decode('utf-8'))
+        return json.dumps({elem.tag: elem.text for elem in xml_tree})
+    except Exception as e:
+        return {"error": f"Failed to parse XML: {str(e)}"}
 
-#    query = f"""
-#        SELECT {', '.join(selected_fields)}
-#        FROM user_events_with_100_fields
-#        LIMIT {limit}
-#    """
 
+def str_or_none(value):
+    return None if value is None else str(value)
 
-    query = f"""
-        SELECT {', '.join(selected_fields)}
+
+BROWSE_CONVERTERS = {
+    "user_id": str,
+    "event_date": str,
+    "xml_blob": browse_xml_blob,
+    **{field: str_or_none for field in BROWSE_DATE_FIELDS},
+}
+
+@router.get("/browse")
+async def browse_data(limit: int = 10):
+    api_start = time.perf_counter()
+
+    prepared, index = await prepare_read(f"""
+        SELECT {', '.join(BROWSE_FIELDS)}
         FROM eventlog.user_events_with_100_fields
         WHERE TOKEN(user_id) > TOKEN(now())
-        LIMIT {limit}
-    """
-
+        LIMIT ?
+    """)
 
     db_start = time.perf_counter()
-    rows = session.execute(query)
+    rows = await fetch_all(prepared.bind((limit,)), profile=PROFILE_ANALYTICS, tuples=True)
     db_end = time.perf_counter()
 
-    results = []
-
-    date_fields = [
-        "event_date", "field_6", "field_13", "field_20", "field_27", "field_34", "field_41", "field_48",
-        "field_55", "field_62", "field_69", "field_76", "field_83", "field_90", "field_97"
-    ]
-
-    for row in rows:
-        xml_data = None
-        if row.get('xml_blob'):
-            try:
-                xml_str = row['xml_blob'].decode('utf-8')
-                xml_tree = ET.fromstring(xml_str)
-                xml_data = {elem.tag: elem.text for elem in xml_tree}
-                xml_data = json.dumps(xml_data)
-            except Exception as e:
-                xml_data = {"error": f"Failed to parse XML: {str(e)}"}
-
-        result_data = {
-            "user_id": str(row.get("user_id")),
-            "event_date": str(row.get("event_date")),
-            "event_time": row.get("event_time"),
-            "event_type": row.get("event_type"),
-            "metadata": row.get("metadata"),
-            "session_id": row.get("session_id"),
-            "xml_blob": xml_data,
-        }
-
-        for key in selected_fields[7:]:  # From field_1 onward
-            result_data[key] = row.get(key)
-
-        # Force convert known date fields
-        for field in date_fields:
-            if field in result_data and result_data[field] is not None:
-                result_data[field] = str(result_data[field])
-
-        results.append(result_data)
+    results = await serialize_rows(rows, index, BROWSE_FIELDS, BROWSE_CONVERTERS)
 
     api_end = time.perf_counter()
 
@@ -632,71 +2900,690 @@ async def browse_data(limit: int = 10):
         }
     }
 
-@app.get("/alerts")
-async def get_alerts(
-    days: int = Query(1, ge=1, le=30),
-    status: str = Query("all", description="Filter by status: new, open, closed, or all"),
-    limit: int = Query(20, gt=0),
-    page: int = Query(1, ge=1)
-):
-    selected_fields = [
-        "alert_date", "status", "create_timestamp", "alert_id", "region", "tenant", "score", "alert_type", "alert_description",
-        "account_number", "amount", "first_name", "last_name",
-        "reviewed", "severity", "transaction_key", "transaction_timestamp"
-    ]
+@router.get("/alerts")
+async def get_alerts(
+    days: int = Query(1, ge=1, le=30),
+    status: str = Query("all", description="Filter by status: new, open, closed, or all"),
+    limit: int = Query(20, gt=0),
+    page: int = Query(1, ge=1)
+):
+    selected_fields = ALERT_FIELDS
+    status_values = list(ALERT_STATUSES) if status == "all" else [status.lower()]
+    offset = (page - 1) * limit
+    max_rows_needed = limit * 100
+
+    # Serve from the in-memory hot window when it holds the whole requested range; its
+    # days are UTC days, like the alert writer's timestamps
+    end_date = datetime.datetime.utcnow().date()
+    start_date = end_date - datetime.timedelta(days=days - 1)
+    if recent_alerts.covers(datetime.datetime.combine(start_date, datetime.time.min)):
+        all_results = [
+            {field: (val if field == "reviewed" else str(val) if val is not None else None)
+             for field, val in zip(selected_fields, alert_field_values(record))}
+            for record in recent_alerts.query(status_values, end_date, days, offset + limit)
+        ]
+        return {"data": all_results[offset:offset + limit]}
+
+    try:
+        # Try one known partition to fetch latest date safely
+        result = (await execute_async_with_profile("""
+            SELECT alert_date FROM alerts.alerts_by_status
+            WHERE status = 'new' LIMIT 1
+        """)).one()
+
+        end_date = result.alert_date if result and result.alert_date else datetime.datetime.utcnow().date()
+    except Exception:
+        end_date = datetime.datetime.utcnow().date()
+
+    start_date = end_date - datetime.timedelta(days=days - 1)
+    all_results = []
+
+    for i in range(days):
+        query_date = end_date - datetime.timedelta(days=i)
+
+        for stat in status_values:
+            try:
+                rows = await read_alerts_by_status_async(stat, query_date, max_rows_needed, selected_fields)
+            except Exception:
+                continue
+
+            for row in rows:
+                result_data = {}
+                for field in selected_fields:
+                    val = row.get(field)
+                    if field == "reviewed":
+                        result_data[field] = val
+                    else:
+                        result_data[field] = str(val) if val is not None else None
+                all_results.append(result_data)
+
+                if len(all_results) >= max_rows_needed:
+                    break
+
+            if len(all_results) >= max_rows_needed:
+                break
+
+    paginated_results = all_results[offset:offset + limit]
+    return {"data": paginated_results}
+
+class BucketCountRequest(BaseModel):
+    bucket_count: int
+
+@router.put("/alerts/buckets/{alert_date}")
+def set_alert_bucket_count(alert_date: date, request: BucketCountRequest):
+    # Only future days can be sharded, so a day never mixes bucketed and unbucketed rows
+    if alert_date <= datetime.datetime.utcnow().date():
+        raise HTTPException(status_code=400, detail="Bucket count can only be set for future days")
+    if not 1 <= request.bucket_count <= 256:
+        raise HTTPException(status_code=400, detail="bucket_count must be between 1 and 256")
+
+    result = session.execute(prepared_alert_bucket_count_insert, (alert_date, request.bucket_count),
+                             execution_profile=PROFILE_INTERACTIVE).one()
+    if not result["[applied]"] and result["bucket_count"] != request.bucket_count:
+        raise HTTPException(status_code=409, detail=f"Bucket count for {alert_date} is already {result['bucket_count']}")
+
+    with alert_bucket_lock:
+        alert_bucket_counts[alert_date] = (request.bucket_count, True, time.monotonic())
+    return {"alert_date": str(alert_date), "bucket_count": request.bucket_count}
+
+@router.get("/alerts/buckets/{alert_date}")
+async def get_alert_bucket_count(alert_date: date):
+    return {"alert_date": str(alert_date), "bucket_count": await alert_bucket_count_async(alert_date)}
+
+# Account lookups
+ACCOUNT_HYDRATION_CONCURRENCY = int(os.environ.get("ACCOUNT_HYDRATION_CONCURRENCY", "32"))
+
+
+async def hydrate_rows(prepared, keys):
+    # Fetch full rows for index entries concurrently, keeping the index order
+    limit = asyncio.Semaphore(ACCOUNT_HYDRATION_CONCURRENCY)
+
+    async def hydrate(key):
+        async with limit:
+            return (await execute_async_with_profile(prepared, key)).one()
+
+    rows = []
+    for result in await asyncio.gather(*[hydrate(key) for key in keys], return_exceptions=True):
+        if isinstance(result, Exception):
+            print(f"⚠️ Hydration read failed: {result}")
+            continue
+        if result:
+            rows.append({k: str(v) if v is not None else None for k, v in result.items()})
+    return rows
+
+@router.get("/account/{account_number}/alerts")
+async def get_account_alerts(account_number: str, limit: int = Query(100, gt=0, le=1000)):
+    index_rows = await fetch_all(f"""
+        SELECT alert_id FROM alerts.alerts_by_account
+        WHERE account_number = %s
+        LIMIT {limit}
+    """, (account_number,))
+    alerts = await hydrate_rows(prepared_alert_by_id_select, [(row["alert_id"],) for row in index_rows])
+
+    return {"account_number": account_number, "data": alerts}
+
+@router.get("/account/{account_number}/transactions")
+async def get_account_transactions(account_number: str, limit: int = Query(100, gt=0, le=1000)):
+    index_rows = await fetch_all(f"""
+        SELECT insert_date, insert_time, transaction_key FROM alerts.transactions_by_account
+        WHERE account_number = %s
+        LIMIT {limit}
+    """, (account_number,))
+    transactions = await hydrate_rows(
+        prepared_transaction_select,
+        [(row["insert_date"], row["insert_time"], row["transaction_key"]) for row in index_rows],
+    )
+
+    return {"account_number": account_number, "data": transactions}
+
+
+# Backfill of the account index from existing data, one job per process
+account_backfill = {
+    "state": "idle", "transactions_indexed": 0, "alerts_indexed": 0,
+    "started_at": None, "finished_at": None, "error": None,
+}
+account_backfill_lock = threading.Lock()
+ACCOUNT_BACKFILL_WRITE_CONCURRENCY = 32
+
+
+def backfill_index(scan_query, index_statement, to_params, counter):
+    with in_flight(PROFILE_ANALYTICS):
+        rows = session.execute(profile_statement(scan_query, PROFILE_ANALYTICS), execution_profile=PROFILE_ANALYTICS)
+        page = []
+        for row in rows:
+            if row.get("account_number") is None:
+                continue
+            page.append(to_params(row))
+            if len(page) >= PROFILE_SETTINGS[PROFILE_ANALYTICS]["fetch_size"]:
+                execute_concurrent_with_args(session, index_statement, page,
+                                             concurrency=ACCOUNT_BACKFILL_WRITE_CONCURRENCY,
+                                             execution_profile=PROFILE_INGEST)
+                account_backfill[counter] += len(page)
+                page = []
+        if page:
+            execute_concurrent_with_args(session, index_statement, page,
+                                         concurrency=ACCOUNT_BACKFILL_WRITE_CONCURRENCY,
+                                         execution_profile=PROFILE_INGEST)
+            account_backfill[counter] += len(page)
+
+
+def run_account_backfill():
+    try:
+        backfill_index(
+            "SELECT account_number, insert_time, transaction_key, insert_date FROM alerts.transactions",
+            prepared_transaction_account_index,
+            lambda row: (row["account_number"], row["insert_time"], row["transaction_key"], row["insert_date"]),
+            "transactions_indexed",
+        )
+        backfill_index(
+            "SELECT account_number, create_timestamp, alert_id, alert_date, transaction_key FROM alerts.alerts_by_id",
+            prepared_alert_account_index,
+            lambda row: (row["account_number"], row["create_timestamp"], row["alert_id"],
+                         row["alert_date"], row["transaction_key"]),
+            "alerts_indexed",
+        )
+        # Recorded in Cassandra, so every worker (and the re-scoring job) can tell the
+        # index now covers alerts written before it existed
+        completed_at = datetime.datetime.utcnow()
+        session.execute(prepared_index_backfill_insert,
+                        ("transactions_by_account", completed_at, account_backfill["transactions_indexed"]),
+                        execution_profile=PROFILE_INGEST)
+        session.execute(prepared_index_backfill_insert,
+                        ("alerts_by_account", completed_at, account_backfill["alerts_indexed"]),
+                        execution_profile=PROFILE_INGEST)
+        account_backfill["state"] = "done"
+        print(f"✅ Account index backfill done: {account_backfill['transactions_indexed']} transactions, "
+              f"{account_backfill['alerts_indexed']} alerts")
+    except Exception as e:
+        account_backfill["state"] = "failed"
+        account_backfill["error"] = str(e)
+        print(f"❌ Account index backfill failed: {e}")
+    finally:
+        account_backfill["finished_at"] = datetime.datetime.utcnow().isoformat()
+
+@router.post("/account-index/backfill")
+def start_account_backfill():
+    with account_backfill_lock:
+        if account_backfill["state"] == "running":
+            raise HTTPException(status_code=409, detail="Backfill already running")
+        account_backfill.update({
+            "state": "running", "transactions_indexed": 0, "alerts_indexed": 0,
+            "started_at": datetime.datetime.utcnow().isoformat(), "finished_at": None, "error": None,
+        })
+    threading.Thread(target=run_account_backfill, name="account-backfill", daemon=True).start()
+    return account_backfill
+
+@router.get("/account-index/backfill")
+def get_account_backfill():
+    return account_backfill
+
+
+# Historical re-scoring
+# Re-applies the current alert rules (score_alert) to alerts.transactions, e.g. after a
+# threshold change. The token ring is split into RESCORE_SPLITS ranges that
+# RESCORE_PARALLELISM threads scan in parallel. Each range checkpoints its paging_state in
+# alerts.rescore_checkpoints after every page, so starting a job again with the same
+# job_id resumes where it stopped. New alerts, and alerts whose score, severity, type or
+# description changed, are written by the scan thread (write_alerts) before the page is
+# checkpointed, so a crash never skips past unwritten alerts. Changed alerts keep their
+# alert_id, create_timestamp, status and reviewed flag. Alerts the current rules would no
+# longer raise are only counted, never deleted. A dry run writes nothing but the checkpoints.
+# Existing alerts are found through alerts_by_account, so a job only starts once the
+# account index backfill (POST /account-index/backfill) has completed; without it alerts
+# older than the index would be taken for missing and raised again.
+RESCORE_SPLITS = int(os.environ.get("RESCORE_SPLITS", "256"))
+RESCORE_PARALLELISM = int(os.environ.get("RESCORE_PARALLELISM", "4"))
+RESCORE_ROWS_PER_SECOND = float(os.environ.get("RESCORE_ROWS_PER_SECOND", "2000"))  # <= 0: unthrottled
+RESCORE_LOOKUP_CONCURRENCY = 32
+RESCORE_SAMPLE_SIZE = 20
+RESCORE_SCAN_QUERY = """
+    SELECT insert_date, insert_time, transaction_key, account_number, amount,
+           first_name, last_name, field_2, field_3, field_5
+    FROM alerts.transactions
+    WHERE TOKEN(insert_date) > %s AND TOKEN(insert_date) <= %s
+"""
+RESCORED_FIELDS = ("score", "severity", "alert_type", "alert_description")
+
+rescore_job = {
+    "state": "idle", "job_id": None, "dry_run": None, "ranges_total": 0, "ranges_done": 0,
+    "rows_scanned": 0, "rows_per_second": 0, "new_alerts": 0, "changed_alerts": 0,
+    "cleared_alerts": 0, "unchanged_alerts": 0, "errors": 0, "sample": [],
+    "started_at": None, "finished_at": None, "error": None,
+}
+rescore_lock = threading.Lock()
+rescore_cancel = threading.Event()
+
+
+class RateLimiter:
+    # Token bucket shared by the scan threads; callers may overdraw and then wait it off
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            rescore_cancel.wait(wait)
+
+
+def rescore_stopping():
+    return rescore_cancel.is_set() or background_stop.is_set()
+
+
+def rescore_count(**deltas):
+    with rescore_lock:
+        for key, delta in deltas.items():
+            rescore_job[key] += delta
+
+
+def rescore_sample(kind, record, previous=None):
+    with rescore_lock:
+        if len(rescore_job["sample"]) < RESCORE_SAMPLE_SIZE:
+            rescore_job["sample"].append({
+                "kind": kind,
+                "alert_id": str(record.alert_id),
+                "transaction_key": str(record.transaction_key),
+                "before": {field: previous.get(field) for field in RESCORED_FIELDS} if previous else None,
+                "after": {field: getattr(record, field) for field in RESCORED_FIELDS} if kind != "cleared" else None,
+            })
+
+
+def existing_alerts(rows):
+    # Alerts already raised for these transactions, by transaction_key. alerts_by_account is
+    # clustered by create_timestamp, which the alert writer sets to the transaction time.
+    keys = [(row["account_number"], row["insert_time"]) for row in rows if row["account_number"] is not None]
+    index_hits = []
+    for success, result in execute_concurrent_with_args(session, prepared_alert_account_lookup, keys,
+                                                        concurrency=RESCORE_LOOKUP_CONCURRENCY,
+                                                        execution_profile=PROFILE_ANALYTICS):
+        index_hits.extend(result)
+
+    alerts = {}
+    for success, result in execute_concurrent_with_args(session, prepared_alert_by_id_select,
+                                                        [(hit["alert_id"],) for hit in index_hits],
+                                                        concurrency=RESCORE_LOOKUP_CONCURRENCY,
+                                                        execution_profile=PROFILE_ANALYTICS):
+        row = result.one()
+        if row:
+            alerts.setdefault(row["transaction_key"], []).append(row)
+    return alerts
+
+
+def unbucketed_alerts(writes):
+    # Ids of re-scored alerts on sharded days whose status row is still in alerts_by_status
+    # (written before the day was sharded): updating it there keeps one row per alert,
+    # where a bucketed write would add a second copy for the merged reads to return
+    keys = [(record.status, record.alert_date, record.create_timestamp, record.alert_id)
+            for record, is_new in writes if not is_new and alert_bucket_count(record.alert_date) > 1]
+    found = set()
+    for success, result in execute_concurrent_with_args(session, prepared_alert_status_lookup, keys,
+                                                        concurrency=RESCORE_LOOKUP_CONCURRENCY,
+                                                        execution_profile=PROFILE_ANALYTICS):
+        found.update(row["alert_id"] for row in result)
+    return found
+
+
+def rescore_page(rows):
+    # Returns the (record, is_new) alert writes the page calls for
+    alerts = existing_alerts(rows)
+    writes = []
+    counts = {"new_alerts": 0, "changed_alerts": 0, "cleared_alerts": 0, "unchanged_alerts": 0, "errors": 0}
+    for row in rows:
+        fields = {k: v for k, v in row.items() if v is not None}
+        try:
+            fields.setdefault("first_name", None)
+            fields.setdefault("last_name", None)
+            scored = score_alert(fields, row["insert_time"])
+        except Exception as e:
+            print(f"⚠️ Re-scoring skipped transaction {row.get('transaction_key')}: {e}")
+            counts["errors"] += 1
+            continue
+
+        previous = alerts.get(row["transaction_key"], [])
+        if scored is None:
+            counts["cleared_alerts"] += len(previous)
+            for alert in previous:
+                rescore_sample("cleared", alert_record_from_row(alert), alert)
+            continue
+        if not previous:
+            counts["new_alerts"] += 1
+            rescore_sample("new", scored)
+            writes.append((scored, True))
+            continue
+
+        for alert in previous:
+            if all(alert[field] == getattr(scored, field) for field in RESCORED_FIELDS):
+                counts["unchanged_alerts"] += 1
+                continue
+            record = alert_record_from_row(alert, **{field: getattr(scored, field) for field in RESCORED_FIELDS})
+            counts["changed_alerts"] += 1
+            rescore_sample("changed", record, alert)
+            writes.append((record, False))
+
+    rescore_count(**counts)
+    return writes
+
+
+def rescore_range(job_id, dry_run, limiter, checkpoint):
+    range_start, range_end = checkpoint["range_start"], checkpoint["range_end"]
+    rows_scanned = checkpoint["rows_scanned"] or 0
+
+    for rows, paging_state in iter_pages(RESCORE_SCAN_QUERY, (range_start, range_end), checkpoint["paging_state"]):
+        if rescore_stopping():
+            return
+        limiter.acquire(len(rows))
+
+        writes = rescore_page(rows)
+        if writes and not dry_run:
+            batch_size, concurrency = alert_write_limits.limits()
+            written = write_alerts(writes, len(writes) >= batch_size * concurrency, unbucketed_alerts(writes))
+            if len(written) < len(writes):
+                # Fails the job; resuming it re-scores this page from the last checkpoint
+                raise RuntimeError(f"{len(writes) - len(written)} of {len(writes)} re-scored alerts were not written")
+        rows_scanned += len(rows)
+        rescore_count(rows_scanned=len(rows))
+
+        # Checkpoint only after the page's alerts are written
+        done = paging_state is None
+        session.execute(prepared_rescore_checkpoint_insert,
+                        (job_id, range_start, range_end, paging_state, done, dry_run, rows_scanned),
+                        execution_profile=PROFILE_INGEST)
+        if done:
+            rescore_count(ranges_done=1)
+            return
+
+
+def token_ranges(splits):
+    step = (MURMUR3_MAX_TOKEN - MURMUR3_MIN_TOKEN) // splits
+    bounds = [MURMUR3_MIN_TOKEN + i * step for i in range(splits)] + [MURMUR3_MAX_TOKEN]
+    return list(zip(bounds, bounds[1:]))
+
 
+def load_rescore_checkpoints(job_id, dry_run):
+    checkpoints = list(session.execute(prepared_rescore_checkpoint_select, (job_id,),
+                                       execution_profile=PROFILE_INTERACTIVE))
+    if not checkpoints:
+        # New job: record every range up front so a resume knows the full split
+        checkpoints = [
+            {"range_start": lo, "range_end": hi, "paging_state": None, "done": False,
+             "dry_run": dry_run, "rows_scanned": 0}
+            for lo, hi in token_ranges(RESCORE_SPLITS)
+        ]
+        execute_concurrent_with_args(session, prepared_rescore_checkpoint_insert, [
+            (job_id, c["range_start"], c["range_end"], None, False, dry_run, 0) for c in checkpoints
+        ], concurrency=RESCORE_LOOKUP_CONCURRENCY, execution_profile=PROFILE_INGEST)
+    elif checkpoints[0]["dry_run"] != dry_run:
+        mode = "a dry run" if checkpoints[0]["dry_run"] else "a live run"
+        raise HTTPException(status_code=409, detail=f"Job {job_id} was started as {mode}")
+    return checkpoints
+
+
+def account_index_backfilled():
+    row = session.execute(prepared_index_backfill_select, ("alerts_by_account",),
+                          execution_profile=PROFILE_INTERACTIVE).one()
+    return row is not None
+
+
+def run_rescore(job_id, dry_run, checkpoints, rows_per_second):
+    limiter = RateLimiter(rows_per_second)
+    started = time.monotonic()
+    pending = [c for c in checkpoints if not c["done"]]
+    error = None
+    executor = ThreadPoolExecutor(max_workers=RESCORE_PARALLELISM, thread_name_prefix="rescore")
     try:
-        # Try one known partition to fetch latest date safely
-        result = session.execute("""
-            SELECT alert_date FROM alerts.alerts_by_status
-            WHERE status = 'new' LIMIT 1
-        """).one()
-
-        end_date = result.alert_date if result and result.alert_date else datetime.date.today()
+        futures = [executor.submit(rescore_range, job_id, dry_run, limiter, c) for c in pending]
+        for future in futures:
+            future.result()
+    except Exception as e:
+        error = e
+        # The ranges in progress stop after their current page, the queued ones never start
+        rescore_cancel.set()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    rescore_job["finished_at"] = datetime.datetime.utcnow().isoformat()
+    rescore_job["rows_per_second"] = round(rescore_job["rows_scanned"] / max(time.monotonic() - started, 1e-3))
+    if error is not None:
+        rescore_job["state"] = "failed"
+        rescore_job["error"] = str(error)
+        print(f"❌ Re-scoring {job_id} failed: {error}")
+        return
+    rescore_job["state"] = "cancelled" if rescore_stopping() else "done"
+    print(f"✅ Re-scoring {job_id} {rescore_job['state']}: {rescore_job['rows_scanned']} transactions, "
+          f"{rescore_job['new_alerts']} new, {rescore_job['changed_alerts']} changed alerts")
+
+
+class RescoreRequest(BaseModel):
+    job_id: Optional[str] = None  # an existing job_id resumes that job from its checkpoints
+    dry_run: bool = True
+    rows_per_second: Optional[float] = None
+
+@router.post("/rescore")
+def start_rescore(request: RescoreRequest):
+    job_id = request.job_id or datetime.datetime.utcnow().strftime("rescore-%Y%m%d-%H%M%S")
+    with rescore_lock:
+        if rescore_job["state"] in ("starting", "running"):
+            raise HTTPException(status_code=409, detail="A re-scoring job is already running")
+        rescore_job["state"] = "starting"
+    try:
+        if not account_index_backfilled():
+            raise HTTPException(status_code=409, detail="The alerts_by_account index has not been backfilled, "
+                                                        "run POST /account-index/backfill first")
+        checkpoints = load_rescore_checkpoints(job_id, request.dry_run)
     except Exception:
-        end_date = datetime.date.today()
+        rescore_job["state"] = "idle"
+        raise
+
+    rescore_cancel.clear()
+    with rescore_lock:
+        rescore_job.update({
+            "state": "running", "job_id": job_id, "dry_run": request.dry_run,
+            "ranges_total": len(checkpoints), "ranges_done": sum(1 for c in checkpoints if c["done"]),
+            "rows_scanned": 0, "rows_per_second": 0, "new_alerts": 0, "changed_alerts": 0,
+            "cleared_alerts": 0, "unchanged_alerts": 0, "errors": 0, "sample": [],
+            "started_at": datetime.datetime.utcnow().isoformat(), "finished_at": None, "error": None,
+        })
+    rows_per_second = RESCORE_ROWS_PER_SECOND if request.rows_per_second is None else request.rows_per_second
+    threading.Thread(target=run_rescore, args=(job_id, request.dry_run, checkpoints, rows_per_second),
+                     name="rescore", daemon=True).start()
+    return rescore_job
+
+@router.get("/rescore")
+def get_rescore():
+    if rescore_job["state"] == "running":
+        elapsed = (datetime.datetime.utcnow() - datetime.datetime.fromisoformat(rescore_job["started_at"])).total_seconds()
+        rescore_job["rows_per_second"] = round(rescore_job["rows_scanned"] / max(elapsed, 1e-3))
+    return rescore_job
+
+@router.delete("/rescore")
+def cancel_rescore():
+    # Ranges stop after their current page; POST the same job_id to resume
+    rescore_cancel.set()
+    return rescore_job
+
+
+# Bulk export
+# Streams a date range of alerts or transactions as CSV or Parquet. Partitions are read
+# page by page with the driver's paging state and each page is encoded and sent before the
+# next one is fetched (one Parquet row group per page), so memory stays flat however many
+# rows are exported. Filters that are not part of the partition key (tenant) are applied
+# while streaming.
+EXPORT_MAX_DAYS = int(os.environ.get("EXPORT_MAX_DAYS", "366"))
+EXPORT_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+ALERT_EXPORT_COLUMNS = [
+    ("alert_date", "date"), ("status", "text"), ("create_timestamp", "timestamp"), ("alert_id", "uuid"),
+    ("region", "text"), ("tenant", "int"), ("score", "int"), ("alert_type", "text"),
+    ("alert_description", "text"), ("account_number", "text"), ("amount", "double"),
+    ("first_name", "text"), ("last_name", "text"), ("reviewed", "boolean"), ("severity", "text"),
+    ("transaction_key", "uuid"), ("transaction_timestamp", "timestamp"),
+]
+TRANSACTION_EXPORT_COLUMNS = [
+    ("transaction_key", "uuid"), ("session_id", "uuid"), ("insert_date", "date"), ("insert_time", "timestamp"),
+    ("account_number", "text"), ("amount", "double"), ("first_name", "text"), ("last_name", "text"),
+] + list(TRANSACTION_FIELD_TYPES.items())
+
+
+def export_value(value):
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, CassandraDate):
+        return value.date()
+    return value
+
+
+class ExportSink(io.RawIOBase):
+    # Write-only file that hands back whatever was written since the last drain
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def csv_export(pages, columns):
+    names = [name for name, _ in columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for rows in pages:
+        for row in rows:
+            writer.writerow(["" if row.get(name) is None else export_value(row.get(name)) for name in names])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
 
-    start_date = end_date - datetime.timedelta(days=days - 1)
-    offset = (page - 1) * limit
-    max_rows_needed = limit * 100
-    all_results = []
 
-    for i in range(days):
-        query_date = end_date - datetime.timedelta(days=i)
-        status_values = ["new", "open", "closed"] if status == "all" else [status.lower()]
+PARQUET_TYPES = {
+    "text": "string", "int": "int32", "bigint": "int64", "uuid": "string", "date": "date32",
+    "timestamp": "timestamp[ms]", "double": "float64", "boolean": "bool",
+}
 
-        for stat in status_values:
-            query = f"""
-                SELECT {', '.join(selected_fields)}
-                FROM alerts.alerts_by_status
-                WHERE status = %s AND alert_date = %s
-                LIMIT {max_rows_needed}
-            """
-            try:
-                rows = session.execute(query, (stat, query_date))
-            except Exception:
-                continue
 
-            for row in rows:
-                result_data = {}
-                for field in selected_fields:
-                    val = row.get(field)
-                    if field == "reviewed":
-                        result_data[field] = val
-                    else:
-                        result_data[field] = str(val) if val is not None else None
-                all_results.append(result_data)
+def parquet_export(pages, columns):
+    schema = pyarrow.schema([(name, pyarrow.type_for_alias(PARQUET_TYPES[cql_type])) for name, cql_type in columns])
+    sink = ExportSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for rows in pages:
+            if rows:
+                writer.write_table(pyarrow.Table.from_pydict({
+                    name: [export_value(row.get(name)) for row in rows] for name, _ in columns
+                }, schema=schema))
+                yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
 
-                if len(all_results) >= max_rows_needed:
-                    break
 
-            if len(all_results) >= max_rows_needed:
-                break
+def export_response(kind, pages, columns, export_format, start_date, end_date):
+    encode = csv_export if export_format == "csv" else parquet_export
 
-    paginated_results = all_results[offset:offset + limit]
-    return {"data": paginated_results}
+    def stream():
+        try:
+            yield from encode(pages, columns)
+        except Exception as e:
+            # Headers are already sent; the client sees a truncated file
+            print(f"❌ {kind} export {start_date}..{end_date} aborted: {e}")
+            raise
+
+    filename = f"{kind}_{start_date}_{end_date}.{export_format}"
+    return StreamingResponse(stream(), media_type=EXPORT_FORMATS[export_format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+def export_days(start_date, end_date, export_format):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if export_format == "parquet" and pyarrow is None:
+        raise HTTPException(status_code=406, detail="Parquet export is not available on this server")
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date is before start_date")
+    days = (end_date - start_date).days + 1
+    if days > EXPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Export at most {EXPORT_MAX_DAYS} days at a time")
+    return [start_date + datetime.timedelta(days=i) for i in range(days)]
+
+
+def alert_export_pages(days, statuses, tenant):
+    fields = ", ".join(name for name, _ in ALERT_EXPORT_COLUMNS)
+    for day in days:
+        bucket_count = alert_bucket_count(day)
+        for status in statuses:
+            # A sharded day can still hold unbucketed rows, written before it was sharded
+            partitions = [(f"SELECT {fields} FROM alerts.alerts_by_status WHERE status = %s AND alert_date = %s",
+                           (status, day))]
+            if bucket_count > 1:
+                partitions += [(f"SELECT {fields} FROM alerts.alerts_by_status_bucketed "
+                                f"WHERE status = %s AND alert_date = %s AND bucket = %s", (status, day, bucket))
+                               for bucket in range(bucket_count)]
+            for query, parameters in partitions:
+                for rows, _ in iter_pages(query, parameters):
+                    yield rows if tenant is None else [row for row in rows if row["tenant"] == tenant]
+
+
+def transaction_export_pages(days, tenant):
+    fields = ", ".join(name for name, _ in TRANSACTION_EXPORT_COLUMNS)
+    for day in days:
+        for rows, _ in iter_pages(f"SELECT {fields} FROM alerts.transactions WHERE insert_date = %s", (day,)):
+            if tenant is not None:
+                rows = [row for row in rows if (row["field_5"] if row["field_5"] is not None else 1) == tenant]
+            yield rows
+
+
+@router.get("/export/alerts")
+def export_alerts(
+    start_date: date,
+    end_date: date = Query(None, description="Defaults to start_date"),
+    status: str = Query("all", description="Filter by status: new, open, closed, or all"),
+    tenant: Optional[int] = None,
+    format: str = Query("csv", description="csv or parquet"),
+):
+    end_date = end_date or start_date
+    days = export_days(start_date, end_date, format)
+    statuses = list(ALERT_STATUSES) if status == "all" else [status.lower()]
+    if not set(statuses) <= set(ALERT_STATUSES):
+        raise HTTPException(status_code=400, detail=f"Unknown status {status}")
+    return export_response("alerts", alert_export_pages(days, statuses, tenant), ALERT_EXPORT_COLUMNS,
+                           format, start_date, end_date)
+
+
+@router.get("/export/transactions")
+def export_transactions(
+    start_date: date,
+    end_date: date = Query(None, description="Defaults to start_date"),
+    tenant: Optional[int] = None,
+    format: str = Query("csv", description="csv or parquet"),
+):
+    end_date = end_date or start_date
+    days = export_days(start_date, end_date, format)
+    return export_response("transactions", transaction_export_pages(days, tenant), TRANSACTION_EXPORT_COLUMNS,
+                           format, start_date, end_date)
 
-@app.get("/alert/{alert_id}")
+@router.get("/alert/{alert_id}")
 async def get_alert_with_transaction(alert_id: str):
     alert_uuid = UUID(alert_id)
 
@@ -704,7 +3591,7 @@ async def get_alert_with_transaction(alert_id: str):
         SELECT * FROM alerts.alerts_by_id
         WHERE alert_id = %s
     """
-    alert_row = session.execute(alert_query, (alert_uuid,)).one()
+    alert_row = (await execute_async_with_profile(alert_query, (alert_uuid,))).one()
     if not alert_row:
         raise HTTPException(status_code=404, detail="Alert not found")
 
@@ -720,7 +3607,7 @@ async def get_alert_with_transaction(alert_id: str):
             SELECT * FROM alerts.transactions
             WHERE insert_date = %s AND insert_time = %s AND transaction_key = %s
         """
-        trans_row = session.execute(trans_query, (insert_date, insert_time, transaction_key)).one()
+        trans_row = (await execute_async_with_profile(trans_query, (insert_date, insert_time, transaction_key))).one()
 
         if trans_row:
             transaction = {k: str(v) if v is not None else None for k, v in trans_row.items()}
@@ -730,14 +3617,14 @@ async def get_alert_with_transaction(alert_id: str):
     return {"alert": alert, "transaction": transaction}
 
 
-@app.patch("/alert/{alert_id}/reviewed")
+@router.patch("/alert/{alert_id}/reviewed")
 async def mark_alert_reviewed(alert_id: str):
     alert_uuid = UUID(alert_id)
 
     # Step 1: Fetch alert from alerts_by_id to get current data
-    row = session.execute("""
+    row = (await execute_async_with_profile("""
         SELECT * FROM alerts.alerts_by_id WHERE alert_id = %s
-    """, [alert_uuid]).one()
+    """, [alert_uuid])).one()
 
     if not row:
         return {"error": "Alert not found"}
@@ -745,53 +3632,43 @@ async def mark_alert_reviewed(alert_id: str):
     alert_date = row["alert_date"]
     create_timestamp = row["create_timestamp"]
     old_status = row["status"]
+    bucket_count = await alert_bucket_count_async(alert_date)
 
     print(f"🧹 Deleting old row from alerts_by_status with status={old_status}, date={alert_date}, ts={create_timestamp}, id={alert_uuid}")
 
     # Step 2: Delete old row in alerts_by_status (using old status!)
-    session.execute("""
-        DELETE FROM alerts.alerts_by_status
-        WHERE status = %s AND alert_date = %s AND create_timestamp = %s AND alert_id = %s
-    """, (old_status, alert_date, create_timestamp, alert_uuid))
+    for statement, params in alert_status_delete(old_status, alert_date, create_timestamp, alert_uuid,
+                                                 bucket_count=bucket_count):
+        await execute_async_with_profile(statement, params, idempotent=False)
     print("✅ Deleted old row. Now inserting new row with status=open")
 
     # Step 3: Insert new row into alerts_by_status with updated status
     new_status = "open"
-    session.execute("""
-        INSERT INTO alerts.alerts_by_status (
-            status, alert_date, create_timestamp, alert_id, tenant, score,
-            account_number, alert_description, alert_type, amount,
-            first_name, last_name, reviewed, severity,
-            transaction_key, transaction_timestamp
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, (
-        new_status, alert_date, create_timestamp, alert_uuid,
-        row["tenant"], row["score"],
-        row["account_number"], row["alert_description"], row["alert_type"],
-        row["amount"], row["first_name"], row["last_name"], True,
-        row["severity"], row["transaction_key"], row["transaction_timestamp"]
-    ))
+    await execute_async_with_profile(*alert_status_insert(alert_record_from_row(row, status=new_status, reviewed=True),
+                                                          bucket_count=bucket_count), idempotent=False)
     print("✅ Inserted new 'open' row.")
 
     # Step 4: Update alerts_by_id (still the same PK)
-    session.execute("""
+    await execute_async_with_profile("""
         UPDATE alerts.alerts_by_id
         SET reviewed = true, status = %s
         WHERE alert_id = %s
-    """, (new_status, alert_uuid))
+    """, (new_status, alert_uuid), idempotent=False)
     print("✅ Updated alerts_by_id")
+    recent_alerts.set_status(alert_uuid, new_status, reviewed=True)
+    await execute_async_with_profile(*log_status_change(alert_uuid, new_status, reviewed=True), idempotent=False)
 
     return {"status": "ok"}
 
-@app.get("/alert/{alert_id}/transaction")
-def get_transaction_for_alert(alert_id: str):
+@router.get("/alert/{alert_id}/transaction")
+async def get_transaction_for_alert(alert_id: str):
     try:
         # Step 1: Lookup alert to find transaction_key, insert_date, and insert_time
-        alert_row = session.execute("""
+        alert_row = (await execute_async_with_profile("""
             SELECT transaction_key, alert_date, transaction_timestamp
             FROM alerts.alerts_by_id
             WHERE alert_id = %s
-        """, (uuid.UUID(alert_id),)).one()
+        """, (uuid.UUID(alert_id),))).one()
 
         if not alert_row:
             raise HTTPException(status_code=404, detail="Alert not found")
@@ -801,10 +3678,10 @@ def get_transaction_for_alert(alert_id: str):
         insert_time = alert_row["transaction_timestamp"]  # same as insert_time in transactions
 
         # Step 2: Fetch the transaction by full primary key
-        txn_row = session.execute("""
+        txn_row = (await execute_async_with_profile("""
             SELECT * FROM alerts.transactions
             WHERE insert_date = %s AND insert_time = %s AND transaction_key = %s
-        """, (insert_date, insert_time, transaction_key)).one()
+        """, (insert_date, insert_time, transaction_key))).one()
 
         if not txn_row:
             raise HTTPException(status_code=404, detail="Transaction not found")
@@ -818,15 +3695,15 @@ def get_transaction_for_alert(alert_id: str):
 
 from cassandra.query import BatchStatement
 
-@app.patch("/alert/{alert_id}/status")
+@router.patch("/alert/{alert_id}/status")
 async def update_alert_status(alert_id: str, status_update: StatusUpdateRequest):
     alert_uuid = UUID(alert_id)
     new_status = status_update.status  # Now using the status from the request body
 
     # Step 1: Fetch alert from alerts_by_id to get current data
-    row = session.execute("""
+    row = (await execute_async_with_profile("""
         SELECT * FROM alerts.alerts_by_id WHERE alert_id = %s
-    """, [alert_uuid]).one()
+    """, [alert_uuid])).one()
 
     if not row:
         return {"error": "Alert not found"}
@@ -836,6 +3713,7 @@ async def update_alert_status(alert_id: str, status_update: StatusUpdateRequest)
     old_status = row["status"]
 
     if old_status != new_status:
+        bucket_count = await alert_bucket_count_async(alert_date)
         print(f"🧹 Deleting old row from alerts_by_status with status={old_status}, date={alert_date}, ts={create_timestamp}, id={alert_uuid}")
 
         # Create a batch statement for consistency
@@ -843,99 +3721,265 @@ async def update_alert_status(alert_id: str, status_update: StatusUpdateRequest)
         batch = BatchStatement(batch_type=BatchType.UNLOGGED)
         
         # Delete old row from alerts_by_status
-        delete_query = session.prepare("""
-            DELETE FROM alerts.alerts_by_status
-            WHERE status = ? AND alert_date = ? AND create_timestamp = ? AND alert_id = ?
-        """)
-        batch.add(delete_query, (old_status, alert_date, create_timestamp, alert_uuid))
+        for statement, params in alert_status_delete(old_status, alert_date, create_timestamp, alert_uuid,
+                                                     bucket_count=bucket_count):
+            batch.add(statement, params)
 
         # Insert new row into alerts_by_status with updated status
-        insert_query = session.prepare("""
-            INSERT INTO alerts.alerts_by_status (
-                status, alert_date, create_timestamp, alert_id, region, tenant, score,
-                account_number, alert_description, alert_type, amount,
-                first_name, last_name, reviewed, severity,
-                transaction_key, transaction_timestamp
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """)
-        batch.add(insert_query, (
-            new_status, alert_date, create_timestamp, alert_uuid,
-            row["region"], row["tenant"], row["score"],
-            row["account_number"], row["alert_description"], row["alert_type"],
-            row["amount"], row["first_name"], row["last_name"], row["reviewed"],
-            row["severity"], row["transaction_key"], row["transaction_timestamp"]
-        ))
+        batch.add(*alert_status_insert(alert_record_from_row(row, status=new_status), bucket_count=bucket_count))
 
         # Update alerts_by_id with new status
-        update_query = session.prepare("""
-            UPDATE alerts.alerts_by_id
-            SET status = ?
-            WHERE alert_id = ?
-        """)
-        batch.add(update_query, (new_status, alert_uuid))
+        batch.add(prepared_alerts_by_id_status_update, (new_status, alert_uuid))
+
+        # Tell the other workers' hot windows
+        batch.add(*log_status_change(alert_uuid, new_status))
 
         # Execute the batch
-        session.execute(batch)
+        await execute_async_with_profile(batch, idempotent=False)
         print("✅ Batch update of alert status completed")
+        recent_alerts.set_status(alert_uuid, new_status)
 
     return {"status": "ok"}
 
 
-@app.get("/events/{user_id}")
-def get_user_events(user_id: str):
+# Paged event reads
+# /events/{user_id} and /events/full/{user_id} take optional since/until bounds on
+# (event_date, event_time). Without page_size the whole range is streamed page by page as
+# the driver fetches it; with page_size a single page is returned together with
+# next_cursor, the driver paging state in URL-safe base64, to pass back as cursor.
+EVENTS_MAX_PAGE_SIZE = 5000
+
+
+def encode_cursor(paging_state):
+    return base64.urlsafe_b64encode(paging_state).decode() if paging_state else None
+
+
+def decode_cursor(cursor):
+    try:
+        return base64.urlsafe_b64decode(cursor.encode())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def json_default(value):
+    # Same conversions FastAPI applies to the non-streamed responses
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+def parse_xml_blob(blob):
+    if not blob:
+        return None
+    try:
+        xml_tree = ET.fromstring(blob.decode('utf-8'))
+        return {elem.tag: elem.text for elem in xml_tree}
+    except Exception as e:
+        return {"error": f"Failed to parse XML: {str(e)}"}
+
+
+OFFLOADABLE_CONVERTERS = {parse_xml_blob, browse_xml_blob}
+
+
+async def serialize_rows(rows, index, fields, converters):
+    # A page of tuple rows -> response dicts; on big pages with the process pool running,
+    # the XML columns are parsed in the pool and filled in afterwards
+    offloaded = {}
+    if process_pool is not None and len(rows) >= OFFLOAD_MIN_ROWS:
+        offloaded = {field: convert for field, convert in converters.items() if convert in OFFLOADABLE_CONVERTERS}
+    serialize = row_serializer(index, fields, {f: c for f, c in converters.items() if f not in offloaded})
+    results = [serialize(row) for row in rows]
+    for field, convert in offloaded.items():
+        position = index[field]
+        for result, value in zip(results, await offload_map(convert, [row[position] for row in rows])):
+            result[field] = value
+    return results
+
+
+def event_range_query(selected_fields, since, until, marker="%s"):
+    # Query for one user's partition, bound on (event_date, event_time); the user_id is
+    # the first parameter, followed by the returned bound parameters. marker is "?" for
+    # a query to prepare.
+    if since and until and until < since:
+        raise HTTPException(status_code=400, detail="until is before since")
+    where, parameters = [f"user_id = {marker}"], []
+    if since:
+        where.append(f"(event_date, event_time) >= ({marker}, {marker})")
+        parameters += [since.date(), since]
+    if until:
+        where.append(f"(event_date, event_time) <= ({marker}, {marker})")
+        parameters += [until.date(), until]
+    query = f"""
+        SELECT {', '.join(selected_fields)}
+        FROM eventlog.user_events_with_100_fields
+        WHERE {' AND '.join(where)}
+    """
+    return query, parameters
+
+
+async def stream_user_events(user_id, selected_fields, converters, since, until, page_size, cursor):
     start_time = time.time()
     try:
         user_uuid = uuid.UUID(user_id)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
+    query, parameters = event_range_query(selected_fields, since, until, marker="?")
     uuid_validation_time = (time.time() - start_time) * 1000
 
-    query = """
-        SELECT user_id, event_date, event_time, event_type, metadata, session_id, xml_blob
-        FROM eventlog.user_events_with_100_fields
-        WHERE user_id = %s
-    """
+    prepared, index = await prepare_read(query)
+    pages = aiter_pages(prepared.bind([user_uuid] + parameters), None, decode_cursor(cursor) if cursor else None,
+                        profile=PROFILE_INTERACTIVE, tuples=True,
+                        fetch_size=page_size or PROFILE_SETTINGS[PROFILE_INTERACTIVE]["fetch_size"])
     db_start_time = time.time()
-    rows = session.execute(query, (user_uuid,))
+    try:
+        rows, paging_state = await anext(pages)
+    except (InvalidRequest, ProtocolException) as e:
+        if cursor:
+            # Paging states only fit the query (and bounds) they came from
+            raise HTTPException(status_code=400, detail=f"Cursor does not match this query: {e}")
+        raise
     db_query_time = (time.time() - db_start_time) * 1000
 
-    results = []
-    for row in rows:
-        xml_data = None
-        if row['xml_blob']:
-            try:
-                xml_str = row['xml_blob'].decode('utf-8')
-                xml_tree = ET.fromstring(xml_str)
-                xml_data = {elem.tag: elem.text for elem in xml_tree}
-            except Exception as e:
-                xml_data = {"error": f"Failed to parse XML: {str(e)}"}
-
-        results.append({
-            "user_id": str(row["user_id"]),
-            "event_date": str(row["event_date"]),
-            "event_time": row["event_time"],
-            "event_type": row["event_type"],
-            "metadata": row["metadata"],
-            "session_id": row["session_id"],
-            "xml_blob": xml_data,
-        })
-
-    if not results:
+    if not rows and paging_state is None and not cursor:
         raise HTTPException(status_code=404, detail="No events found for this user")
 
-    response_time = (time.time() - start_time) * 1000
+    async def stream():
+        nonlocal rows, paging_state
+        db_fetch_time = db_query_time
+        separator = b""
+        yield b'{"data": ['
+        while True:
+            for item in await serialize_rows(rows, index, selected_fields, converters):
+                yield separator + json.dumps(item, default=json_default).encode()
+                separator = b","
+            if page_size or paging_state is None:
+                break
+            fetch_start = time.time()
+            rows, paging_state = await anext(pages)
+            db_fetch_time += (time.time() - fetch_start) * 1000
+
+        response_time = (time.time() - start_time) * 1000
+        yield b"], " + json.dumps({
+            "next_cursor": encode_cursor(paging_state) if page_size else None,
+            "timing": {
+                "webToApi": uuid_validation_time,
+                "apiToDb": db_query_time,
+                "dbFetch": db_fetch_time,
+                "dbToWeb": response_time - (uuid_validation_time + db_fetch_time),
+            },
+        })[1:].encode()
+
+    return StreamingResponse(stream(), media_type="application/json")
+
+
+EVENT_SUMMARY_CONVERTERS = {"user_id": str, "event_date": str, "xml_blob": parse_xml_blob}
+
+
+# Multi-user fetch
+# POST /events/batch reads many users' partitions concurrently, at most
+# EVENT_BATCH_CONCURRENCY at a time, and streams one NDJSON line per user in completion
+# order, with that user's timing. A final line summarises the batch. Every read takes its
+# own interactive in-flight slot, so a batch counts against the profile budget like the
+# same reads sent separately; a read shed for lack of a slot is reported on its line.
+EVENT_BATCH_MAX_USERS = int(os.environ.get("EVENT_BATCH_MAX_USERS", "500"))
+EVENT_BATCH_CONCURRENCY = int(os.environ.get("EVENT_BATCH_CONCURRENCY", "32"))
+EVENT_BATCH_MAX_ROWS = 1000
+EVENT_SUMMARY_FIELDS = ["user_id", "event_date", "event_time", "event_type", "metadata", "session_id", "xml_blob"]
+
+
+class EventBatchRequest(BaseModel):
+    user_ids: List[str]
+    columns: Optional[List[str]] = None  # defaults to the /events/{user_id} columns
+    since: Optional[datetime.datetime] = None
+    until: Optional[datetime.datetime] = None
+    limit: int = 100  # events per user
+
+
+def event_batch_line(user_id, rows, error, columns, limit, queued_ms, db_ms):
+    line = {"user_id": str(user_id), "timing": {"queued": queued_ms, "db": db_ms}}
+    if error is not None:
+        line["error"] = str(error)
+    else:
+        line["count"] = len(rows)
+        line["truncated"] = len(rows) >= limit
+        line["events"] = [
+            {column: parse_xml_blob(row[column]) if column == "xml_blob" else row[column] for column in columns}
+            for row in rows
+        ]
+    return json.dumps(line, default=json_default).encode() + b"\n"
+
 
-    return {
-        "data": results,
-        "timing": {
-            "webToApi": uuid_validation_time,
-            "apiToDb": db_query_time,
-            "dbFetch": db_query_time,
-            "dbToWeb": response_time - (uuid_validation_time + db_query_time),
-        }
-    }
+@router.post("/events/batch")
+async def get_events_batch(request: EventBatchRequest):
+    if not request.user_ids:
+        raise HTTPException(status_code=400, detail="No user_ids given")
+    if len(request.user_ids) > EVENT_BATCH_MAX_USERS:
+        raise HTTPException(status_code=400, detail=f"At most {EVENT_BATCH_MAX_USERS} user_ids per batch")
+    if not 0 < request.limit <= EVENT_BATCH_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {EVENT_BATCH_MAX_ROWS}")
+    try:
+        user_uuids = list(dict.fromkeys(uuid.UUID(user_id) for user_id in request.user_ids))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+
+    columns = request.columns or EVENT_SUMMARY_FIELDS
+    unknown = [column for column in columns if column not in EVENT_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+    columns = list(dict.fromkeys(["user_id"] + columns))
+
+    query, parameters = event_range_query(columns, request.since, request.until)
+    statement = profile_statement(query + f" LIMIT {request.limit}", PROFILE_INTERACTIVE)
+    statement.fetch_size = request.limit  # one page per user
+
+    async def stream():
+        started = time.time()
+        limit = asyncio.Semaphore(EVENT_BATCH_CONCURRENCY)
+        failed = 0
+
+        async def read(user_uuid):
+            async with limit:
+                submitted = time.time()
+                try:
+                    result = await execute_async_with_profile(statement, [user_uuid] + parameters)
+                    rows, error = result.current_rows, None
+                except HTTPException as e:
+                    rows, error = None, e.detail
+                except Exception as e:
+                    rows, error = None, e
+                return user_uuid, submitted, time.time(), rows, error
+
+        reads = [asyncio.ensure_future(read(user_uuid)) for user_uuid in user_uuids]
+        try:
+            for completed in asyncio.as_completed(reads):
+                user_uuid, submitted, finished, rows, error = await completed
+                failed += error is not None
+                yield event_batch_line(user_uuid, rows, error, columns, request.limit,
+                                       (submitted - started) * 1000, (finished - submitted) * 1000)
+        finally:
+            for pending in reads:  # client disconnected: stop the reads not yet sent
+                pending.cancel()
+
+        yield json.dumps({"summary": {
+            "users": len(user_uuids), "failed": failed, "elapsed": (time.time() - started) * 1000,
+        }}).encode() + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.get("/events/{user_id}")
+async def get_user_events(
+    user_id: str,
+    since: Optional[datetime.datetime] = Query(None, description="Only events at or after this time"),
+    until: Optional[datetime.datetime] = Query(None, description="Only events at or before this time"),
+    page_size: Optional[int] = Query(None, gt=0, le=EVENTS_MAX_PAGE_SIZE, description="Return one page and a next_cursor"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+):
+    return await stream_user_events(user_id, EVENT_SUMMARY_FIELDS, EVENT_SUMMARY_CONVERTERS, since, until, page_size, cursor)
 
-#@app.get("/random_user_ids")
+#@router.get("/random_user_ids")
 #def get_random_user_ids():
 #    query = "SELECT user_id FROM eventlog.user_events_with_100_fields LIMIT 5000"
 #    rows = session.execute(query)
@@ -945,96 +3989,48 @@ def get_user_events(user_id: str):
 #    random_ids = random.sample(user_ids, min(20, len(user_ids)))
 #    return {"user_ids": random_ids}
 
-@app.get("/random_user_ids")
-def get_random_user_ids():
-    query = f"""
-        SELECT user_id FROM eventlog.user_events_with_100_fields
-        WHERE TOKEN(user_id) > TOKEN(now())
-        LIMIT 1000;
-    """
-    rows = session.execute(query)
-    user_ids = [str(row["user_id"]) for row in rows]
+@router.get("/random_user_ids")
+async def get_random_user_ids(
+    count: int = Query(1000, gt=0, le=10000, description="How many user ids to return"),
+    mode: str = Query("random", description="random, or deterministic to get a repeatable sample for a seed"),
+    seed: int = Query(0, description="Seed used in deterministic mode"),
+):
+    if mode not in ("random", "deterministic"):
+        raise HTTPException(status_code=400, detail="mode must be random or deterministic")
+
+    if not len(user_reservoir):
+        # Nothing sampled yet (fresh process): one token-range read to get started
+        user_reservoir.reseed(await sample_user_ids_by_token_async())
+
+    user_ids = [str(user_id) for user_id in user_reservoir.sample(count, seed if mode == "deterministic" else None)]
     if not user_ids:
         raise HTTPException(status_code=404, detail="No users found.")
     return {"user_ids": user_ids}
 
-@app.get("/events/full/{user_id}")
-def get_user_full_event_data(user_id: str):
-    start_time = time.time()
-    try:
-        user_uuid = uuid.UUID(user_id)
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid UUID format")
-    uuid_validation_time = (time.time() - start_time) * 1000
-
-    selected_fields = [
-        "user_id", "event_date", "event_time", "event_type", "metadata", "session_id", "xml_blob"
-    ] + [f"field_{i}" for i in range(1, 100)]
-
-    #excluded_fields = ["dummy_field1", "dummy_field2"]
-    #selected_fields = [field for field in selected_fields if field not in excluded_fields]
-
-    #excluded_fields = ["dummy_field1", "dummy_field2"]
-    #selected_fields = [field for field in selected_fields]
-
-    query = f"""
-        SELECT {', '.join(selected_fields)}
-        FROM eventlog.user_events_with_100_fields
-        WHERE user_id = %s
-    """
-    db_start_time = time.time()
-    rows = session.execute(query, (user_uuid,))
-    db_query_time = (time.time() - db_start_time) * 1000
-
-    results = []
-    for row in rows:
-        xml_data = None
-        if row['xml_blob']:
-            try:
-                xml_str = row['xml_blob'].decode('utf-8')
-                xml_tree = ET.fromstring(xml_str)
-                xml_data = {elem.tag: elem.text for elem in xml_tree}
-            except Exception as e:
-                xml_data = {"error": f"Failed to parse XML: {str(e)}"}
-
-        result_data = {
-            "user_id": str(row["user_id"]),
-            "event_date": str(row["event_date"]),
-            "event_time": row["event_time"],
-            "event_type": row["event_type"],
-            "metadata": row["metadata"],
-            "session_id": row["session_id"],
-            "xml_blob": xml_data,
-        }
-
-        for key in selected_fields[4:]:
-            result_data[key] = row.get(key)
+EVENT_FULL_FIELDS = [
+    "user_id", "event_date", "event_time", "event_type", "metadata", "session_id", "xml_blob"
+] + [f"field_{i}" for i in range(1, 100)]
+EVENT_FULL_DATE_FIELDS = [
+    "event_date", "field_6", "field_13", "field_20", "field_27", "field_34", "field_41", "field_48",
+    "field_55", "field_62", "field_69", "field_76", "field_83", "field_90", "field_97"
+]
 
-        date_fields = [
-            "event_date", "field_6", "field_13", "field_20", "field_27", "field_34", "field_41", "field_48",
-            "field_55", "field_62", "field_69", "field_76", "field_83", "field_90", "field_97"
-        ]
-        for field in date_fields:
-            if field in row:
-                result_data[field] = str(row[field])
 
-        results.append(result_data)
+# xml_blob is returned as stored on this endpoint
+EVENT_FULL_CONVERTERS = {"user_id": str, **{field: str for field in EVENT_FULL_DATE_FIELDS}}
 
-    if not results:
-        raise HTTPException(status_code=404, detail="No events found for this user")
 
-    response_time = (time.time() - start_time) * 1000
-    return {
-        "data": results,
-        "timing": {
-            "webToApi": uuid_validation_time,
-            "apiToDb": db_query_time,
-            "dbFetch": db_query_time,
-            "dbToWeb": response_time - (uuid_validation_time + db_query_time),
-        }
-    }
+@router.get("/events/full/{user_id}")
+async def get_user_full_event_data(
+    user_id: str,
+    since: Optional[datetime.datetime] = Query(None, description="Only events at or after this time"),
+    until: Optional[datetime.datetime] = Query(None, description="Only events at or before this time"),
+    page_size: Optional[int] = Query(None, gt=0, le=EVENTS_MAX_PAGE_SIZE, description="Return one page and a next_cursor"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+):
+    return await stream_user_events(user_id, EVENT_FULL_FIELDS, EVENT_FULL_CONVERTERS, since, until, page_size, cursor)
 
-@app.post("/insert-random")
+@router.post("/insert-random")
 async def insert_random_row():
     user_id = uuid.uuid4()
     event_type = random.choice(["click", "view", "purchase", "signup"])
@@ -1048,12 +4044,12 @@ async def insert_random_row():
     INSERT INTO user_events_with_100_fields (user_id, event_date, event_time, event_type, metadata, session_id, xml_blob)
     VALUES (%s, %s, %s, %s, %s, %s, %s)
     """
-    session.execute(query, (user_id, event_date, event_time, event_type, metadata, session_id, xml_blob))
+    await execute_async_with_profile(query, (user_id, event_date, event_time, event_type, metadata, session_id, xml_blob), profile=PROFILE_INGEST, idempotent=False)
 
     await broadcast_new_data(f"New row added for user_id: {user_id}")
     return {"status": "inserted", "user_id": str(user_id)}
 
-@app.post("/run-query")
+@router.post("/run-query")
 async def run_query(request: Request):
     start_time = time.time()
     body = await request.json()
@@ -1064,7 +4060,7 @@ async def run_query(request: Request):
 
     try:
         db_start = time.time()
-        rows = session.execute(SimpleStatement(cql_query))
+        rows = await fetch_all(cql_query, profile=PROFILE_ANALYTICS, idempotent=False)
         db_end = time.time()
         data = [dict(row) for row in rows]
     except Exception as e:
@@ -1078,31 +4074,512 @@ async def run_query(request: Request):
         }
     }
 
-@app.post("/refresh_alerts_by_type")
+# Time-bucketed alert rollups
+# The alert worker adds every new alert to per-minute counters (alerts.alert_rollup_minute),
+# broken down by ROLLUP_DIMENSIONS. A background roller sums minute rows into hour rows
+# and hour rows into day rows (alerts.alert_rollups); those are plain overwrites, so
+# re-rolling a period, or several worker processes rolling it, is harmless. Each process
+# re-rolls the hours its own alerts touched. /dashboard/timeseries reads whichever
+# resolution keeps the range under TIMESERIES_MAX_BUCKETS buckets.
+ROLLUP_DIMENSIONS = ("all", "type", "severity", "tenant", "region")
+ROLLUP_INTERVAL_SECONDS = float(os.environ.get("ROLLUP_INTERVAL_SECONDS", "60"))
+ROLLUP_CATCHUP_HOURS = int(os.environ.get("ROLLUP_CATCHUP_HOURS", "48"))  # re-rolled at startup
+TIMESERIES_MAX_BUCKETS = int(os.environ.get("TIMESERIES_MAX_BUCKETS", "1500"))
+ROLLUP_STEPS = {
+    "minute": datetime.timedelta(minutes=1),
+    "hour": datetime.timedelta(hours=1),
+    "day": datetime.timedelta(days=1),
+}
+
+rollup_dirty_hours = set()
+rollup_lock = threading.Lock()
+
+
+def rollup_values(record):
+    return (
+        ("all", ""),
+        ("type", record.alert_type or ""),
+        ("severity", record.severity or ""),
+        ("tenant", str(record.tenant)),
+        ("region", record.region or ""),
+    )
+
+
+def record_alert_rollups(records):
+    totals = {}  # (dimension, minute, value) -> [count, amount in cents]
+    for record in records:
+        minute = record.create_timestamp.replace(second=0, microsecond=0)
+        cents = round((record.amount or 0) * 100)
+        for dimension, value in rollup_values(record):
+            total = totals.setdefault((dimension, minute, value), [0, 0])
+            total[0] += 1
+            total[1] += cents
+
+    batch = BatchStatement(batch_type=BatchType.COUNTER)
+    for (dimension, minute, value), (count, cents) in totals.items():
+        batch.add(prepared_rollup_minute_update, (count, cents, dimension, minute.date(), minute, value))
+    execute_ingest_write(batch)
+
+    with rollup_lock:
+        rollup_dirty_hours.update(minute.replace(minute=0) for _, minute, _ in totals)
+
+
+def rollup_period(resolution, bucket_start):
+    # Partition of a rollup row: hour rows are kept per day, day rows per month
+    return bucket_start.date() if resolution == "hour" else bucket_start.date().replace(day=1)
+
+
+def sum_rollup_rows(rows, count_column, amount_column, scale):
+    totals = {}
+    for row in rows:
+        total = totals.setdefault(row["value"], [0, 0])
+        total[0] += row[count_column] or 0
+        total[1] += (row[amount_column] or 0) * scale
+    return totals
+
+
+def write_rollups(resolution, dimension, bucket_start, totals):
+    execute_concurrent_with_args(session, prepared_rollup_insert, [
+        (resolution, dimension, rollup_period(resolution, bucket_start), bucket_start, value, count, amount)
+        for value, (count, amount) in totals.items()
+    ], execution_profile=PROFILE_INGEST)
+
+
+def roll_up_hour(hour):
+    end = hour + ROLLUP_STEPS["hour"]
+    for dimension in ROLLUP_DIMENSIONS:
+        rows = session.execute(prepared_rollup_minute_select, (dimension, hour.date(), hour, end),
+                               execution_profile=PROFILE_ANALYTICS)
+        write_rollups("hour", dimension, hour, sum_rollup_rows(rows, "alert_count", "amount_cents", 0.01))
+
+
+def roll_up_day(day):
+    start = datetime.datetime.combine(day, datetime.time.min)
+    for dimension in ROLLUP_DIMENSIONS:
+        rows = session.execute(prepared_rollup_select, ("hour", dimension, day, start, start + ROLLUP_STEPS["day"]),
+                               execution_profile=PROFILE_ANALYTICS)
+        write_rollups("day", dimension, start, sum_rollup_rows(rows, "alert_count", "amount", 1))
+
+
+def rollup_worker():
+    # Catch up on hours whose roll-up a previous process may not have finished
+    now = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    with rollup_lock:
+        rollup_dirty_hours.update(now - datetime.timedelta(hours=i) for i in range(ROLLUP_CATCHUP_HOURS))
+
+    while not background_stop.is_set():
+        with rollup_lock:
+            hours = sorted(rollup_dirty_hours)
+            rollup_dirty_hours.clear()
+        try:
+            for hour in hours:
+                roll_up_hour(hour)
+            for day in sorted({hour.date() for hour in hours}):
+                roll_up_day(day)
+        except Exception as e:
+            print(f"⚠️ Alert rollup failed, retrying next round: {e}")
+            with rollup_lock:
+                rollup_dirty_hours.update(hours)
+        background_stop.wait(ROLLUP_INTERVAL_SECONDS)
+
+
+@router.get("/dashboard/timeseries")
+async def get_alert_timeseries(
+    start: datetime.datetime,
+    end: Optional[datetime.datetime] = Query(None, description="Defaults to now (UTC)"),
+    resolution: str = Query("auto", description="minute, hour, day, or auto"),
+    dimension: str = Query("all", description="all, type, severity, tenant or region"),
+):
+    end = end or datetime.datetime.utcnow()
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if dimension not in ROLLUP_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"dimension must be one of {', '.join(ROLLUP_DIMENSIONS)}")
+    if resolution == "auto":
+        resolution = next((r for r, step in ROLLUP_STEPS.items() if (end - start) / step <= TIMESERIES_MAX_BUCKETS), "day")
+    if resolution not in ROLLUP_STEPS:
+        raise HTTPException(status_code=400, detail="resolution must be minute, hour, day or auto")
+    if (end - start) / ROLLUP_STEPS[resolution] > TIMESERIES_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"More than {TIMESERIES_MAX_BUCKETS} {resolution} buckets, use a coarser resolution")
+
+    # Align to bucket boundaries, then read each partition the range touches
+    step = ROLLUP_STEPS[resolution]
+    if resolution == "minute":
+        start = start.replace(second=0, microsecond=0)
+    elif resolution == "hour":
+        start = start.replace(minute=0, second=0, microsecond=0)
+    else:
+        start = datetime.datetime.combine(start.date(), datetime.time.min)
+
+    if resolution == "minute":
+        prepared, count_column, amount_column, scale = prepared_rollup_minute_select, "alert_count", "amount_cents", 0.01
+        periods = [start.date() + datetime.timedelta(days=i) for i in range((end.date() - start.date()).days + 1)]
+        parameters = [(dimension, period, start, end) for period in periods]
+    else:
+        prepared, count_column, amount_column, scale = prepared_rollup_select, "alert_count", "amount", 1
+        bucket_starts = (start + i * step for i in range(math.ceil((end - start) / step)))
+        periods = sorted({rollup_period(resolution, bucket_start) for bucket_start in bucket_starts})
+        parameters = [(resolution, dimension, period, start, end) for period in periods]
+
+    results = await asyncio.gather(*[fetch_all(prepared, partition) for partition in parameters])
+
+    data = [
+        {
+            "bucket_start": row["bucket_start"].isoformat(),
+            "value": row["value"],
+            "count": row[count_column] or 0,
+            "amount": round((row[amount_column] or 0) * scale, 2),
+        }
+        for rows in results for row in rows
+    ]
+    data.sort(key=lambda item: (item["bucket_start"], item["value"]))
+    return {"resolution": resolution, "dimension": dimension, "start": start.isoformat(),
+            "end": end.isoformat(), "data": data}
+
+
+# Streaming sketches
+# Per day and tenant, every process keeps mergeable sketches in memory:
+#   top_accounts         count-min sketch + top-K of account_number by alert count
+#   alerted_accounts     HyperLogLog of account_number over alerts
+#   transaction_amounts  DDSketch of transaction amounts
+# and snapshots the ones that changed to alerts.sketch_snapshots every
+# SKETCH_SNAPSHOT_SECONDS, one row per sketch instance. The dashboard endpoints merge all
+# snapshots of a day (this process's live sketches replacing its own snapshots).
+SKETCH_SNAPSHOT_SECONDS = float(os.environ.get("SKETCH_SNAPSHOT_SECONDS", "30"))
+SKETCH_RETENTION_DAYS = int(os.environ.get("SKETCH_RETENTION_DAYS", "2"))  # days kept in memory
+SKETCH_SNAPSHOT_TTL = 35 * 24 * 3600
+SKETCH_TOP_K = 50
+SKETCH_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def sketch_hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=16).digest(), "little")
+
+
+class CountMinTopK:
+    def __init__(self, width=2048, depth=4, k=SKETCH_TOP_K):
+        self.width = width
+        self.depth = depth
+        self.k = k
+        self.table = [[0] * width for _ in range(depth)]
+        self.top = {}  # key -> estimated count, for the k heaviest keys seen
+
+    def _columns(self, key):
+        h = sketch_hash(key)
+        h1, h2 = h & 0xFFFFFFFFFFFFFFFF, (h >> 64) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def _offer(self, key, estimate):
+        if key in self.top or len(self.top) < self.k:
+            self.top[key] = estimate
+            return
+        lightest = min(self.top, key=self.top.get)
+        if estimate > self.top[lightest]:
+            del self.top[lightest]
+            self.top[key] = estimate
+
+    def add(self, key, count=1):
+        estimate = None
+        for row, column in zip(self.table, self._columns(key)):
+            row[column] += count
+            estimate = row[column] if estimate is None else min(estimate, row[column])
+        self._offer(key, estimate)
+
+    def estimate(self, key):
+        return min(row[column] for row, column in zip(self.table, self._columns(key)))
+
+    def merge(self, other):
+        for row, other_row in zip(self.table, other.table):
+            row[:] = map(operator.add, row, other_row)
+        candidates = set(self.top) | set(other.top)
+        self.top = {}
+        for key in candidates:
+            self._offer(key, self.estimate(key))
+
+    def most_common(self, n):
+        return heapq.nlargest(n, self.top.items(), key=operator.itemgetter(1))
+
+    def to_dict(self):
+        return {"width": self.width, "depth": self.depth, "k": self.k, "table": self.table, "top": self.top}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["width"], data["depth"], data["k"])
+        sketch.table = data["table"]
+        sketch.top = data["top"]
+        return sketch
+
+
+class HyperLogLog:
+    def __init__(self, p=12):
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def add(self, key):
+        h = sketch_hash(key) & 0xFFFFFFFFFFFFFFFF
+        index = h >> (64 - self.p)
+        rest = (h << self.p) & 0xFFFFFFFFFFFFFFFF
+        rank = 64 - rest.bit_length() + 1 if rest else 64 - self.p + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting for small cardinalities
+        return round(estimate)
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def to_dict(self):
+        return {"p": self.p, "registers": base64.b64encode(self.registers).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["p"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        return sketch
+
+
+class QuantileSketch:
+    # DDSketch: log-spaced bins keep every quantile within relative_accuracy of the true value
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0  # amounts are never negative
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return None
+
+    def merge(self, other):
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def to_dict(self):
+        return {"relative_accuracy": self.relative_accuracy, "bins": self.bins,
+                "zero_count": self.zero_count, "count": self.count}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"])
+        sketch.bins = {int(index): count for index, count in data["bins"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        return sketch
+
+
+SKETCH_KINDS = {
+    "top_accounts": CountMinTopK,
+    "alerted_accounts": HyperLogLog,
+    "transaction_amounts": QuantileSketch,
+}
+
+
+def pack_sketch(sketch):
+    return zlib.compress(json.dumps(sketch.to_dict()).encode())
+
+
+def unpack_sketch(kind, blob):
+    return SKETCH_KINDS[kind].from_dict(json.loads(zlib.decompress(blob)))
+
+
+class SketchStore:
+    def __init__(self, retention_days):
+        self.retention = datetime.timedelta(days=retention_days)
+        self.sketches = {}  # (kind, day, tenant) -> (sketch id, sketch)
+        self.dirty = set()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _get(self, kind, day, tenant):
+        key = (kind, day, tenant)
+        entry = self.sketches.get(key)
+        if entry is None:
+            # A fresh id per instance, so a day dropped from memory and started again never
+            # overwrites the snapshot holding its earlier counts
+            self.created += 1
+            entry = self.sketches[key] = (f"{SKETCH_WORKER_ID}:{self.created}", SKETCH_KINDS[kind]())
+        self.dirty.add(key)
+        return entry[1]
+
+    def add_alerts(self, records):
+        with self.lock:
+            for record in records:
+                self._get("top_accounts", record.alert_date, record.tenant).add(record.account_number)
+                self._get("alerted_accounts", record.alert_date, record.tenant).add(record.account_number)
+
+    def add_transactions(self, rows):
+        with self.lock:
+            for day, tenant, amount in rows:
+                self._get("transaction_amounts", day, tenant).add(amount)
+
+    def take_dirty(self):
+        # Packed copies of the sketches changed since the last call; days past the
+        # retention window are dropped once they have been handed out
+        cutoff = datetime.datetime.utcnow().date() - self.retention
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            packed = [(key, self.sketches[key][0], pack_sketch(self.sketches[key][1])) for key in dirty]
+            for key in [key for key in self.sketches if key[1] < cutoff and key not in self.dirty]:
+                del self.sketches[key]
+        return packed
+
+    def local(self, kind, day):
+        with self.lock:
+            return {
+                sketch_id: (key[2], pack_sketch(sketch))
+                for key, (sketch_id, sketch) in self.sketches.items() if key[0] == kind and key[1] == day
+            }
+
+
+alert_sketches = SketchStore(SKETCH_RETENTION_DAYS)
+
+
+def snapshot_sketches():
+    packed = alert_sketches.take_dirty()
+    if packed:
+        now = datetime.datetime.utcnow()
+        execute_concurrent_with_args(session, prepared_sketch_snapshot_insert, [
+            (kind, day, tenant, sketch_id, blob, now, SKETCH_SNAPSHOT_TTL)
+            for (kind, day, tenant), sketch_id, blob in packed
+        ], execution_profile=PROFILE_INGEST)
+    return len(packed)
+
+
+def sketch_snapshot_worker():
+    while not background_stop.wait(SKETCH_SNAPSHOT_SECONDS):
+        try:
+            snapshot_sketches()
+        except Exception as e:
+            print(f"⚠️ Sketch snapshot failed: {e}")
+
+
+async def merged_sketches(kind, day, tenant=None):
+    # tenant -> sketch merged over every process's snapshot of the day
+    local = alert_sketches.local(kind, day)
+    packed = [(row["tenant"], row["sketch"]) for row in await fetch_all(
+        prepared_sketch_snapshot_select, (kind, day)) if row["worker"] not in local]
+    packed.extend(local.values())
+
+    merged = {}
+    for sketch_tenant, blob in packed:
+        if tenant is not None and sketch_tenant != tenant:
+            continue
+        sketch = unpack_sketch(kind, blob)
+        if sketch_tenant in merged:
+            merged[sketch_tenant].merge(sketch)
+        else:
+            merged[sketch_tenant] = sketch
+    return merged
+
+
+def merge_all(sketches):
+    total = None
+    for sketch in sketches:
+        if total is None:
+            total = sketch
+        else:
+            total.merge(sketch)
+    return total
+
+
+@router.get("/dashboard/top_accounts")
+async def get_top_accounts(
+    day: date = Query(None, description="Defaults to today"),
+    tenant: Optional[int] = None,
+    limit: int = Query(20, gt=0, le=SKETCH_TOP_K),
+):
+    day = day or datetime.datetime.utcnow().date()
+    total = merge_all((await merged_sketches("top_accounts", day, tenant)).values())
+    data = [{"account_number": account, "alerts": count} for account, count in total.most_common(limit)] if total else []
+    return {"day": str(day), "tenant": tenant, "data": data}
+
+
+@router.get("/dashboard/distinct_accounts")
+async def get_distinct_alerted_accounts(
+    day: date = Query(None, description="Defaults to today"),
+    tenant: Optional[int] = None,
+):
+    day = day or datetime.datetime.utcnow().date()
+    by_tenant = await merged_sketches("alerted_accounts", day, tenant)
+    counts = {str(t): sketch.count() for t, sketch in by_tenant.items()}
+    total = merge_all(by_tenant.values())
+    return {"day": str(day), "alerted_accounts": total.count() if total else 0, "by_tenant": counts}
+
+
+@router.get("/dashboard/amount_percentiles")
+async def get_amount_percentiles(
+    day: date = Query(None, description="Defaults to today"),
+    tenant: Optional[int] = None,
+    quantiles: str = Query("0.5,0.9,0.99", description="Comma separated, between 0 and 1"),
+):
+    day = day or datetime.datetime.utcnow().date()
+    try:
+        qs = [float(q) for q in quantiles.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="quantiles must be numbers")
+    if not all(0 <= q <= 1 for q in qs):
+        raise HTTPException(status_code=400, detail="quantiles must be between 0 and 1")
+
+    def summary(sketch):
+        return {"count": sketch.count, **{f"p{q * 100:g}": sketch.quantile(q) for q in qs}}
+
+    by_tenant = await merged_sketches("transaction_amounts", day, tenant)
+    data = {str(t): summary(sketch) for t, sketch in by_tenant.items()}
+    total = merge_all(by_tenant.values())
+    return {"day": str(day), "all": summary(total) if total else None, "by_tenant": data}
+
+
+@router.post("/refresh_alerts_by_type")
 def refresh_alerts_by_type():
     try:
-        rows = session.execute("SELECT alert_type FROM alerts.alerts_by_status")
         counter = {}
-
-        for row in rows:
-            alert_type = row.get("alert_type")
-            if alert_type:
-                counter[alert_type] = counter.get(alert_type, 0) + 1
+        with in_flight(PROFILE_ANALYTICS):
+            for row in scan_alerts_by_status("alert_type"):
+                alert_type = row.get("alert_type")
+                if alert_type:
+                    counter[alert_type] = counter.get(alert_type, 0) + 1
 
         for alert_type, count in counter.items():
-            session.execute("""
+            execute_with_profile("""
                 INSERT INTO alerts.dash_alerts_by_type (alert_type, count)
                 VALUES (%s, %s)
-            """, (alert_type, count))
+            """, (alert_type, count), profile=PROFILE_ANALYTICS)
 
         return {"status": "refreshed", "data": counter}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/dashboard/alerts_by_type")
-def get_alerts_by_type_dashboard():
+@router.get("/dashboard/alerts_by_type")
+async def get_alerts_by_type_dashboard():
     try:
-        result = session.execute("SELECT * FROM alerts.dash_alerts_by_type")
+        result = await fetch_all("SELECT * FROM alerts.dash_alerts_by_type")
         data = []
 
         for row in result:
@@ -1125,31 +4602,30 @@ def get_alerts_by_type_dashboard():
         print("Error in /dashboard/alerts_by_type:", e)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/refresh_alerts_by_tenant")
+@router.post("/refresh_alerts_by_tenant")
 def refresh_alerts_by_tenant():
     try:
-        rows = session.execute("SELECT tenant FROM alerts.alerts_by_status")
         counter = {}
-
-        for row in rows:
-            tenant = str(row.get("tenant"))  # ✅ Ensure tenant is a string
-            if tenant:
-                counter[tenant] = counter.get(tenant, 0) + 1
+        with in_flight(PROFILE_ANALYTICS):
+            for row in scan_alerts_by_status("tenant"):
+                tenant = str(row.get("tenant"))  # ✅ Ensure tenant is a string
+                if tenant:
+                    counter[tenant] = counter.get(tenant, 0) + 1
 
         for tenant, count in counter.items():
-            session.execute("""
+            execute_with_profile("""
                 INSERT INTO alerts.dash_alerts_by_tenant (tenant, count)
                 VALUES (%s, %s)
-            """, (tenant, count))
+            """, (tenant, count), profile=PROFILE_ANALYTICS)
 
         return {"status": "refreshed", "data": counter}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/dashboard/alerts_by_tenant")
-def get_alerts_by_tenant_dashboard():
+@router.get("/dashboard/alerts_by_tenant")
+async def get_alerts_by_tenant_dashboard():
     try:
-        result = session.execute("SELECT * FROM alerts.dash_alerts_by_tenant")
+        result = await fetch_all("SELECT * FROM alerts.dash_alerts_by_tenant")
         data = []
 
         for row in result:
@@ -1169,10 +4645,9 @@ def get_alerts_by_tenant_dashboard():
         print("Error in /dashboard/alerts_by_tenant:", e)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/refresh_alerts_by_score_range")
+@router.post("/refresh_alerts_by_score_range")
 def refresh_alerts_by_score_range():
     try:
-        rows = session.execute("SELECT score FROM alerts.alerts_by_status")
         buckets = {
             "0–60": 0,
             "61–65": 0,
@@ -1184,48 +4659,48 @@ def refresh_alerts_by_score_range():
             "91–95": 0,
             "96–100": 0
         }
-
-        for row in rows:
-            score = row.get("score")
-            if score is None:
-                continue
-            try:
-                score = float(score)
-                if score <= 60:
-                    buckets["0–60"] += 1
-                elif score <= 65:
-                    buckets["61–65"] += 1
-                elif score <= 70:
-                    buckets["66–70"] += 1
-                elif score <= 75:
-                    buckets["71–75"] += 1
-                elif score <= 80:
-                    buckets["76–80"] += 1
-                elif score <= 85:
-                    buckets["81–85"] += 1
-                elif score <= 90:
-                    buckets["86–90"] += 1
-                elif score <= 95:
-                    buckets["91–95"] += 1
-                else:
-                    buckets["96–100"] += 1
-            except:
-                continue
+        with in_flight(PROFILE_ANALYTICS):
+            for row in scan_alerts_by_status("score"):
+                score = row.get("score")
+                if score is None:
+                    continue
+                try:
+                    score = float(score)
+                    if score <= 60:
+                        buckets["0–60"] += 1
+                    elif score <= 65:
+                        buckets["61–65"] += 1
+                    elif score <= 70:
+                        buckets["66–70"] += 1
+                    elif score <= 75:
+                        buckets["71–75"] += 1
+                    elif score <= 80:
+                        buckets["76–80"] += 1
+                    elif score <= 85:
+                        buckets["81–85"] += 1
+                    elif score <= 90:
+                        buckets["86–90"] += 1
+                    elif score <= 95:
+                        buckets["91–95"] += 1
+                    else:
+                        buckets["96–100"] += 1
+                except:
+                    continue
 
         for bucket, count in buckets.items():
-            session.execute("""
+            execute_with_profile("""
                 INSERT INTO alerts.dash_alerts_by_score_range (score_range, count)
                 VALUES (%s, %s)
-            """, (bucket, count))
+            """, (bucket, count), profile=PROFILE_ANALYTICS)
 
         return {"status": "refreshed", "data": buckets}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/dashboard/alerts_by_score_range")
-def get_alerts_by_score_range():
+@router.get("/dashboard/alerts_by_score_range")
+async def get_alerts_by_score_range():
     try:
-        rows = session.execute("SELECT * FROM alerts.dash_alerts_by_score_range")
+        rows = await fetch_all("SELECT * FROM alerts.dash_alerts_by_score_range")
         data = []
 
         for row in rows:
@@ -1244,37 +4719,395 @@ def get_alerts_by_score_range():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/refresh_alerts_by_region")
+@router.post("/refresh_alerts_by_region")
 def refresh_alerts_by_region():
     try:
-        rows = session.execute("SELECT region FROM alerts.alerts_by_status")
         counter = {}
-
-        for row in rows:
-            # Compatible with namedtuple or dict-like row
-            region = row.get("region") if isinstance(row, dict) else getattr(row, "region", None)
-            if region:
-                counter[region] = counter.get(region, 0) + 1
+        with in_flight(PROFILE_ANALYTICS):
+            for row in scan_alerts_by_status("region"):
+                # Compatible with namedtuple or dict-like row
+                region = row.get("region") if isinstance(row, dict) else getattr(row, "region", None)
+                if region:
+                    counter[region] = counter.get(region, 0) + 1
 
         # Optionally clear the table before inserting to avoid duplicates
-        session.execute("TRUNCATE alerts.dash_alerts_by_region")
+        execute_with_profile("TRUNCATE alerts.dash_alerts_by_region", profile=PROFILE_ANALYTICS, idempotent=False)
 
         for region, count in counter.items():
-            session.execute("""
+            execute_with_profile("""
                 INSERT INTO alerts.dash_alerts_by_region (region, count)
                 VALUES (%s, %s)
-            """, (region, count))
+            """, (region, count), profile=PROFILE_ANALYTICS)
 
         return {"status": "refreshed", "data": counter}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/dashboard/alerts_by_region")
-def get_alerts_by_region():
+@router.get("/dashboard/alerts_by_region")
+async def get_alerts_by_region():
     try:
-        rows = session.execute("SELECT region, count FROM alerts.dash_alerts_by_region")
+        rows = await fetch_all("SELECT region, count FROM alerts.dash_alerts_by_region")
         #return {"data": [dict(row._asdict()) for row in rows]}
         return {"data": [dict(row) for row in rows]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+# Request-body decompression and response compression
+MAX_DECOMPRESSED_BODY = int(os.environ.get("MAX_DECOMPRESSED_BODY", str(256 * 1024 * 1024)))
+COMPRESSION_DEFAULT_THRESHOLD = int(os.environ.get("COMPRESSION_DEFAULT_THRESHOLD", "4096"))
+# Path prefix -> smallest response worth compressing (None: never compress)
+COMPRESSION_ROUTE_THRESHOLDS = [
+    ("/browse", 1024),
+    ("/events/", 1024),
+    ("/transactions", 1024),
+    ("/alerts", 1024),
+    ("/health", None),
+    ("/metrics", None),
+]
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "application/x-ndjson", "text/")
+COMPRESSION_OFFLOAD_BYTES = 256 * 1024  # bigger chunks are compressed on a worker thread
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def supported_encodings():
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def compression_threshold(path):
+    for prefix, threshold in COMPRESSION_ROUTE_THRESHOLDS:
+        if path.startswith(prefix):
+            return threshold
+    return COMPRESSION_DEFAULT_THRESHOLD
+
+
+def negotiate_encoding(accept_encoding):
+    # Highest q wins, zstd before gzip on a tie
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip()] = q
+
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+ZSTD_SKIPPABLE_MAGIC = range(0x184D2A50, 0x184D2A60)
+
+
+def zstd_frames_complete(data):
+    # True when data is a whole number of zstd frames; walks the frame and block headers
+    # without decompressing anything
+    pos = 0
+    try:
+        while pos < len(data):
+            if int.from_bytes(data[pos:pos + 4], "little") in ZSTD_SKIPPABLE_MAGIC:
+                pos += 8 + int.from_bytes(data[pos + 4:pos + 8], "little")
+                continue
+            header = data[pos:pos + 18]
+            has_checksum = zstandard.get_frame_parameters(header).has_checksum
+            pos += zstandard.frame_header_size(header)
+            last = False
+            while not last:
+                if pos + 3 > len(data):
+                    return False
+                block = int.from_bytes(data[pos:pos + 3], "little")
+                last, block_type, block_size = block & 1, (block >> 1) & 3, block >> 3
+                pos += 3 + (1 if block_type == 1 else block_size)  # RLE blocks hold one byte
+            pos += 4 if has_checksum else 0
+    except zstandard.ZstdError:
+        return False
+    return 0 < pos == len(data)
+
+
+class StreamDecoder:
+    # Inflates in DECOMPRESS_STEP output steps and checks the size limit after each one,
+    # so a decompression bomb is stopped at the limit instead of after it has filled memory
+    DECOMPRESS_STEP = 64 * 1024
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.produced = 0
+        self.pieces = []
+        if encoding == "gzip":
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            # The stream writer hands its output to self.write one step at a time; the
+            # compressed input is kept to check the frames are complete at the end
+            self.decompressor = zstandard.ZstdDecompressor().stream_writer(self, write_size=self.DECOMPRESS_STEP)
+            self.compressed = []
+
+    def feed(self, data):
+        if self.encoding != "gzip":
+            self.compressed.append(data)
+            self.decompressor.write(data)
+        else:
+            while True:
+                piece = self.decompressor.decompress(data, self.DECOMPRESS_STEP)
+                self.write(piece)
+                data = self.decompressor.unconsumed_tail
+                if not data and len(piece) < self.DECOMPRESS_STEP:
+                    break
+            if self.decompressor.unused_data:
+                raise ValueError("unexpected data after the end of the gzip stream")
+        out, self.pieces = b"".join(self.pieces), []
+        return out
+
+    def finish(self):
+        # A body cut off mid-stream is rejected rather than taken as complete
+        if self.encoding == "gzip":
+            if not self.decompressor.eof:
+                raise ValueError("truncated gzip stream")
+        elif not zstd_frames_complete(b"".join(self.compressed)):
+            raise ValueError("truncated zstd stream")
+
+    def write(self, data):
+        self.produced += len(data)
+        if self.produced > MAX_DECOMPRESSED_BODY:
+            raise BodyTooLarge()
+        self.pieces.append(data)
+        return len(data)
+
+
+class StreamEncoder:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data, final):
+        # Flush every chunk so streamed responses reach the client as they are produced
+        if self.encoding == "gzip":
+            mode = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        else:
+            mode = zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return self.compressor.compress(data) + self.compressor.flush(mode)
+
+
+class CompressingSender:
+    def __init__(self, send, encoding, threshold):
+        self.downstream = send
+        self.encoding = encoding
+        self.threshold = threshold
+        self.start_message = None
+        self.encoder = None
+        self.passthrough = False
+
+    async def _compress(self, data, final):
+        if len(data) >= COMPRESSION_OFFLOAD_BYTES:
+            return await anyio.to_thread.run_sync(self.encoder.compress, data, final)
+        return self.encoder.compress(data, final)
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            # Hold the headers until the first body chunk tells us whether to compress
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            headers = MutableHeaders(raw=list(start["headers"]))
+            content_type = headers.get("content-type", "")
+            if ("content-encoding" in headers
+                    or not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES)
+                    or (not more_body and len(body) < self.threshold)):
+                self.passthrough = True
+                await self.downstream(start)
+                await self.downstream(message)
+                return
+
+            self.encoder = StreamEncoder(self.encoding)
+            body = await self._compress(body, not more_body)
+            headers["content-encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["content-length"]
+            else:
+                headers["content-length"] = str(len(body))
+            await self.downstream({**start, "headers": headers.raw})
+            await self.downstream({"type": "http.response.body", "body": body, "more_body": more_body})
+            return
+
+        body = await self._compress(body, not more_body)
+        await self.downstream({"type": "http.response.body", "body": body, "more_body": more_body})
+
+
+class CompressionMiddleware:
+    # gzip/zstd request bodies are inflated (with a size cap) before they reach the
+    # handlers; responses are compressed per Accept-Encoding once they pass the
+    # route's size threshold. Streaming responses are compressed chunk by chunk.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_encoding = headers.get("content-encoding", "identity").strip().lower()
+        if content_encoding != "identity":
+            if content_encoding not in supported_encodings():
+                response = JSONResponse({"detail": f"Unsupported Content-Encoding: {content_encoding}"}, status_code=415)
+                await response(scope, receive, send)
+                return
+            try:
+                body = await self._read_body(receive, StreamDecoder(content_encoding))
+            except BodyTooLarge:
+                response = JSONResponse({"detail": "Decompressed request body is too large"}, status_code=413)
+                await response(scope, receive, send)
+                return
+            except Exception as e:
+                response = JSONResponse({"detail": f"Could not decompress request body: {e}"}, status_code=400)
+                await response(scope, receive, send)
+                return
+            scope, receive = self._replay(scope, receive, body)
+
+        encoding = negotiate_encoding(headers.get("accept-encoding", ""))
+        threshold = compression_threshold(scope["path"])
+        if encoding is None or threshold is None:
+            await self.app(scope, receive, send)
+            return
+
+        await self.app(scope, receive, CompressingSender(send, encoding, threshold).send)
+
+    @staticmethod
+    async def _read_body(receive, decoder):
+        pieces = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ValueError("client disconnected")
+            pieces.append(decoder.feed(message.get("body", b"")))
+            if not message.get("more_body", False):
+                decoder.finish()
+                return b"".join(pieces)
+
+    @staticmethod
+    def _replay(scope, receive, body):
+        headers = MutableHeaders(raw=list(scope["headers"]))
+        del headers["content-encoding"]
+        headers["content-length"] = str(len(body))
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return {**scope, "headers": headers.raw}, replay_receive
+
+
+def start_backend():
+    global cluster, session
+    cluster, session = connect_cluster()
+
+    # Prepares and pool warm-up are independent round-trips, run them side by side
+    with ThreadPoolExecutor(max_workers=STARTUP_PARALLELISM) as executor:
+        warm_up = executor.submit(warm_up_pools)
+        prepared = prepare_statements(executor)
+        warm_up.result()
+    globals().update(prepared)
+    print(f"✅ Connected to Cassandra and prepared {len(prepared)} statements (pid {os.getpid()})")
+
+    start_process_pool()
+    start_alert_worker()
+    if GROUP_COMMIT_WINDOW_MS > 0:
+        transaction_writer.start()
+
+    background_stop.clear()
+    threading.Thread(target=hot_window_worker, name="hot-alert-window", daemon=True).start()
+    threading.Thread(target=status_change_worker, name="alert-status-changes", daemon=True).start()
+    threading.Thread(target=user_sampler_worker, name="user-sampler", daemon=True).start()
+    threading.Thread(target=rollup_worker, name="alert-rollups", daemon=True).start()
+    threading.Thread(target=sketch_snapshot_worker, name="sketch-snapshots", daemon=True).start()
+    threading.Thread(target=health_prober, name="cluster-health", daemon=True).start()
+
+
+def stop_backend():
+    # Requests have finished by now; flush queued alerts before the session goes away
+    background_stop.set()
+    transaction_writer.stop(DRAIN_TIMEOUT)
+    stop_alert_worker(DRAIN_TIMEOUT)
+    try:
+        snapshot_sketches()
+    except Exception as e:
+        print(f"⚠️ Final sketch snapshot failed: {e}")
+    stop_process_pool()
+    if cluster is not None:
+        cluster.shutdown()
+    print(f"✅ Backend stopped (pid {os.getpid()})")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, start_backend)
+    try:
+        yield
+    finally:
+        await broadcaster.close_all()
+        await loop.run_in_executor(None, stop_backend)
+
+
+def create_app():
+    app = FastAPI(lifespan=lifespan)
+
+    app.add_middleware(RouteContextMiddleware)
+    app.add_middleware(CompressionMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        #allow_origins=["*"],  # Adjust in production
+        #allow_origins=["192.168.1.103"],
+        allow_origins=["192.168.1.103, https://halibut-more-tiger.ngrok-free.app"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.include_router(router)
+    return app
+
+
+# Every worker process imports this module and runs its own lifespan, e.g.
+#   uvicorn main:app --workers 4
+#   gunicorn main:app -k uvicorn.workers.UvicornWorker -w 4
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        workers=int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+    )
@@ -0,0 +1,45 @@
+import datetime
+import uuid
+
+from cassandra.util import Date as CassandraDate
+
+import main
+
+
+class RecordingBatch:
+    def __init__(self, **kwargs):
+        self.statements = []
+
+    def add(self, statement, params):
+        self.statements.append((statement, params))
+
+
+def alert_row(alert_date):
+    # An alerts_by_id row as the driver returns it
+    return {
+        "alert_id": uuid.uuid4(), "region": "EU", "tenant": "t1", "score": 80, "account_number": "ACC1",
+        "alert_date": alert_date, "alert_description": main.RULE1_DESCRIPTION, "alert_type": "rule1",
+        "amount": 12000.0, "create_timestamp": datetime.datetime(2024, 1, 2, 3, 4, 5),
+        "first_name": "A", "last_name": "B", "reviewed": False, "severity": "high", "status": "new",
+        "transaction_key": uuid.uuid4(), "transaction_timestamp": datetime.datetime(2024, 1, 2, 3, 4, 5),
+    }
+
+
+def test_record_from_cassandra_row_has_a_python_date():
+    record = main.alert_record_from_row(alert_row(CassandraDate(datetime.date(2024, 1, 2))), score=101)
+    assert record.alert_date == datetime.date(2024, 1, 2)
+    assert type(record.alert_date) is datetime.date
+    assert record.score == 101
+
+
+def test_rescored_alert_is_batched(monkeypatch):
+    # A changed alert from the re-scoring job goes through alert_batch like a new one
+    monkeypatch.setattr(main, "BatchStatement", RecordingBatch)
+    monkeypatch.setattr(main, "alert_bucket_count", lambda alert_date, create=False: 1)
+    today = CassandraDate(datetime.datetime.utcnow().date())
+    record = main.alert_record_from_row(alert_row(today), score=101)
+
+    batch, added = main.alert_batch([(record, False)])
+
+    assert added == [(record, False)]
+    assert len(batch.statements) == 3
@@ -0,0 +1,123 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import main
+
+
+class RecordingBatch:
+    def __init__(self, batch_type=None, **kwargs):
+        self.batch_type = batch_type
+        self.statements = []
+
+    def add(self, statement, params=None):
+        if statement == "bad":
+            raise TypeError("Received an argument of invalid type")
+        self.statements.append(statement)
+
+
+class FakeSession:
+    # Acknowledges every batch, or fails those holding a statement listed in failing
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def execute_async(self, batch, execution_profile=None):
+        with self.lock:
+            self.batches.append(batch)
+        future = Future()
+        if self.failing & set(batch.statements):
+            future.set_exception(main.OperationTimedOut("timed out"))
+        else:
+            future.set_result(None)
+        return future
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(main, "BatchStatement", RecordingBatch)
+    writer = main.GroupCommitWriter(window_ms=50, max_statements=1000, batch_statements=50)
+    writer.start()
+    yield writer
+    writer.stop(5)
+
+
+def test_requests_in_one_window_share_a_batch_per_partition(monkeypatch, writer):
+    session = FakeSession()
+    monkeypatch.setattr(main, "session", session)
+
+    futures = [
+        writer.submit([(("transactions", "d1"), ["a1", "a2"])]),
+        writer.submit([(("transactions", "d1"), ["b1", "b2"]), (("transactions", "d2"), ["c1", "c2"])]),
+    ]
+    for future in futures:
+        future.result(5)
+
+    assert sorted(batch.statements for batch in session.batches) == [["a1", "a2", "b1", "b2"], ["c1", "c2"]]
+    assert all(batch.batch_type == main.BatchType.LOGGED for batch in session.batches)
+
+
+def test_failed_batch_fails_only_the_requests_it_holds(monkeypatch, writer):
+    monkeypatch.setattr(main, "session", FakeSession(failing={"b1"}))
+
+    ok = writer.submit([(("transactions", "d1"), ["a1"])])
+    failed = writer.submit([(("transactions", "d2"), ["b1"])])
+
+    assert ok.result(5) is None
+    with pytest.raises(main.OperationTimedOut):
+        failed.result(5)
+
+
+def test_flush_error_fails_its_group_and_the_writer_keeps_going(monkeypatch, writer):
+    session = FakeSession()
+    monkeypatch.setattr(main, "session", session)
+
+    bad = writer.submit([(("transactions", "d1"), ["bad"])])
+    with pytest.raises(TypeError):
+        bad.result(5)
+
+    assert writer.submit([(("transactions", "d1"), ["a1"])]).result(5) is None
+    assert writer.thread.is_alive()
+
+
+def test_cancelled_request_is_dropped(monkeypatch, writer):
+    session = FakeSession()
+    monkeypatch.setattr(main, "session", session)
+    flushing, release = threading.Event(), threading.Event()
+    original_flush = writer.flush
+
+    def slow_flush(group):
+        flushing.set()
+        release.wait(5)
+        original_flush(group)
+
+    monkeypatch.setattr(writer, "flush", slow_flush)
+    first = writer.submit([(("transactions", "d1"), ["a1"])])
+    assert flushing.wait(5)  # the writer is busy with the first request
+    cancelled = writer.submit([(("transactions", "d1"), ["b1"])])
+    assert cancelled.cancel()  # the client went away before the writer claimed it
+    release.set()
+
+    assert first.result(5) is None
+    later = writer.submit([(("transactions", "d1"), ["c1"])])
+    assert later.result(5) is None
+    assert "b1" not in [statement for batch in session.batches for statement in batch.statements]
+    assert writer.thread.is_alive()
+
+
+def test_single_statement_units_go_unlogged_and_large_groups_split(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(main, "session", session)
+    monkeypatch.setattr(main, "BatchStatement", RecordingBatch)
+    writer = main.GroupCommitWriter(window_ms=0, max_statements=1000, batch_statements=3)
+    group = [([(("transactions", "d1"), [f"s{i}"])], Future()) for i in range(7)]
+    for _, future in group:
+        future.set_running_or_notify_cancel()
+
+    writer.flush(group)
+
+    assert [len(batch.statements) for batch in session.batches] == [3, 3, 1]
+    assert all(batch.batch_type == main.BatchType.UNLOGGED for batch in session.batches)
+    assert writer.stats()["statements_per_round_trip"] == pytest.approx(7 / 3, abs=0.01)
@@ -0,0 +1,197 @@
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+# WriteBatchController (AIMD write batching)
+
+def test_full_fast_rounds_grow_batch_size_and_concurrency_additively():
+    controller = main.WriteBatchController(batch_size=20, max_batch_size=200, concurrency=1, max_concurrency=16)
+
+    for _ in range(10):
+        controller.observe(0.001, full=True)
+
+    batch_size, concurrency = controller.limits()
+    assert batch_size == 30
+    assert 4 <= concurrency <= 5  # + 1/concurrency per round
+
+
+def test_rounds_that_are_not_full_do_not_grow():
+    controller = main.WriteBatchController(batch_size=20, max_batch_size=200, concurrency=2, max_concurrency=16)
+
+    controller.observe(0.001, full=False)
+
+    assert controller.limits() == (20, 2)
+
+
+def test_slow_round_cuts_multiplicatively_once_per_cooldown(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(main.time, "monotonic", clock)
+    controller = main.WriteBatchController(batch_size=100, max_batch_size=200, concurrency=10, max_concurrency=16)
+    slow = (main.WRITE_BATCH_LATENCY_TARGET_MS + 1) / 1000
+
+    controller.observe(slow)
+    controller.observe(slow)  # the rounds already in flight saw the old limits
+    assert controller.limits() == (70, 7)
+
+    clock.now += main.WRITE_BATCH_DECREASE_COOLDOWN
+    controller.observe(0.001, timed_out=True)
+    assert controller.limits() == (49, 4)
+    assert controller.stats()["timeouts"] == 1
+
+
+def test_batch_size_warning_only_halves_the_batch():
+    controller = main.WriteBatchController(batch_size=100, max_batch_size=200, concurrency=10, max_concurrency=16)
+
+    controller.observe(0.001, oversized=True)
+
+    assert controller.limits() == (50, 10)
+
+
+def test_limits_stay_within_bounds():
+    controller = main.WriteBatchController(batch_size=199, max_batch_size=200, concurrency=16, max_concurrency=16)
+    for _ in range(5):
+        controller.observe(0.001)
+    assert controller.limits() == (200, 16)
+
+    controller = main.WriteBatchController(batch_size=1, max_batch_size=200, concurrency=1, max_concurrency=16)
+    controller.observe(0.001, timed_out=True)
+    assert controller.limits() == (1, 1)
+
+
+# TransactionDeduplicator
+
+def deduplicator(**kwargs):
+    settings = {"window_seconds": 900, "max_keys": 1000, "bloom_bits": 1 << 16, "hashes": 4, **kwargs}
+    return main.TransactionDeduplicator(**settings)
+
+
+def test_written_key_is_a_duplicate():
+    dedup = deduplicator()
+    key = uuid.uuid4()
+
+    assert not dedup.seen(key)
+    dedup.remember([key])
+
+    assert dedup.seen(key)
+    assert dedup.stats()["duplicates_dropped"] == 1
+
+
+def test_retry_during_the_first_write_is_a_duplicate():
+    dedup = deduplicator()
+    key = uuid.uuid4()
+
+    assert not dedup.seen(key)
+    assert dedup.seen(key)
+    assert dedup.stats()["in_flight_keys"] == 1
+
+
+def test_released_key_is_accepted_again():
+    dedup = deduplicator()
+    key = uuid.uuid4()
+
+    dedup.seen(key)
+    dedup.release([key])
+
+    assert not dedup.seen(key)
+
+
+def test_bloom_false_positive_never_drops_a_row():
+    dedup = deduplicator(bloom_bits=8)  # every bit set after a few keys
+    dedup.remember([uuid.uuid4() for _ in range(50)])
+
+    assert not any(dedup.seen(uuid.uuid4()) for _ in range(100))
+
+
+def test_key_expires_after_the_window(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(main.time, "monotonic", clock)
+    dedup = deduplicator(window_seconds=60)
+    key = uuid.uuid4()
+    dedup.seen(key)
+    dedup.remember([key])
+
+    clock.now += 30
+    assert dedup.seen(key)
+    clock.now += 61
+    assert not dedup.seen(key)
+
+
+def test_lru_holds_at_most_max_keys():
+    dedup = deduplicator(max_keys=10)
+    keys = [uuid.uuid4() for _ in range(20)]
+    dedup.remember(keys)
+
+    assert dedup.stats()["tracked_keys"] == 10
+    assert not dedup.seen(keys[0])
+    assert dedup.seen(keys[-1])
+
+
+# AdmissionController
+
+@pytest.fixture
+def admission(monkeypatch):
+    monkeypatch.setattr(main, "session", None)
+    monkeypatch.setattr(main, "ADMISSION_TENANT_BURST", 100.0)
+    monkeypatch.setattr(main, "ADMISSION_TENANT_ROWS_PER_SECOND", 10.0)
+    return main.AdmissionController()
+
+
+def test_tenant_over_its_rate_gets_429_with_retry_after(admission):
+    admission.admit({1: 100})
+
+    with pytest.raises(HTTPException) as rejected:
+        admission.admit({1: 20})
+
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers["Retry-After"] == "2"  # 20 rows at 10 rows/s
+    assert admission.stats()["rejected_requests"] == 1
+
+
+def test_batch_bigger_than_the_burst_needs_only_a_full_bucket(admission):
+    admission.admit({1: 500})
+
+    with pytest.raises(HTTPException):
+        admission.admit({1: 1})
+
+
+def test_rejected_batch_charges_no_tenant(admission):
+    admission.admit({2: 100})
+
+    with pytest.raises(HTTPException):
+        admission.admit({1: 50, 2: 50})
+
+    admission.admit({1: 100})
+
+
+def test_slow_writes_shed_all_ingest(admission):
+    admission.record_write_latency(main.ADMISSION_MAX_WRITE_LATENCY_MS * 10 / 1000)
+
+    with pytest.raises(HTTPException) as rejected:
+        admission.admit({1: 1})
+
+    assert rejected.value.status_code == 429
+    assert "write latency" in rejected.value.detail
+
+
+def test_latency_above_target_slows_the_tenant_refill(admission):
+    admission.record_write_latency(main.ADMISSION_WRITE_LATENCY_TARGET_MS * 2 / 1000 / 0.2)
+
+    assert admission.stats()["tenant_rows_per_second"] == pytest.approx(5.0, rel=0.01)
+
+
+def test_rows_by_tenant_counts_malformed_rows_under_default():
+    counts = main.rows_by_tenant([{"tenant": 3}, {"tenant": 3}, {"tenant": "x"}, {"field_5": 4}], main.derive_tenant)
+
+    assert counts == {3: 2, "default": 1, 4: 1}
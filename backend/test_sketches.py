@@ -0,0 +1,87 @@
+import math
+import random
+
+import main
+
+
+def test_count_min_never_underestimates_and_stays_within_its_error_bound():
+    rng = random.Random(7)
+    counts = {}
+    for _ in range(50000):
+        # A few heavy accounts over a long tail
+        key = f"ACC{rng.randrange(10)}" if rng.random() < 0.3 else f"ACC{rng.randrange(10, 20000)}"
+        counts[key] = counts.get(key, 0) + 1
+    sketch = main.CountMinTopK()
+    for key, count in counts.items():
+        sketch.add(key, count)
+
+    total = sum(counts.values())
+    bound = math.e / sketch.width * total
+    errors = [sketch.estimate(key) - count for key, count in counts.items()]
+    assert min(errors) >= 0
+    # Holds per key with probability 1 - e^-depth; allow that share of misses
+    assert sum(error > bound for error in errors) <= len(errors) * math.exp(-sketch.depth)
+
+
+def test_count_min_top_k_holds_the_heavy_hitters_after_merge():
+    left, right = main.CountMinTopK(), main.CountMinTopK()
+    for i in range(2000):
+        left.add(f"tail{i}")
+        right.add(f"tail{i + 2000}")
+    for i in range(5):
+        left.add(f"heavy{i}", 300)
+        right.add(f"heavy{i}", 200)
+
+    left.merge(right)
+
+    top = dict(left.most_common(5))
+    assert set(top) == {f"heavy{i}" for i in range(5)}
+    assert all(count >= 500 for count in top.values())
+
+
+def test_hyperloglog_is_within_three_standard_errors():
+    for cardinality in (1000, 100000):
+        sketch = main.HyperLogLog()
+        for i in range(cardinality):
+            sketch.add(f"ACC{i}")
+        standard_error = 1.04 / math.sqrt(len(sketch.registers))
+        assert abs(sketch.count() - cardinality) <= 3 * standard_error * cardinality
+
+
+def test_hyperloglog_merge_counts_the_union():
+    left, right = main.HyperLogLog(), main.HyperLogLog()
+    for i in range(30000):
+        left.add(i)
+        right.add(i + 20000)  # 10000 ids in both
+
+    left.merge(right)
+
+    assert abs(left.count() - 50000) <= 3 * 1.04 / math.sqrt(len(left.registers)) * 50000
+
+
+def test_quantile_sketch_is_within_its_relative_accuracy():
+    rng = random.Random(11)
+    values = [rng.lognormvariate(8, 1.5) for _ in range(20000)] + [0.0] * 100
+    sketch = main.QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    values.sort()
+    for q in (0.0, 0.01, 0.25, 0.5, 0.9, 0.99, 0.999, 1.0):
+        expected = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - expected) <= 0.01 * expected + 1e-9
+
+
+def test_quantile_sketch_survives_merge_and_snapshot():
+    rng = random.Random(3)
+    whole, left, right = main.QuantileSketch(), main.QuantileSketch(), main.QuantileSketch()
+    for i in range(5000):
+        value = rng.uniform(1, 50000)
+        whole.add(value)
+        (left if i % 2 else right).add(value)
+
+    left.merge(right)
+    restored = main.unpack_sketch("transaction_amounts", main.pack_sketch(left))
+
+    for q in (0.5, 0.9, 0.99):
+        assert restored.quantile(q) == whole.quantile(q)
@@ -0,0 +1,45 @@
+import random
+from collections import Counter
+
+import main
+
+
+def test_ingest_does_not_displace_the_token_range_sample():
+    reservoir = main.UserIdReservoir(5)
+    reservoir.reseed([1, 2, 3, 4, 5])
+
+    for _ in range(100):
+        reservoir.offer_many([99] * 50)  # one busy user
+
+    assert sorted(reservoir.sample(5)) == [1, 2, 3, 4, 5]
+
+
+def test_ingest_fills_free_slots_once_per_id():
+    reservoir = main.UserIdReservoir(5)
+    reservoir.reseed([1, 2])
+
+    reservoir.offer_many([9, 9, 9, 1, 8])
+
+    assert sorted(reservoir.sample(10)) == [1, 2, 8, 9]
+
+
+def test_reservoir_before_the_first_reseed_is_uniform_over_distinct_ids():
+    hits = Counter()
+    for trial in range(4000):
+        reservoir = main.UserIdReservoir(2)
+        reservoir.rng = random.Random(trial)
+        for user_id in range(10):
+            # Busier users send more rows, but each request offers its ids once
+            reservoir.offer_many([user_id] * (user_id + 1))
+        hits.update(reservoir.sample(2))
+
+    expected = 4000 * 2 / 10
+    assert all(abs(hits[user_id] - expected) < 0.15 * expected for user_id in range(10))
+
+
+def test_deterministic_sample_repeats_for_the_same_seed():
+    reservoir = main.UserIdReservoir(100)
+    reservoir.reseed(range(100))
+
+    assert reservoir.sample(10, seed=42) == reservoir.sample(10, seed=42)
+    assert len(set(reservoir.sample(10, seed=42))) == 10
@@ -56,6 +56,16 @@ const dashboards = {
       });
     },
     refresh: async () => axios.post("/refresh_alerts_by_region"),
+  },
+  alertsTrend: {
+    label: "Alert Trend (30 days)",
+    fetch: async () => {
+      const start = new Date(Date.now() - 30 * 24 * 3600 * 1000).toISOString().slice(0, 19);
+      const res = await axios.get("/dashboard/timeseries", { params: { start, resolution: "hour" } });
+      return res.data.data.map(item => ({ name: item.bucket_start.slice(0, 13).replace("T", " "), value: item.count }));
+    },
+    // Rollups are maintained as alerts are written, there is nothing to refresh
+    refresh: async () => {},
   }
 };
 
@@ -261,6 +271,16 @@ export default function Dashboards() {
             </div>
           </div>
         </div>
+      ) : selectedDashboard === "alertsTrend" ? (
+        <ResponsiveContainer width="100%" height={400}>
+          <BarChart data={chartData[selectedDashboard]}>
+            <CartesianGrid strokeDasharray="3 3" />
+            <XAxis dataKey="name" minTickGap={40} />
+            <YAxis allowDecimals={false} />
+            <Tooltip />
+            <Bar dataKey="value" name="alerts" fill="#82ca9d" />
+          </BarChart>
+        </ResponsiveContainer>
       ) : selectedDashboard === "alertsByScoreRange" ? (
         <ResponsiveContainer width="100%" height={400}>
           <BarChart data={chartData[selectedDashboard]}>
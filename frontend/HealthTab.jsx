@@ -19,6 +19,7 @@ if (typeof document !== 'undefined') {
 const HealthTab = () => {
   const [status, setStatus] = useState({ api: 'Unknown', cassandra: 'Unknown', cassandra_latency: null, websocket: 'Unknown' });
   const [lastChecked, setLastChecked] = useState(null);
+  const [nodes, setNodes] = useState([]);
   const [demoMessage, setDemoMessage] = useState('');
   const [demoError, setDemoError] = useState(false);
   const flashRef = useRef(null);
@@ -35,10 +36,16 @@ const HealthTab = () => {
         ...prev,
         api: res.ok ? `UP (${Math.round(end - start)}ms)` : 'DOWN',
         cassandra: data.cassandra_status,
-        cassandra_latency: data.cassandra_latency_ms
+        cassandra_latency: data.cassandra_latency_ms,
+        schema_agreement: data.schema_agreement
       }));
       setLastChecked(new Date().toLocaleTimeString());
 
+      const nodesRes = await fetch('/health/nodes');
+      if (nodesRes.ok) {
+        setNodes((await nodesRes.json()).nodes);
+      }
+
       if (flashRef.current) {
         flashRef.current.style.backgroundColor = '#333';
         setTimeout(() => {
@@ -168,6 +175,12 @@ const HealthTab = () => {
               {status.cassandra} {status.cassandra_latency ? `(${status.cassandra_latency}ms)` : ''}
             </td>
           </tr>
+          <tr>
+            <td>Schema Agreement</td>
+            <td style={{ color: status.schema_agreement === false ? '#ff6b6b' : '#00e676' }}>
+              {status.schema_agreement == null ? 'Unknown' : status.schema_agreement ? 'Yes' : 'No'}
+            </td>
+          </tr>
           <tr>
             <td>WebSocket</td>
             <td style={{ color: getStatusColor(status.websocket) }}>{status.websocket}</td>
@@ -175,6 +188,34 @@ const HealthTab = () => {
         </tbody>
       </table>
 
+      {/* Per-node probe results */}
+      {nodes.length > 0 && (
+        <table border="1" cellPadding="8" cellSpacing="0" style={{ width: '100%', marginTop: '1rem', backgroundColor: '#1f1f1f', borderCollapse: 'collapse', borderColor: '#333' }}>
+          <thead>
+            <tr style={{ backgroundColor: '#2c2c2c' }}>
+              <th style={{ color: '#f5f5f5' }}>Node</th>
+              <th style={{ color: '#f5f5f5' }}>DC / Rack</th>
+              <th style={{ color: '#f5f5f5' }}>Latency</th>
+              <th style={{ color: '#f5f5f5' }}>In Flight</th>
+              <th style={{ color: '#f5f5f5' }}>Status</th>
+            </tr>
+          </thead>
+          <tbody>
+            {nodes.map(node => (
+              <tr key={node.address}>
+                <td>{node.address}</td>
+                <td>{node.datacenter} / {node.rack}</td>
+                <td>{node.latency_ewma_ms != null ? `${node.latency_ewma_ms.toFixed(1)}ms` : '-'}</td>
+                <td>{node.in_flight} ({node.open_connections} conn)</td>
+                <td style={{ color: node.slow ? '#ff6b6b' : '#00e676' }}>
+                  {node.error || (node.slow ? 'SLOW' : 'UP')}
+                </td>
+              </tr>
+            ))}
+          </tbody>
+        </table>
+      )}
+
       {/* Timestamps and Demo Query Result */}
       <div style={{ marginTop: '1rem', fontSize: '0.9rem', color: '#aaa' }}>
         <p>Last checked: {lastChecked}</p>
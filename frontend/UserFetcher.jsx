@@ -3,6 +3,9 @@ import {
   LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer
 } from 'recharts';
 
+const PAGE_SIZE = 200;
+const BATCH_MAX_USERS = 500;
+
 const UserFetcher = () => {
   const [userId, setUserId] = useState('');
   const [result, setResult] = useState(null);
@@ -11,25 +14,36 @@ const UserFetcher = () => {
   const [loading, setLoading] = useState(false);
   const [detailedTiming, setDetailedTiming] = useState(null);
   const [error, setError] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [eventsPath, setEventsPath] = useState('/events');
+  const [randomUserIds, setRandomUserIds] = useState([]);
 
-  const fetchUser = async () => {
+  // Heavy users have years of events: load them a page at a time
+  const fetchEventsPage = async (path, cursor = null) => {
     if (!userId) return;
     setLoading(true);
-    setResult(null);
+    if (!cursor) {
+      setResult(null);
+      setNextCursor(null);
+    }
     setDetailedTiming(null);
     setError(null);
 
     const startTime = performance.now();
     try {
-      const res = await fetch(`/events/${userId}`);
+      const params = new URLSearchParams({ page_size: PAGE_SIZE });
+      if (cursor) params.set('cursor', cursor);
+      const res = await fetch(`${path}/${userId}?${params}`);
+      const json = await res.json();
       const endTime = performance.now();
       const totalTime = Math.round(endTime - startTime);
-      const json = await res.json();
 
       const data = json.data || json;
       const timing = json.timing || null;
 
-      setResult(data);
+      setResult(prev => (cursor && Array.isArray(prev) && Array.isArray(data) ? [...prev, ...data] : data));
+      setNextCursor(json.next_cursor || null);
+      setEventsPath(path);
       setHttpStatus(res.status);
       setDetailedTiming(timing);
 
@@ -38,8 +52,9 @@ const UserFetcher = () => {
         { time: totalTime, status: res.status }
       ]);
     } catch (err) {
+      console.error('Fetch error:', err);
       const totalTime = Math.round(performance.now() - startTime);
-      setResult(null);
+      if (!cursor) setResult(null);
       setHttpStatus(null);
       setTimingHistory(prev => [
         ...prev,
@@ -50,9 +65,12 @@ const UserFetcher = () => {
     setLoading(false);
   };
 
+  const fetchUser = () => fetchEventsPage('/events');
+
   const fetchRandomUsers = async () => {
     setLoading(true);
     setResult(null);
+    setNextCursor(null);
     setDetailedTiming(null);
     setError(null);
 
@@ -63,6 +81,7 @@ const UserFetcher = () => {
       if (json.user_ids && json.user_ids.length > 0) {
         const csvString = json.user_ids.join(',\n');
         setResult(csvString);
+        setRandomUserIds(json.user_ids);
       }
     } catch (err) {
       console.error('Failed to fetch random users', err);
@@ -72,45 +91,59 @@ const UserFetcher = () => {
     setLoading(false);
   };
 
-  const fetchAllEvents = async () => {
-    if (!userId) return;
+  const fetchAllEvents = () => fetchEventsPage('/events/full');
+
+  // One request for the whole cohort; the server streams a line per user as reads complete
+  const fetchBatchEvents = async () => {
+    const userIds = randomUserIds.slice(0, BATCH_MAX_USERS);
+    if (userIds.length === 0) return;
     setLoading(true);
     setResult(null);
+    setNextCursor(null);
     setDetailedTiming(null);
     setError(null);
 
     const startTime = performance.now();
     try {
-      const res = await fetch(`/events/full/${userId}`);
-      const rawText = await res.text();
-      const endTime = performance.now();
-      const totalTime = Math.round(endTime - startTime);
-
-      let json;
-      try {
-        json = JSON.parse(rawText);
-      } catch (parseErr) {
-        console.error('JSON parse error:', parseErr);
-        setError('Failed to parse server response.');
-        throw new Error('Failed to parse JSON response in fetchAllEvents');
+      const res = await fetch('/events/batch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ user_ids: userIds, limit: 20 })
+      });
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = '';
+      const users = [];
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        for (const line of lines.filter(Boolean)) {
+          const entry = JSON.parse(line);
+          if (entry.summary) continue;
+          users.push({
+            user_id: entry.user_id,
+            events: entry.error ? `error: ${entry.error}` : `${entry.count}${entry.truncated ? '+' : ''}`,
+            db_ms: entry.timing.db.toFixed(1)
+          });
+        }
+        setResult([...users]);
       }
 
-      const data = json.data || json;
-      const timing = json.timing || null;
-
-      setResult(data);
+      const totalTime = Math.round(performance.now() - startTime);
       setHttpStatus(res.status);
-      setDetailedTiming(timing);
-
       setTimingHistory(prev => [
         ...prev,
         { time: totalTime, status: res.status }
       ]);
     } catch (err) {
-      console.error('Fetch error:', err);
-      setError('Fetch failed.');
+      console.error('Batch fetch error:', err);
+      setError('Batch fetch failed.');
       const totalTime = Math.round(performance.now() - startTime);
-      setResult(null);
       setHttpStatus(null);
       setTimingHistory(prev => [
         ...prev,
@@ -120,8 +153,11 @@ const UserFetcher = () => {
     setLoading(false);
   };
 
+  const loadMore = () => fetchEventsPage(eventsPath, nextCursor);
+
   const clearResult = () => {
     setResult(null);
+    setNextCursor(null);
     setHttpStatus(null);
     setDetailedTiming(null);
     setError(null);
@@ -226,6 +262,17 @@ const UserFetcher = () => {
               >
                 Fetch Random User IDs
               </button>
+              {randomUserIds.length > 0 && (
+                <button
+                  onClick={fetchBatchEvents}
+                  style={{
+                    marginLeft: '1rem', padding: '0.5rem 1rem', fontSize: '1rem',
+                    backgroundColor: '#17a2b8', color: 'white', borderRadius: '4px', border: 'none', cursor: 'pointer'
+                  }}
+                >
+                  Fetch Events for {Math.min(randomUserIds.length, BATCH_MAX_USERS)} Users
+                </button>
+              )}
             </div>
 
             {/* Error Message */}
@@ -240,7 +287,7 @@ const UserFetcher = () => {
 
           {/* Results Section */}
           <div style={{ marginTop: '2rem' }}>
-            {loading ? (
+            {loading && !result ? (
               <p style={{ textAlign: 'center', color: '#bbb' }}>Loading...</p>
             ) : result ? (
               typeof result === 'string' ? (
@@ -313,6 +360,22 @@ const UserFetcher = () => {
                 No results to display.
               </p>
             )}
+
+            {/* More events for this user */}
+            {nextCursor && (
+              <div style={{ textAlign: 'center', marginBottom: '2rem' }}>
+                <button
+                  onClick={loadMore}
+                  disabled={loading}
+                  style={{
+                    padding: '0.5rem 1rem', fontSize: '1rem',
+                    backgroundColor: '#007bff', color: 'white', borderRadius: '4px', border: 'none', cursor: 'pointer'
+                  }}
+                >
+                  {loading ? 'Loading...' : `Load more (${result.length} loaded)`}
+                </button>
+              </div>
+            )}
           </div>
         </div>
 